@@ -0,0 +1,73 @@
+import argparse
+import json
+import sys
+
+"""
+Compares two benchmark result files case by case and exits with status 1 if any case regressed
+by more than the threshold: lower throughput or a higher p99 latency.
+
+Usage:
+    python -m benchmarks.compare baseline.json results.json --threshold 0.1
+"""
+
+DEFAULT_THRESHOLD = 0.1
+
+
+def case_key(result):
+    return (result["benchmark"],) + tuple(sorted(result["params"].items()))
+
+
+def relative_change(baseline, current):
+    if not baseline or current is None:
+        return None
+    return (current - baseline) / baseline
+
+
+def compare_results(baseline_results, current_results, threshold=DEFAULT_THRESHOLD):
+    baseline_by_case = {case_key(result): result for result in baseline_results}
+    comparisons = []
+    for result in current_results:
+        baseline = baseline_by_case.get(case_key(result))
+        if baseline is None:
+            continue
+        throughput_change = relative_change(baseline["throughput_msgs_per_second"], result["throughput_msgs_per_second"])
+        p99_change = relative_change(baseline["latency_ms"]["p99"], result["latency_ms"]["p99"])
+        regressed = ((throughput_change is not None and throughput_change < -threshold)
+                     or (p99_change is not None and p99_change > threshold))
+        comparisons.append({
+            "benchmark": result["benchmark"],
+            "params": result["params"],
+            "throughput_change": throughput_change,
+            "p99_change": p99_change,
+            "regressed": regressed,
+        })
+    return comparisons
+
+
+def format_change(change):
+    return "n/a" if change is None else f"{change * 100:+.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed relative regression, e.g. 0.1 for 10%%.")
+    arguments = parser.parse_args(argv)
+
+    with open(arguments.baseline) as baseline_file, open(arguments.current) as current_file:
+        baseline, current = json.load(baseline_file), json.load(current_file)
+
+    comparisons = compare_results(baseline["results"], current["results"], arguments.threshold)
+    for comparison in comparisons:
+        params = " ".join(f"{key}={value}" for key, value in comparison["params"].items())
+        marker = "REGRESSED" if comparison["regressed"] else "ok"
+        print(f"{comparison['benchmark']:<11} {params:<60} throughput {format_change(comparison['throughput_change']):>8}  "
+              f"p99 {format_change(comparison['p99_change']):>8}  {marker}")
+
+    return 1 if any(comparison["regressed"] for comparison in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
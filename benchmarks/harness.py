@@ -0,0 +1,193 @@
+import asyncio
+import math
+import resource
+import socket
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager, asynccontextmanager
+
+import fakeredis
+import redis.asyncio as redis
+
+from src.message_queue.memory_queue import InMemoryBroker
+
+"""
+Shared helpers for the benchmark scenarios: an embedded Redis stand-in, latency statistics,
+memory tracking, and an in-process WebSocket client that talks to an ASGI app directly.
+"""
+
+WEBSOCKET_CLOSE_TIMEOUT_SECONDS = 5
+
+
+class TunedTcpFakeServer(fakeredis.TcpFakeServer):
+    # The socketserver default backlog of 5 resets connections when many clients connect at
+    # once, and without TCP_NODELAY pipelined replies stall on delayed ACKs.
+    request_queue_size = 128
+
+    def get_request(self):
+        connection, address = super().get_request()
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection, address
+
+
+"""
+A fakeredis server listening on an ephemeral local port. Clients connect with redis-py over real
+sockets, so every command yields to the event loop the way it does against a real Redis; the
+in-process FakeAsyncRedis completes commands without yielding and starves blocking readers.
+"""
+class FakeRedisServer:
+    def __init__(self):
+        self.server = TunedTcpFakeServer(("127.0.0.1", 0))
+        self.url = "redis://%s:%d" % self.server.server_address
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+"""
+Where a benchmark case runs: a fresh FakeRedisServer per case, or an existing Redis when
+redis_url is given (only keys starting with key_prefix are deleted between cases). With the
+"memory" backend every case gets a fresh InMemoryBroker instead and no Redis at all. Also records
+memory usage, see MemoryTracker.
+"""
+class BenchmarkEnvironment:
+    def __init__(self, redis_url=None, trace_memory=False, backend="list", websocket_subprotocol=None):
+        self.redis_url = redis_url
+        self.backend = backend
+        self.websocket_subprotocol = websocket_subprotocol
+        self.broker = None
+        self.memory_tracker = MemoryTracker(trace=trace_memory)
+
+    def track_memory(self):
+        return self.memory_tracker.track()
+
+    @asynccontextmanager
+    async def redis(self, key_prefix):
+        if self.backend == "memory":
+            self.broker = InMemoryBroker()
+            yield None
+            return
+
+        if self.redis_url is not None:
+            redis_client = redis.from_url(self.redis_url)
+            try:
+                await delete_keys(redis_client, key_prefix)
+            finally:
+                await redis_client.aclose()
+            yield self.redis_url
+            return
+
+        fake_server = FakeRedisServer()
+        fake_server.start()
+        try:
+            yield fake_server.url
+        finally:
+            fake_server.stop()
+
+
+async def delete_keys(redis_client, key_prefix):
+    async for key in redis_client.scan_iter(match=f"{key_prefix}*"):
+        await redis_client.delete(key)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies):
+    values = sorted(latencies)
+    summary = {name: percentile(values, fraction) for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+    summary["max"] = values[-1] if values else None
+    return {name: round(value * 1000, 4) if value is not None else None for name, value in summary.items()}
+
+
+def build_result(benchmark, params, message_count, duration, latencies, memory, **extra):
+    result = {
+        "benchmark": benchmark,
+        "params": params,
+        "messages": message_count,
+        "duration_seconds": round(duration, 6),
+        "throughput_msgs_per_second": round(message_count / duration, 2) if duration > 0 else None,
+        "latency_ms": summarize_latencies(latencies),
+        "memory": memory,
+    }
+    result.update(extra)
+    return result
+
+
+"""
+Records the peak RSS of the process and, when trace is set, the peak Python heap allocated
+while the block runs. Tracing allocations slows everything down, so it is opt-in.
+"""
+class MemoryTracker:
+    def __init__(self, trace=False):
+        self.trace = trace
+
+    @contextmanager
+    def track(self):
+        usage = {}
+        if self.trace:
+            tracemalloc.start()
+        try:
+            yield usage
+        finally:
+            if self.trace:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                usage["traced_peak_bytes"] = peak
+            usage["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+"""
+Drives an ASGI WebSocket endpoint without a network: the app receives frames from an
+asyncio.Queue, and every frame it sends is passed to on_message with its arrival time.
+"""
+class AsgiWebSocketClient:
+    def __init__(self, app, path, on_message, subprotocols=()):
+        self.app = app
+        self.path = path
+        self.on_message = on_message
+        self.subprotocols = list(subprotocols)
+        self._incoming = asyncio.Queue()
+        self._accepted = asyncio.Event()
+        self._task = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [],
+            "client": ("127.0.0.1", 0),
+            "server": ("127.0.0.1", 80),
+            "subprotocols": self.subprotocols,
+        }
+        self._incoming.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(scope, self._incoming.get, self._send))
+        await self._accepted.wait()
+
+    async def close(self):
+        self._incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        try:
+            await asyncio.wait_for(self._task, WEBSOCKET_CLOSE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+
+    async def _send(self, message):
+        if message["type"] == "websocket.accept":
+            self._accepted.set()
+        elif message["type"] == "websocket.send":
+            self.on_message(message.get("text") or message.get("bytes"), time.perf_counter())
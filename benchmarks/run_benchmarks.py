@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import sys
+
+from benchmarks.harness import BenchmarkEnvironment
+from benchmarks.scenarios import run_publish, run_consume, run_end_to_end, run_fan_out
+from src.utils.config import MESSAGE_MAX_CONTENT_LENGTH
+from src.websocket.websocket_handler import SUBPROTOCOLS, WebSocketHandler
+from src.utils.logger import LOGGER_NAME
+
+"""
+Runs the benchmark sweep against an embedded fakeredis server (or --redis-url) and writes the results to JSON.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --quick --only publish,consume
+
+Compare two runs with:
+    python -m benchmarks.compare baseline.json results.json
+"""
+
+DEFAULT_OUTPUT_FILE = "benchmark_results.json"
+DEFAULT_MESSAGE_COUNT = 2000
+DEFAULT_MESSAGE_SIZES = [64, 512, 4096]
+DEFAULT_CONCURRENCY = [1, 16, 64]
+DEFAULT_BATCH_SIZES = [1, 10, 100]
+DEFAULT_SOCKETS = [1, 10, 100]
+
+QUICK_MESSAGE_COUNT = 500
+QUICK_MESSAGE_SIZES = [64]
+QUICK_CONCURRENCY = [1, 16]
+QUICK_BATCH_SIZES = [1, 100]
+QUICK_SOCKETS = [1, 10]
+
+BENCHMARKS = ("publish", "consume", "end_to_end", "fan_out")
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and latency benchmarks for the message queue.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE, help="JSON file to write the results to.")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma-separated benchmarks to run.")
+    parser.add_argument("--quick", action="store_true", help="Run a small sweep, e.g. as a smoke test.")
+    parser.add_argument("--messages", type=int, help="Messages per case.")
+    parser.add_argument("--message-sizes", type=parse_list, help="Comma-separated message sizes in bytes.")
+    parser.add_argument("--concurrency", type=parse_list, help="Comma-separated publisher/consumer counts.")
+    parser.add_argument("--batch-sizes", type=parse_list, help="Comma-separated batch sizes.")
+    parser.add_argument("--sockets", type=parse_list, help="Comma-separated WebSocket counts for fan_out.")
+    parser.add_argument("--redis-url", help="Run against this Redis instead of an embedded fakeredis server.")
+    parser.add_argument("--backend", choices=("list", "memory"), default="list",
+                        help="Queue backend: Redis lists, or the in-process queue to measure the services without Redis.")
+    parser.add_argument("--ws-subprotocol", choices=sorted(SUBPROTOCOLS),
+                        help="WebSocket subprotocol the benchmark clients request, e.g. mq.json-array to coalesce messages into frames.")
+    parser.add_argument("--trace-memory", action="store_true", help="Record the peak Python heap per case (slower).")
+    arguments = parser.parse_args(argv)
+
+    arguments.only = [name for name in arguments.only.split(",") if name]
+    unknown = set(arguments.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    if arguments.ws_subprotocol and WebSocketHandler.select_subprotocol([arguments.ws_subprotocol]) is None:
+        parser.error(f"{arguments.ws_subprotocol} is not available (is msgpack installed?)")
+
+    arguments.messages = arguments.messages or (QUICK_MESSAGE_COUNT if arguments.quick else DEFAULT_MESSAGE_COUNT)
+    arguments.message_sizes = arguments.message_sizes or (QUICK_MESSAGE_SIZES if arguments.quick else DEFAULT_MESSAGE_SIZES)
+    arguments.concurrency = arguments.concurrency or (QUICK_CONCURRENCY if arguments.quick else DEFAULT_CONCURRENCY)
+    arguments.batch_sizes = arguments.batch_sizes or (QUICK_BATCH_SIZES if arguments.quick else DEFAULT_BATCH_SIZES)
+    arguments.sockets = arguments.sockets or (QUICK_SOCKETS if arguments.quick else DEFAULT_SOCKETS)
+    return arguments
+
+
+def build_cases(arguments):
+    # Service A caps message content, so larger sizes collapse into one case for the HTTP path.
+    http_message_sizes = sorted({min(size, MESSAGE_MAX_CONTENT_LENGTH) for size in arguments.message_sizes})
+    cases = []
+    for size in arguments.message_sizes:
+        for concurrency in arguments.concurrency:
+            for batch_size in arguments.batch_sizes:
+                cases.append(("publish", run_publish, (size, concurrency, batch_size)))
+                cases.append(("consume", run_consume, (size, concurrency, batch_size)))
+    for size in http_message_sizes:
+        for concurrency in arguments.concurrency:
+            for batch_size in arguments.batch_sizes:
+                cases.append(("end_to_end", run_end_to_end, (size, concurrency, batch_size)))
+    for size in arguments.message_sizes:
+        for sockets in arguments.sockets:
+            cases.append(("fan_out", run_fan_out, (size, sockets, max(arguments.batch_sizes))))
+    return [case for case in cases if case[0] in arguments.only]
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def format_summary(result):
+    params = " ".join(f"{key}={value}" for key, value in result["params"].items())
+    latency = result["latency_ms"]
+    return (f"{result['benchmark']:<11} {params:<60} "
+            f"{result['throughput_msgs_per_second'] or 0:>12.1f} msg/s  "
+            f"p50 {latency['p50'] or 0:.3f} ms  p99 {latency['p99'] or 0:.3f} ms")
+
+
+async def run_benchmarks(arguments):
+    environment = BenchmarkEnvironment(redis_url=arguments.redis_url, trace_memory=arguments.trace_memory, backend=arguments.backend,
+                                       websocket_subprotocol=arguments.ws_subprotocol)
+    results = []
+    for _, run, case_arguments in build_cases(arguments):
+        result = await run(environment, *case_arguments, arguments.messages)
+        print(format_summary(result), flush=True)
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    # Per-message and per-connection logging would dominate the measurements.
+    logging.getLogger(LOGGER_NAME).setLevel(logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    results = asyncio.run(run_benchmarks(arguments))
+    report = {
+        "metadata": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_commit": get_git_commit(),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "redis": arguments.redis_url or "fakeredis",
+            "backend": arguments.backend,
+            "ws_subprotocol": arguments.ws_subprotocol,
+            "messages_per_case": arguments.messages,
+            "trace_memory": arguments.trace_memory,
+        },
+        "results": results,
+    }
+    with open(arguments.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Wrote {len(results)} results to {arguments.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
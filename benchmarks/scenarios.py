@@ -0,0 +1,254 @@
+import asyncio
+import json
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+import httpx
+
+from benchmarks.harness import AsgiWebSocketClient, build_result
+from src.message_queue.codec import message_codec, msgpack
+from src.message_queue.redis_queue import RedisQueue
+from src.message_queue.memory_queue import InMemoryQueue
+from src.utils.config import MESSAGE_MAX_CONTENT_LENGTH, MESSAGE_FORWARD_RAW
+
+"""
+Benchmark scenarios. Each one gets a fresh Redis from the BenchmarkEnvironment, runs message_count
+messages through the code under test and returns a result dictionary (see harness.build_result).
+
+- publish: RedisQueue.publish / publish_many from concurrent publishers.
+- consume: RedisQueue.subscribe_batch from concurrent consumers draining a pre-filled queue.
+- end_to_end: HTTP POST to service A -> queue -> service B hub -> WebSocket.
+- fan_out: messages published straight to the queue and broadcast by service B to N WebSockets.
+
+With the "memory" backend the same scenarios run on InMemoryQueue, which measures the service logic
+without Redis and the network.
+"""
+
+BENCHMARK_QUEUE_NAME = "benchmark_queue"
+BENCHMARK_MESSAGE_TYPE = "benchmark"
+PREFILL_CHUNK_SIZE = 1000
+CONSUME_SUBSCRIBE_TIMEOUT_SECONDS = 1
+DELIVERY_TIMEOUT_SECONDS = 120
+
+
+def make_message(content_size, sent_time=0.0):
+    # The send time leads the content so the receiving side can compute the latency.
+    prefix = f"{sent_time:.9f} "
+    return {"type": BENCHMARK_MESSAGE_TYPE, "content": prefix + "x" * max(0, content_size - len(prefix))}
+
+
+def read_sent_time(message):
+    return float(message["content"].split(" ", 1)[0])
+
+
+def decode_frame(frame, subprotocol):
+    # Returns the messages carried by one WebSocket frame (see websocket_handler.SUBPROTOCOLS).
+    if subprotocol == "mq.msgpack":
+        return msgpack.unpackb(frame)
+    if subprotocol == "mq.json-array":
+        return json.loads(frame)
+    if subprotocol == "mq.ndjson":
+        return [json.loads(line) for line in frame.split("\n")]
+    return [json.loads(frame)]
+
+
+def split_into_batches(message_count, batch_size):
+    full_batches, remainder = divmod(message_count, batch_size)
+    return [batch_size] * full_batches + ([remainder] if remainder else [])
+
+
+async def run_workers(concurrency, work_items, handle):
+    work_iterator = iter(work_items)
+
+    async def worker():
+        for item in work_iterator:
+            await handle(item)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+@asynccontextmanager
+async def connected_queue(environment, redis_url, max_queue_size):
+    # Connecting through RedisQueue.connect uses the same connection pools as the services.
+    if environment.backend == "memory":
+        queue = InMemoryQueue(BENCHMARK_QUEUE_NAME, max_queue_size=max_queue_size, broker=environment.broker)
+    else:
+        queue = RedisQueue(BENCHMARK_QUEUE_NAME, connection_url=redis_url, max_queue_size=max_queue_size)
+    if not await queue.connect():
+        raise RuntimeError(f"Failed to connect to {redis_url}")
+    try:
+        yield queue
+    finally:
+        await queue.disconnect()
+
+
+async def open_connections(queue, concurrency):
+    # Opens the pooled connections up front so that connection setup is not part of the measurement.
+    if queue.backend_name == "memory":
+        return
+    await asyncio.gather(*(queue.redis_client.ping() for _ in range(concurrency)))
+    await asyncio.gather(*(queue.get_blocking_client().ping() for _ in range(min(concurrency, queue.blocking_max_connections))))
+
+
+async def run_publish(environment, message_size, concurrency, batch_size, message_count):
+    async with environment.redis(BENCHMARK_QUEUE_NAME) as redis_url, connected_queue(environment, redis_url, message_count) as queue:
+        return await measure_publish(queue, message_size, concurrency, batch_size, message_count, environment)
+
+
+async def measure_publish(queue, message_size, concurrency, batch_size, message_count, environment):
+    serialized_message = message_codec.encode(make_message(message_size))
+    latencies = []
+    failures = 0
+
+    async def publish(count):
+        nonlocal failures
+        start_time = time.perf_counter()
+        if count == 1:
+            published = await queue.publish(serialized_message)
+        else:
+            published = await queue.publish_many([serialized_message] * count)
+        latencies.append(time.perf_counter() - start_time)
+        failures += 0 if published else count
+
+    await open_connections(queue, concurrency)
+    with environment.track_memory() as memory:
+        start_time = time.perf_counter()
+        await run_workers(concurrency, split_into_batches(message_count, batch_size), publish)
+        duration = time.perf_counter() - start_time
+
+    params = {"message_size": message_size, "concurrency": concurrency, "batch_size": batch_size}
+    return build_result("publish", params, message_count, duration, latencies, dict(memory), failures=failures)
+
+
+async def run_consume(environment, message_size, concurrency, batch_size, message_count):
+    async with environment.redis(BENCHMARK_QUEUE_NAME) as redis_url, connected_queue(environment, redis_url, message_count) as queue:
+        return await measure_consume(queue, message_size, concurrency, batch_size, message_count, environment)
+
+
+async def measure_consume(queue, message_size, concurrency, batch_size, message_count, environment):
+    serialized_message = message_codec.encode(make_message(message_size))
+    for count in split_into_batches(message_count, PREFILL_CHUNK_SIZE):
+        await queue.publish_many([serialized_message] * count)
+
+    latencies = []
+    consumed = 0
+    drained = asyncio.Event()
+
+    async def consume():
+        nonlocal consumed
+        while not drained.is_set():
+            start_time = time.perf_counter()
+            messages = await queue.subscribe_batch(batch_size, CONSUME_SUBSCRIBE_TIMEOUT_SECONDS, raw=MESSAGE_FORWARD_RAW)
+            if messages:
+                latencies.append(time.perf_counter() - start_time)
+                consumed += len(messages)
+            if consumed >= message_count:
+                drained.set()
+
+    await open_connections(queue, concurrency)
+    with environment.track_memory() as memory:
+        start_time = time.perf_counter()
+        consumers = [asyncio.create_task(consume()) for _ in range(concurrency)]
+        await drained.wait()
+        duration = time.perf_counter() - start_time
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+
+    params = {"message_size": message_size, "concurrency": concurrency, "batch_size": batch_size,
+              "raw": MESSAGE_FORWARD_RAW}
+    return build_result("consume", params, consumed, duration, latencies, dict(memory))
+
+
+@contextmanager
+def patched_services(publisher_queue, subscriber_queue, client_queue_size):
+    # The service apps use module-level singletons; swap them for ones bound to the fake Redis.
+    import src.service_a.app as service_a
+    import src.service_b.app as service_b
+    from src.service_a.message_publisher import MessagePublisher
+    from src.service_b.message_subscriber import MessageSubscriber
+    from src.service_b.message_hub import MessageHub
+
+    originals = (service_a.message_publisher, service_b.message_subscriber, service_b.message_hub)
+    service_a.message_publisher = MessagePublisher(publisher_queue, auto_batch=False)
+    service_b.message_subscriber = MessageSubscriber(subscriber_queue)
+    service_b.message_hub = MessageHub(service_b.message_subscriber, delivery_mode="broadcast",
+                                       client_queue_size=client_queue_size)
+    try:
+        yield service_a, service_b
+    finally:
+        service_a.message_publisher, service_b.message_subscriber, service_b.message_hub = originals
+
+
+async def run_delivery(environment, benchmark, message_size, concurrency, batch_size, sockets, message_count, via_http):
+    async with (environment.redis(BENCHMARK_QUEUE_NAME) as redis_url,
+                connected_queue(environment, redis_url, message_count) as publisher_queue,
+                connected_queue(environment, redis_url, message_count) as subscriber_queue):
+        return await measure_delivery(publisher_queue, subscriber_queue, benchmark, message_size, concurrency,
+                                      batch_size, sockets, message_count, environment, via_http)
+
+
+async def measure_delivery(publisher_queue, subscriber_queue, benchmark, message_size, concurrency, batch_size,
+                           sockets, message_count, environment, via_http):
+    content_size = min(message_size, MESSAGE_MAX_CONTENT_LENGTH)
+    expected = message_count * sockets
+    latencies = []
+    delivered = asyncio.Event()
+    last_delivery_time = None
+
+    def on_message(frame, received_time):
+        nonlocal last_delivery_time
+        for message in decode_frame(frame, environment.websocket_subprotocol):
+            latencies.append(received_time - read_sent_time(message))
+        last_delivery_time = received_time
+        if len(latencies) >= expected:
+            delivered.set()
+
+    with patched_services(publisher_queue, subscriber_queue, client_queue_size=message_count) as (service_a, service_b):
+        await service_b.message_hub.start()
+        subprotocols = [environment.websocket_subprotocol] if environment.websocket_subprotocol else []
+        clients = [AsgiWebSocketClient(service_b.app, "/ws", on_message, subprotocols) for _ in range(sockets)]
+        for client in clients:
+            await client.connect()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=service_a.app), base_url="http://service-a") as http_client:
+
+            async def send_over_http(count):
+                messages = [make_message(content_size, time.perf_counter()) for _ in range(count)]
+                if count == 1:
+                    response = await http_client.post("/messages", json=messages[0])
+                else:
+                    response = await http_client.post("/messages/batch", json=messages)
+                response.raise_for_status()
+
+            async def send_to_queue(count):
+                messages = [make_message(content_size, time.perf_counter()) for _ in range(count)]
+                serialized_messages = messages if publisher_queue.stores_objects else [message_codec.encode(message) for message in messages]
+                await publisher_queue.publish_many(serialized_messages)
+
+            with environment.track_memory() as memory:
+                start_time = time.perf_counter()
+                await run_workers(concurrency, split_into_batches(message_count, batch_size),
+                                  send_over_http if via_http else send_to_queue)
+                try:
+                    await asyncio.wait_for(delivered.wait(), DELIVERY_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                duration = (last_delivery_time or time.perf_counter()) - start_time
+
+        dropped = sum(client.dropped_messages for client in service_b.message_hub.clients)
+        for client in clients:
+            await client.close()
+        await service_b.message_hub.stop()
+
+    params = {"message_size": content_size, "concurrency": concurrency, "batch_size": batch_size, "sockets": sockets}
+    return build_result(benchmark, params, len(latencies), duration, latencies, dict(memory),
+                        expected_deliveries=expected, lost=expected - len(latencies), dropped=dropped)
+
+
+async def run_end_to_end(environment, message_size, concurrency, batch_size, message_count):
+    return await run_delivery(environment, "end_to_end", message_size, concurrency, batch_size, 1, message_count, via_http=True)
+
+
+async def run_fan_out(environment, message_size, sockets, batch_size, message_count):
+    return await run_delivery(environment, "fan_out", message_size, 1, batch_size, sockets, message_count, via_http=False)
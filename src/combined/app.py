@@ -0,0 +1,31 @@
+from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+import src.service_a.app as service_a
+import src.service_b.app as service_b
+from src.utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+"""
+Service A and service B in one process, e.g. with REDIS_QUEUE_BACKEND = "memory" so that messages go
+from the REST endpoints to the WebSockets without Redis and without serialization:
+
+    uvicorn src.combined.app:app --port 8002
+
+Both services keep their routes; GET /metrics is served once since they share the metrics registry.
+"""
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with service_a.lifespan(service_a.app), service_b.lifespan(service_b.app):
+        logger.info("[combined:Lifespan] Service A and service B started")
+        yield
+
+
+app = FastAPI(lifespan=lifespan)
+
+paths = {route.path for route in app.router.routes}
+for route in service_a.app.router.routes + service_b.app.router.routes:
+    if route.path not in paths:
+        app.router.routes.append(route)
+        paths.add(route.path)
@@ -0,0 +1,88 @@
+import time
+from abc import ABC, abstractmethod
+
+from src.message_queue.expiry import is_expired
+from src.message_queue import queue_metrics
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.config import REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, REDIS_MESSAGE_DRAIN_BATCH_SIZE
+
+logger = get_logger(__name__)
+
+"""
+The interface shared by every queue backend (see queue_factory.create_queue).
+
+- publish / publish_many return True once the messages are stored and False when the backend stays
+  unavailable; they raise QueueFullError when the overflow policy rejects them (see overflow.py).
+  Messages given an idempotency key that was already published within the backend's
+  idempotency_window are dropped (see idempotency.py). partition_keys place messages on the
+  partitions of a PartitionedQueue; the other backends ignore them.
+- subscribe returns one decoded message or None, subscribe_batch a list that is empty on timeout.
+  With raw=True messages are returned as stored, if the backend allows it.
+- ack confirms delivered messages; backends without redelivery simply return True.
+- Messages whose expires_at has passed (see expiry.py) are never returned by subscribe or
+  subscribe_batch; they are counted in expired_messages instead. sweep_expired evicts them from
+  the queue without consuming anything else.
+
+Backends that set stores_objects keep published objects as they are, so callers may publish
+dictionaries instead of serialized payloads.
+"""
+class MessageQueue(ABC):
+    backend_name = None
+    stores_objects = False
+    expired_messages = 0
+
+    @abstractmethod
+    async def connect(self):
+        pass
+
+    @abstractmethod
+    async def disconnect(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        pass
+
+    @abstractmethod
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, checkpoint=None, idempotency_keys=None, partition_keys=None):
+        pass
+
+    @abstractmethod
+    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, message_types=None):
+        pass
+
+    @abstractmethod
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        pass
+
+    @abstractmethod
+    async def ack(self, messages):
+        pass
+
+    @abstractmethod
+    async def get_queue_size(self):
+        pass
+
+    """
+    Returns the number of expired messages removed from the queue. Backends that cannot remove
+    messages from the middle of the queue leave them to be dropped when they are consumed.
+    """
+    async def sweep_expired(self):
+        return 0
+
+    """
+    Returns the messages that have not expired, in order, and counts the others. Serialized payloads
+    are checked without being decoded where possible (see get_expires_at).
+    """
+    def drop_expired(self, messages):
+        now = time.time()
+        fresh = [message for message in messages if not is_expired(message, now, self.codec)]
+        if len(fresh) < len(messages):
+            self.record_expired(len(messages) - len(fresh))
+        return fresh
+
+    def record_expired(self, count):
+        self.expired_messages += count
+        queue_metrics.expired_messages.inc(count, backend=self.backend_name)
+        logger.info("[MessageQueue:record_expired] Dropped %d expired messages (%d in total). queue name: %s",
+                    count, self.expired_messages, self.queue_name, extra=SAMPLED)
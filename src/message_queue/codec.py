@@ -0,0 +1,151 @@
+import json
+import zlib
+
+from src.utils.config import MESSAGE_CODEC_FORMAT, MESSAGE_CODEC_COMPRESSION, MESSAGE_CODEC_COMPRESSION_THRESHOLD_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+"""
+Payload layout
+
+Uncompressed JSON (from "json" or "orjson") is stored as plain JSON text with no header, exactly as
+messages were stored before the codec existed. Such payloads can be forwarded to a WebSocket as they are.
+
+Every other payload starts with a 3-byte header: HEADER_MAGIC, a format tag and a compression tag.
+JSON text can never start with HEADER_MAGIC, so a queue holding both kinds of payload decodes correctly.
+"""
+HEADER_MAGIC = b"\x00"
+HEADER_LENGTH = 3
+
+FORMAT_TAGS = {"json": b"j", "orjson": b"j", "msgpack": b"m"}
+COMPRESSION_TAGS = {"none": b"-", "zlib": b"g", "zstd": b"z", "lz4": b"l"}
+
+class MessageCodec:
+    def __init__(self, format=MESSAGE_CODEC_FORMAT,
+                 compression=MESSAGE_CODEC_COMPRESSION,
+                 compression_threshold=MESSAGE_CODEC_COMPRESSION_THRESHOLD_BYTES):
+        if format not in FORMAT_TAGS:
+            raise ValueError(f"Unknown message format: {format}")
+        if compression not in COMPRESSION_TAGS:
+            raise ValueError(f"Unknown message compression: {compression}")
+        if format == "orjson" and orjson is None:
+            raise ValueError("orjson is not installed")
+        if format == "msgpack" and msgpack is None:
+            raise ValueError("msgpack is not installed")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("zstandard is not installed")
+        if compression == "lz4" and lz4_frame is None:
+            raise ValueError("lz4 is not installed")
+
+        self.format = format
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._zstd_compressor = zstandard.ZstdCompressor() if compression == "zstd" else None
+
+    def encode(self, message):
+        if self.format == "json":
+            body = json.dumps(message)
+        elif self.format == "orjson":
+            body = orjson.dumps(message)
+        else:
+            body = msgpack.packb(message)
+
+        compressed = self.compression != "none" and len(body) >= self.compression_threshold
+        if FORMAT_TAGS[self.format] == b"j" and not compressed:
+            return body
+
+        if isinstance(body, str):
+            body = body.encode()
+        compression = self.compression if compressed else "none"
+        return HEADER_MAGIC + FORMAT_TAGS[self.format] + COMPRESSION_TAGS[compression] + self.compress(body, compression)
+
+    def decode(self, payload):
+        if not is_tagged(payload):
+            return loads_json(payload)
+
+        format_tag, compression_tag = payload[1:2], payload[2:3]
+        body = decompress(payload[HEADER_LENGTH:], compression_tag)
+        if format_tag == FORMAT_TAGS["msgpack"]:
+            if msgpack is None:
+                raise ValueError("msgpack is not installed")
+            return msgpack.unpackb(body)
+        return loads_json(body)
+
+    def compress(self, body, compression):
+        if compression == "zlib":
+            return zlib.compress(body)
+        elif compression == "zstd":
+            return self._zstd_compressor.compress(body)
+        elif compression == "lz4":
+            return lz4_frame.compress(body)
+        return body
+
+
+def is_tagged(payload):
+    return isinstance(payload, (bytes, bytearray)) and payload[:1] == HEADER_MAGIC
+
+
+def decompress(body, compression_tag):
+    if compression_tag == COMPRESSION_TAGS["zlib"]:
+        return zlib.decompress(body)
+    elif compression_tag == COMPRESSION_TAGS["zstd"]:
+        if zstandard is None:
+            raise ValueError("zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    elif compression_tag == COMPRESSION_TAGS["lz4"]:
+        if lz4_frame is None:
+            raise ValueError("lz4 is not installed")
+        return lz4_frame.decompress(body)
+    return body
+
+
+def loads_json(payload):
+    return orjson.loads(payload) if orjson else json.loads(payload)
+
+
+def dumps_json(message):
+    return orjson.dumps(message).decode() if orjson else json.dumps(message)
+
+
+"""
+Returns the JSON text to send to a WebSocket client for either a decoded message or a raw payload.
+Untagged payloads are already JSON and are passed through without a decode/encode round trip.
+"""
+def to_json_text(message):
+    if isinstance(message, str):
+        return message
+    if isinstance(message, (bytes, bytearray)):
+        if not is_tagged(message):
+            return message.decode()
+        return dumps_json(message_codec.decode(message))
+    return dumps_json(message)
+
+
+message_codec = MessageCodec()
+
+
+"""
+Returns the message object for either a decoded message or a raw payload.
+"""
+def to_object(message):
+    if isinstance(message, (str, bytes, bytearray)):
+        return message_codec.decode(message)
+    return message
@@ -0,0 +1,85 @@
+import re
+
+from src.message_queue.codec import message_codec, is_tagged
+
+EXPIRES_AT_FIELD = "expires_at"
+ENQUEUED_AT_FIELD = "enqueued_at"
+TRACE_FIELD = "trace"
+
+"""
+Service A writes expires_at as the first field of every message that has one (see build_envelope),
+so for plain JSON payloads it is read with an anchored match on the first bytes instead of a decode.
+Payloads that carry the field elsewhere, or are tagged by the codec, are decoded.
+"""
+LEADING_EXPIRES_AT = re.compile(r'\{"expires_at":\s*(-?\d+(?:\.\d+)?)')
+LEADING_EXPIRES_AT_BYTES = re.compile(LEADING_EXPIRES_AT.pattern.encode())
+
+"""
+Removes the expired messages among up to ARGV[2] entries of the list KEYS[1], starting at index
+ARGV[1]. Only plain JSON payloads that start with expires_at are recognized; anything else is kept.
+Expired entries are overwritten with a tombstone, which no payload can equal (JSON never starts with
+a NUL byte and tagged payloads continue with a format tag), and removed with one LREM.
+ARGV[3] is the current time in seconds since the epoch. Returns {scanned, removed}.
+"""
+SWEEP_EXPIRED_SCRIPT = """
+local start = tonumber(ARGV[1])
+local count = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tombstone = '\\0expired'
+local items = redis.call('LRANGE', KEYS[1], start, start + count - 1)
+local removed = 0
+for i, item in ipairs(items) do
+    local expires_at = tonumber(string.match(item, '^{"expires_at":%s*(%-?%d+%.?%d*)'))
+    if expires_at and expires_at <= now then
+        redis.call('LSET', KEYS[1], start + i - 1, tombstone)
+        removed = removed + 1
+    end
+end
+if removed > 0 then
+    redis.call('LREM', KEYS[1], 0, tombstone)
+end
+return {#items, removed}
+"""
+
+
+"""
+Returns the message with the envelope fields in front: expires_at, the earlier of now + ttl and
+deadline (omitted when neither is set), enqueued_at, and the trace context of a sampled message
+(see Tracer). Times are seconds since the epoch.
+"""
+def build_envelope(message, now, ttl=None, deadline=None, trace=None):
+    expiries = [expiry for expiry in (now + ttl if ttl else None, deadline) if expiry]
+    envelope = {EXPIRES_AT_FIELD: round(min(expiries), 3)} if expiries else {}
+    envelope[ENQUEUED_AT_FIELD] = round(now, 3)
+    if trace:
+        envelope[TRACE_FIELD] = trace
+    envelope.update(message)
+    return envelope
+
+
+"""
+Returns the expiry time of a message or serialized payload, or None when it never expires.
+"""
+def get_expires_at(message, codec=message_codec):
+    if isinstance(message, (str, bytes, bytearray)):
+        if not is_tagged(message):
+            if isinstance(message, str):
+                pattern, field = LEADING_EXPIRES_AT, EXPIRES_AT_FIELD
+            else:
+                pattern, field = LEADING_EXPIRES_AT_BYTES, EXPIRES_AT_FIELD.encode()
+            match = pattern.match(message)
+            if match:
+                return float(match.group(1))
+            if field not in message:
+                return None
+        try:
+            message = codec.decode(message)
+        except Exception:
+            return None
+    expires_at = message.get(EXPIRES_AT_FIELD) if isinstance(message, dict) else None
+    return expires_at if isinstance(expires_at, (int, float)) else None
+
+
+def is_expired(message, now, codec=message_codec):
+    expires_at = get_expires_at(message, codec)
+    return expires_at is not None and expires_at <= now
@@ -0,0 +1,125 @@
+def idempotency_key_name(queue_name, idempotency_key):
+    return f"{queue_name}:idempotency:{idempotency_key}"
+
+
+"""
+Pushes a batch while dropping every message whose idempotency key was seen within the window, so a
+retried publish (by the queue after an ambiguous failure, or by a client) is stored only once.
+
+KEYS are the lists, then one idempotency key per keyed message in order, then optionally the
+checkpoint key. ARGV is max_size, the checkpoint value ("" for none), "1" to reject the batch when
+a list has no room (otherwise lists are trimmed to max_size), the window in seconds and the number
+of lists, followed for every list by its message count and, per message, "1" or "0" for whether it
+has an idempotency key and the message itself.
+
+Duplicates are dropped, the room is checked, the messages are pushed and trimmed and the keys are
+recorded in one atomic step. Returns -1 when the batch was rejected for lack of room, otherwise
+{pushed, trimmed}.
+"""
+IDEMPOTENT_PUSH_SCRIPT = """
+local max_size = tonumber(ARGV[1])
+local checkpoint = ARGV[2]
+local reject = ARGV[3] == '1'
+local window = tonumber(ARGV[4])
+local list_count = tonumber(ARGV[5])
+local key_index = list_count
+local index = 6
+local batches = {}
+local new_keys = {}
+local seen = {}
+for i = 1, list_count do
+    local count = tonumber(ARGV[index])
+    index = index + 1
+    local messages = {}
+    for j = 1, count do
+        local duplicate = false
+        if ARGV[index] == '1' then
+            key_index = key_index + 1
+            local key = KEYS[key_index]
+            duplicate = seen[key] or redis.call('EXISTS', key) == 1
+            if not duplicate then
+                seen[key] = true
+                new_keys[#new_keys + 1] = key
+            end
+        end
+        if not duplicate then
+            messages[#messages + 1] = ARGV[index + 1]
+        end
+        index = index + 2
+    end
+    batches[i] = messages
+end
+if reject then
+    for i = 1, list_count do
+        if #batches[i] > 0 and redis.call('LLEN', KEYS[i]) + #batches[i] > max_size then
+            return -1
+        end
+    end
+end
+local pushed, trimmed = 0, 0
+for i = 1, list_count do
+    local messages = batches[i]
+    local first, length = 1, 0
+    -- unpack() is limited by the Lua stack size, so long batches are pushed in chunks.
+    while first <= #messages do
+        local last = math.min(first + 999, #messages)
+        length = redis.call('RPUSH', KEYS[i], unpack(messages, first, last))
+        first = last + 1
+    end
+    pushed = pushed + #messages
+    if length > max_size then
+        redis.call('LTRIM', KEYS[i], -max_size, -1)
+        trimmed = trimmed + length - max_size
+    end
+end
+for _, key in ipairs(new_keys) do
+    redis.call('SET', key, '1', 'EX', window)
+end
+if checkpoint ~= '' then
+    redis.call('SET', KEYS[#KEYS], checkpoint)
+end
+return {pushed, trimmed}
+"""
+
+
+"""
+The IDEMPOTENT_PUSH_SCRIPT of the stream backend. KEYS and ARGV have the same layout, without the
+reject flag: ARGV is max_size, the checkpoint value ("" for none), the window in seconds and the
+number of streams, followed by the messages of every stream. Messages are appended with XADD and
+the streams trimmed approximately to max_size. Returns the number of messages appended.
+"""
+IDEMPOTENT_XADD_SCRIPT = """
+local max_size = ARGV[1]
+local checkpoint = ARGV[2]
+local window = tonumber(ARGV[3])
+local stream_count = tonumber(ARGV[4])
+local key_index = stream_count
+local index = 5
+local seen = {}
+local pushed = 0
+for i = 1, stream_count do
+    local count = tonumber(ARGV[index])
+    index = index + 1
+    for j = 1, count do
+        local duplicate = false
+        if ARGV[index] == '1' then
+            key_index = key_index + 1
+            local key = KEYS[key_index]
+            duplicate = seen[key] or redis.call('EXISTS', key) == 1
+            if not duplicate then
+                seen[key] = true
+                redis.call('SET', key, '1', 'EX', window)
+            end
+        end
+        if not duplicate then
+            redis.call('XADD', KEYS[i], 'MAXLEN', '~', max_size, '*', 'data', ARGV[index + 1])
+            pushed = pushed + 1
+        end
+        index = index + 2
+    end
+end
+if checkpoint ~= '' then
+    redis.call('SET', KEYS[#KEYS], checkpoint)
+end
+return pushed
+"""
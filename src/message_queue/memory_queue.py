@@ -0,0 +1,272 @@
+import asyncio
+import time
+from collections import deque
+
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.codec import message_codec
+from src.message_queue.expiry import is_expired
+from src.message_queue.idempotency import idempotency_key_name
+from src.message_queue.type_routing import TypeRouter
+from src.message_queue.priority_lanes import PriorityLanes
+from src.message_queue.overflow import QueueFullError, validate_overflow_policy, push_with_overflow_policy
+from src.message_queue import queue_metrics
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.config import REDIS_MESSAGE_QUEUE_MAX_SIZE, REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, REDIS_MESSAGE_DRAIN_BATCH_SIZE, REDIS_QUEUE_OVERFLOW_POLICY, REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS, MESSAGE_IDEMPOTENCY_WINDOW_SECONDS
+
+logger = get_logger(__name__)
+
+"""
+The lanes of every InMemoryQueue in the process, so a publisher and a subscriber created separately
+(e.g. service A and service B running in one process) share their messages.
+
+Every key maps to a deque, and consumers blocked on a set of keys wait on a future registered for
+each of them; every pushed message wakes the longest waiting consumer of that key. The broker also answers the
+few Redis commands the shared helpers use (SMEMBERS for TypeRouter, GET for checkpoints), so it can
+stand in for the Redis client, and keeps the idempotency keys published within their window.
+"""
+class InMemoryBroker:
+    def __init__(self):
+        self.lanes = {}
+        self.sets = {}
+        self.values = {}
+        self._waiters = {}
+        # name -> expiry time, in insertion order, so expired keys are purged from the front.
+        self._idempotency_keys = {}
+
+    def push(self, key, messages):
+        lane = self.lanes.setdefault(key, deque())
+        lane.extend(messages)
+        waiters = self._waiters.get(key)
+        woken = 0
+        for _ in range(len(messages)):
+            while waiters and waiters[0].done():
+                waiters.popleft()
+            if not waiters:
+                break
+            waiters.popleft().set_result(key)
+            woken += 1
+        return woken
+
+    def pop(self, keys, max_count):
+        for key in keys:
+            lane = self.lanes.get(key)
+            if lane:
+                return key, [lane.popleft() for _ in range(min(max_count, len(lane)))]
+        return None, []
+
+    async def wait(self, keys, timeout):
+        # Awaiting the future directly (rather than through wait_for) lets a woken consumer run on
+        # the next iteration of the event loop.
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        for key in keys:
+            self._waiters.setdefault(key, deque()).append(waiter)
+        timer = loop.call_later(timeout, lambda: waiter.done() or waiter.set_result(None))
+        try:
+            await waiter
+        finally:
+            timer.cancel()
+            for key in keys:
+                waiters = self._waiters.get(key)
+                if waiters and waiter in waiters:
+                    waiters.remove(waiter)
+
+    def length(self, key):
+        return len(self.lanes.get(key, ()))
+
+    """
+    Records an idempotency key for window seconds. Returns False when it was already recorded.
+    """
+    def claim_idempotency_key(self, name, window):
+        now = time.monotonic()
+        while self._idempotency_keys:
+            oldest, expires_at = next(iter(self._idempotency_keys.items()))
+            if expires_at > now:
+                break
+            del self._idempotency_keys[oldest]
+        if self._idempotency_keys.get(name, 0) > now:
+            return False
+        self._idempotency_keys[name] = now + window
+        return True
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, ()))
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+default_broker = InMemoryBroker()
+
+
+"""
+Queue backend that keeps messages in process memory, with the same publish/subscribe, type routing,
+priority lanes and overflow semantics as RedisQueue but no network and no serialization: published
+objects are handed to the subscriber by reference. Serialized payloads are decoded on subscribe
+unless raw=True. Messages are lost when the process exits.
+"""
+class InMemoryQueue(MessageQueue):
+    backend_name = "memory"
+    stores_objects = True
+
+    def __init__(self, queue_name=None,
+                 max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                 broker=None,
+                 codec=None,
+                 priority_lanes=None,
+                 overflow_policy=REDIS_QUEUE_OVERFLOW_POLICY,
+                 overflow_block_timeout=REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS,
+                 idempotency_window=MESSAGE_IDEMPOTENCY_WINDOW_SECONDS):
+        self.queue_name = queue_name
+        self.max_queue_size = max_queue_size
+        self.broker = broker or default_broker
+        self.redis_client = self.broker
+        self.codec = codec or message_codec
+        self.type_router = TypeRouter(queue_name)
+        self.priority_lanes = priority_lanes or PriorityLanes()
+        self.overflow_policy = validate_overflow_policy(overflow_policy)
+        self.overflow_block_timeout = overflow_block_timeout
+        self.idempotency_window = idempotency_window
+        self.dropped_messages = 0
+        self.expired_messages = 0
+        self.duplicate_messages = 0
+
+    async def connect(self):
+        logger.info("[InMemoryQueue:connect] Using the in-process queue backend")
+        return True
+
+    async def disconnect(self):
+        return True
+
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        return await self.publish_many([serialized_message], [message_type] if message_type else None, [priority] if priority else None,
+                                       idempotency_keys=[idempotency_key] if idempotency_key else None)
+
+    """
+    Messages whose idempotency key was already published within idempotency_window seconds are
+    dropped. The room is checked for the whole batch, duplicates included.
+    """
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, checkpoint=None, idempotency_keys=None, partition_keys=None):
+        if not serialized_messages:
+            return True
+        if idempotency_keys and not any(idempotency_keys):
+            idempotency_keys = None
+
+        messages_by_key = {}
+        idempotency_keys_by_key = {}
+        for index, serialized_message in enumerate(serialized_messages):
+            key = self.type_router.key_for(message_types[index] if message_types else None)
+            if priorities:
+                key = self.priority_lanes.lane_key(key, priorities[index])
+            messages_by_key.setdefault(key, []).append(serialized_message)
+            if idempotency_keys:
+                idempotency_keys_by_key.setdefault(key, []).append(idempotency_keys[index])
+
+        start_time = time.perf_counter()
+        try:
+            if self.overflow_policy != "drop_oldest":
+                await push_with_overflow_policy(lambda: self.has_room(messages_by_key), self.overflow_policy, self.overflow_block_timeout)
+        except QueueFullError:
+            queue_metrics.rejected_messages.inc(len(serialized_messages), backend=self.backend_name)
+            logger.warning("[InMemoryQueue:publish_many] Queue is full, rejected %d messages. queue name: %s",
+                           len(serialized_messages), self.queue_name, extra=SAMPLED)
+            raise
+
+        # Nothing below awaits, so the batch is stored atomically with respect to other tasks.
+        duplicates = 0
+        for key, keys in idempotency_keys_by_key.items():
+            messages = [message for message, idempotency_key in zip(messages_by_key[key], keys)
+                        if not idempotency_key or self.broker.claim_idempotency_key(idempotency_key_name(self.queue_name, idempotency_key), self.idempotency_window)]
+            duplicates += len(messages_by_key[key]) - len(messages)
+            messages_by_key[key] = messages
+        trimmed = woken = 0
+        for key, messages in messages_by_key.items():
+            woken += self.broker.push(key, messages)
+            lane = self.broker.lanes[key]
+            while len(lane) > self.max_queue_size:
+                lane.popleft()
+                trimmed += 1
+        if message_types:
+            self.broker.sets.setdefault(self.type_router.types_key, set()).update(message_type for message_type in message_types if message_type)
+        if checkpoint:
+            self.broker.values[checkpoint[0]] = str(checkpoint[1]).encode()
+
+        if duplicates:
+            self.duplicate_messages += duplicates
+            queue_metrics.duplicate_messages.inc(duplicates, backend=self.backend_name)
+            logger.info("[InMemoryQueue:publish_many] Skipped %d messages already published. queue name: %s",
+                        duplicates, self.queue_name, extra=SAMPLED)
+        if trimmed:
+            self.dropped_messages += trimmed
+            logger.warning("[InMemoryQueue:publish_many] Queue is full, dropped the %d oldest messages (%d in total). queue name: %s",
+                           trimmed, self.dropped_messages, self.queue_name, extra=SAMPLED)
+        queue_metrics.record_published(self.backend_name, len(serialized_messages), start_time, trimmed)
+        if woken:
+            # Nothing else yields on this path, so without this a busy producer would starve the consumers it just woke.
+            await asyncio.sleep(0)
+        return True
+
+    async def has_room(self, messages_by_key):
+        return all(self.broker.length(key) + len(messages) <= self.max_queue_size for key, messages in messages_by_key.items())
+
+    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, message_types=None):
+        messages = await self.subscribe_batch(1, subscribe_timeout, message_types=message_types)
+        return messages[0] if messages else None
+
+    """
+    Pops up to max_count messages from the first non-empty lane, in the order chosen by PriorityLanes,
+    waiting up to subscribe_timeout seconds for one to arrive.
+    """
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        start_time = time.perf_counter()
+        keys = await self.type_router.resolve_keys(self.broker, message_types)
+        if not keys:
+            await asyncio.sleep(subscribe_timeout)
+            return []
+
+        lanes = self.priority_lanes.lanes_in_order(keys)
+        deadline = time.monotonic() + subscribe_timeout
+        while True:
+            key, messages = self.broker.pop(lanes, max_count)
+            messages = self.drop_expired(messages)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                break
+            await self.broker.wait(lanes, remaining)
+
+        if not messages:
+            return []
+        queue_metrics.record_consumed(self.backend_name, len(messages), start_time)
+        logger.info("[InMemoryQueue:subscribe_batch] Consumed %d messages. queue name: %s", len(messages), key, extra=SAMPLED)
+        if raw:
+            return messages
+        return [self.decode(message) for message in messages]
+
+    async def sweep_expired(self):
+        keys = await self.type_router.get_all_keys(self.broker)
+        now = time.time()
+        swept = 0
+        for key in self.priority_lanes.all_lanes(keys):
+            lane = self.broker.lanes.get(key)
+            if not lane:
+                continue
+            fresh = [message for message in lane if not is_expired(message, now, self.codec)]
+            if len(fresh) < len(lane):
+                swept += len(lane) - len(fresh)
+                lane.clear()
+                lane.extend(fresh)
+        if swept:
+            self.record_expired(swept)
+        return swept
+
+    def decode(self, message):
+        return self.codec.decode(message) if isinstance(message, (str, bytes, bytearray)) else message
+
+    async def ack(self, messages):
+        return True
+
+    async def get_queue_size(self):
+        keys = await self.type_router.get_all_keys(self.broker)
+        queue_size = sum(self.broker.length(lane) for lane in self.priority_lanes.all_lanes(keys))
+        queue_metrics.queue_depth.set(queue_size, backend=self.backend_name)
+        return queue_size
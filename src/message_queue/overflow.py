@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from src.utils.config import REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS, REDIS_QUEUE_OVERFLOW_POLL_INTERVAL_SECONDS
+
+OVERFLOW_POLICIES = ("drop_oldest", "reject_new", "block")
+
+"""
+What a queue does when a publish would take it past max_queue_size:
+
+- "drop_oldest": The messages are added and the oldest ones are trimmed. Dropped messages are
+                 counted in the queue's dropped_messages and the mq_trimmed_messages_total metric.
+- "reject_new": Nothing is written and QueueFullError is raised, so the producer can back off.
+- "block": The publish waits up to block_timeout seconds for consumers to make room, then
+           behaves like "reject_new".
+
+With "reject_new" and "block" a batch is admitted or rejected as a whole, checked atomically in Redis.
+"""
+class QueueFullError(Exception):
+    pass
+
+
+def validate_overflow_policy(overflow_policy):
+    if overflow_policy not in OVERFLOW_POLICIES:
+        raise ValueError(f"Unsupported overflow policy: {overflow_policy}")
+    return overflow_policy
+
+
+"""
+Calls try_push until it reports that the messages were admitted. try_push returns True when they
+were written and False when the queue had no room. With "reject_new" it is called once.
+"""
+async def push_with_overflow_policy(try_push, overflow_policy,
+                                    block_timeout=REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS,
+                                    poll_interval=REDIS_QUEUE_OVERFLOW_POLL_INTERVAL_SECONDS):
+    deadline = time.monotonic() + block_timeout
+    while True:
+        if await try_push():
+            return
+        remaining = deadline - time.monotonic()
+        if overflow_policy != "block" or remaining <= 0:
+            raise QueueFullError("Queue is full")
+        await asyncio.sleep(min(poll_interval, remaining))
@@ -0,0 +1,385 @@
+import asyncio
+import itertools
+import os
+import socket
+import uuid
+from collections import deque
+
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.redis_queue import RedisQueue
+from src.message_queue.codec import message_codec
+from src.message_queue.partitioning import ConsistentHashRing, get_partition_key, assign_partitions
+from src.message_queue import queue_metrics
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.metrics import Gauge
+from src.utils.config import (REDIS_CONNECTION_URL, REDIS_BLOCKING_MAX_CONNECTIONS, REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS,
+                              REDIS_MESSAGE_DRAIN_BATCH_SIZE, REDIS_QUEUE_PARTITIONS, REDIS_PARTITION_URLS,
+                              REDIS_PARTITION_REBALANCE_INTERVAL_SECONDS, REDIS_PARTITION_LEASE_SECONDS, REDIS_PARTITION_PREFETCH_BATCHES)
+
+logger = get_logger(__name__)
+
+owned_partitions = Gauge("mq_owned_partitions", "Partitions currently read by this consumer.")
+
+"""
+Takes or renews the lease on a partition for ARGV[1], for ARGV[2] milliseconds, unless another
+consumer holds it. Returns 1 when the caller holds the lease.
+"""
+ACQUIRE_LEASE_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner == false or owner == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+"""
+The keys of a partition share a hash tag, so on a Redis Cluster all its lanes and type keys map to
+one slot and the MULTI/EXEC and Lua calls of RedisQueue stay valid.
+"""
+def partition_name(queue_name, partition):
+    return f"{{{queue_name}:{partition}}}"
+
+
+"""
+A "list" queue split into partition_count RedisQueue partitions, placed round-robin on
+connection_urls, so the load is spread over several keys and servers.
+
+Publishing: a message goes to the partition of its partition key (see get_partition_key) on a
+ConsistentHashRing, so all messages of a key land in one FIFO partition and keep their order.
+The publisher passes the keys in partition_keys; otherwise serialized payloads are decoded to read
+them. Messages without a key are spread round-robin.
+A batch is split by partition and the partitions are written concurrently; a batch spanning several
+partitions is not atomic, and a checkpoint is written on the first server once every partition has
+accepted its part.
+
+Consuming: every consumer heartbeats into a sorted set on the first server and owns the partitions
+that assign_partitions deals to it among the live members. Ownership is guarded by a lease per
+partition, so a partition changes hands only after its previous owner released it or stopped
+renewing it, and one partition is never read by two consumers at once. Each owned partition has a
+reader task that prefetches batches (up to prefetch_batches queued). Readers use the raw and
+message_types arguments of the first subscribe call. Prefetched batches are kept as stored, and
+those of a released partition are put back at the head of their lanes before its lease is given up,
+so the next owner reads them first and a key keeps its order across the handoff.
+"""
+class PartitionedQueue(MessageQueue):
+    backend_name = "list"
+
+    def __init__(self, queue_name=None,
+                 partition_count=REDIS_QUEUE_PARTITIONS,
+                 connection_urls=None,
+                 consumer_id=None,
+                 rebalance_interval=REDIS_PARTITION_REBALANCE_INTERVAL_SECONDS,
+                 lease_duration=REDIS_PARTITION_LEASE_SECONDS,
+                 prefetch_batches=REDIS_PARTITION_PREFETCH_BATCHES,
+                 read_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS,
+                 read_batch_size=REDIS_MESSAGE_DRAIN_BATCH_SIZE,
+                 **queue_kwargs):
+        self.queue_name = queue_name
+        self.connection_urls = list(connection_urls or REDIS_PARTITION_URLS or [REDIS_CONNECTION_URL])[:partition_count]
+        self.consumer_id = consumer_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.rebalance_interval = rebalance_interval
+        self.lease_duration = lease_duration
+        self.read_timeout = read_timeout
+        self.read_batch_size = read_batch_size
+        self.codec = queue_kwargs.get("codec") or message_codec
+        self.ring = ConsistentHashRing(partition_count)
+        self.members_key = f"{queue_name}:consumers"
+
+        # Every partition on a server shares its clients, and each owned partition keeps one blocking read open.
+        partitions_per_server = -(-partition_count // len(self.connection_urls))
+        queue_kwargs["blocking_max_connections"] = max(queue_kwargs.get("blocking_max_connections", REDIS_BLOCKING_MAX_CONNECTIONS), partitions_per_server)
+        self.partitions = [RedisQueue(partition_name(queue_name, partition),
+                                      connection_url=self.connection_urls[partition % len(self.connection_urls)],
+                                      **queue_kwargs)
+                           for partition in range(partition_count)]
+        self.redis_client = None
+        self.owned = {}
+        self._next_partition = itertools.count()
+        self._batches = asyncio.Queue()
+        self._prefetch_slots = asyncio.Semaphore(prefetch_batches)
+        self._leftover = deque()
+        self._leftover_source = None
+        self._reading = set()
+        self._read_arguments = None
+        self._rebalancer_task = None
+        self._rebalance_lock = asyncio.Lock()
+        self._acquire_lease_script = None
+        self._release_lease_script = None
+
+    async def connect(self):
+        server_count = len(self.connection_urls)
+        for server, primary in enumerate(self.partitions[:server_count]):
+            if not await primary.connect():
+                logger.error("[PartitionedQueue:connect] Failed to connect to %s", self.connection_urls[server])
+                return False
+            for partition in self.partitions[server + server_count::server_count]:
+                partition.redis_client, partition.blocking_client = primary.redis_client, primary.blocking_client
+        self.redis_client = self.partitions[0].redis_client
+        logger.info("[PartitionedQueue:connect] Connected %d partitions on %d servers", len(self.partitions), server_count)
+        return True
+
+    async def disconnect(self):
+        await self.stop_consuming()
+        disconnected = True
+        for primary in self.partitions[:len(self.connection_urls)]:
+            disconnected = await primary.disconnect() and disconnected
+        return disconnected
+
+    """
+    Places a message by the partition key its publisher gave, or else by the one read from the message.
+    """
+    def get_partition(self, serialized_message, key=None):
+        if key is None:
+            try:
+                message = serialized_message if isinstance(serialized_message, dict) else self.codec.decode(serialized_message)
+                key = get_partition_key(message)
+            except Exception:
+                key = None
+        if key is None:
+            return next(self._next_partition) % len(self.partitions)
+        return self.ring.get_partition(key)
+
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        return await self.publish_many([serialized_message], [message_type] if message_type else None, [priority] if priority else None,
+                                       idempotency_keys=[idempotency_key] if idempotency_key else None,
+                                       partition_keys=[partition_key] if partition_key else None)
+
+    """
+    Returns True once every partition stored its part of the batch. Raises QueueFullError when a
+    partition rejected its part; the other partitions may have stored theirs.
+    """
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, checkpoint=None, idempotency_keys=None, partition_keys=None):
+        if not serialized_messages:
+            return True
+
+        indexes_by_partition = {}
+        for index, serialized_message in enumerate(serialized_messages):
+            partition = self.get_partition(serialized_message, partition_keys[index] if partition_keys else None)
+            indexes_by_partition.setdefault(partition, []).append(index)
+
+        results = await asyncio.gather(*(
+            self.partitions[partition].publish_many([serialized_messages[index] for index in indexes],
+                                                    [message_types[index] for index in indexes] if message_types else None,
+                                                    [priorities[index] for index in indexes] if priorities else None,
+                                                    idempotency_keys=[idempotency_keys[index] for index in indexes] if idempotency_keys else None)
+            for partition, indexes in indexes_by_partition.items()), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if not all(results):
+            return False
+
+        if checkpoint:
+            try:
+                await self.redis_client.set(*checkpoint)
+            except Exception as e:
+                logger.error("[PartitionedQueue:publish_many] Failed to write the checkpoint: %s", e)
+                return False
+        return True
+
+    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, message_types=None):
+        messages = await self.subscribe_batch(1, subscribe_timeout, message_types=message_types)
+        return messages[0] if messages else None
+
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        await self.start_consuming(raw, message_types)
+        if not self._leftover:
+            try:
+                partition, key, batch = await asyncio.wait_for(self._batches.get(), subscribe_timeout)
+            except asyncio.TimeoutError:
+                return []
+            self._prefetch_slots.release()
+            self._leftover.extend(batch)
+            self._leftover_source = (partition, key)
+        messages = [self._leftover.popleft() for _ in range(min(max_count, len(self._leftover)))]
+        if self._read_arguments[0]:
+            return messages
+        return [self.codec.decode(message) if isinstance(message, (str, bytes, bytearray)) else message for message in messages]
+
+    async def ack(self, messages):
+        return True
+
+    @property
+    def expired_messages(self):
+        return sum(partition.expired_messages for partition in self.partitions)
+
+    """
+    Sweeps every partition, owned or not, so expired messages are evicted even from partitions that
+    currently have no consumer.
+    """
+    async def sweep_expired(self):
+        swept = 0
+        for partition in self.partitions:
+            swept += await partition.sweep_expired()
+        return swept
+
+    async def get_queue_size(self):
+        queue_size = 0
+        for partition in self.partitions:
+            queue_size += await partition.get_queue_size()
+        queue_metrics.queue_depth.set(queue_size, backend=self.backend_name)
+        return queue_size
+
+    async def start_consuming(self, raw=False, message_types=None):
+        if self._rebalancer_task is None:
+            self._read_arguments = (raw, message_types)
+            self._rebalancer_task = asyncio.create_task(self._rebalance_loop())
+            logger.info("[PartitionedQueue:start_consuming] Joined as consumer %s", self.consumer_id)
+
+    async def stop_consuming(self):
+        if self._rebalancer_task is None:
+            return
+        self._rebalancer_task.cancel()
+        try:
+            await self._rebalancer_task
+        except asyncio.CancelledError:
+            pass
+        self._rebalancer_task = None
+        for partition in list(self.owned):
+            await self.release(partition)
+        try:
+            await self.redis_client.zrem(self.members_key, self.consumer_id)
+        except Exception as e:
+            logger.error("[PartitionedQueue:stop_consuming] Failed to leave the consumer group: %s", e)
+        logger.info("[PartitionedQueue:stop_consuming] Left as consumer %s", self.consumer_id)
+
+    async def _rebalance_loop(self):
+        while True:
+            try:
+                await self.rebalance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[PartitionedQueue:rebalance] Error: %s", e)
+            await asyncio.sleep(self.rebalance_interval)
+
+    """
+    Heartbeats, drops members that missed their lease, and then releases the partitions no longer
+    assigned to this consumer before taking the ones that are.
+    """
+    async def rebalance(self):
+        async with self._rebalance_lock:
+            seconds, microseconds = await self.redis_client.time()
+            now = seconds * 1000 + microseconds // 1000
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.zadd(self.members_key, {self.consumer_id: now})
+                pipe.zremrangebyscore(self.members_key, "-inf", now - self.lease_duration * 1000)
+                pipe.zrange(self.members_key, 0, -1)
+                members = [member.decode() if isinstance(member, bytes) else member for member in (await pipe.execute())[2]]
+
+            assigned = assign_partitions(len(self.partitions), members, self.consumer_id)
+            for partition in list(self.owned):
+                if partition not in assigned:
+                    await self.release(partition)
+            for partition in assigned:
+                if await self.acquire_lease(partition):
+                    if partition not in self.owned:
+                        self.start_reader(partition)
+                elif partition in self.owned:
+                    logger.warning("[PartitionedQueue:rebalance] Lost the lease on partition %d", partition)
+                    await self.release(partition)
+            owned_partitions.set(len(self.owned))
+            logger.info("[PartitionedQueue:rebalance] %d consumers, reading partitions %s", len(members), sorted(self.owned), extra=SAMPLED)
+
+    def lease_key(self, partition):
+        return f"{self.queue_name}:owner:{partition}"
+
+    async def acquire_lease(self, partition):
+        if self._acquire_lease_script is None or self._acquire_lease_script.registered_client is not self.redis_client:
+            self._acquire_lease_script = self.redis_client.register_script(ACQUIRE_LEASE_SCRIPT)
+        return bool(await self._acquire_lease_script(keys=[self.lease_key(partition)],
+                                                     args=[self.consumer_id, int(self.lease_duration * 1000)]))
+
+    def start_reader(self, partition):
+        stopped = asyncio.Event()
+        self.owned[partition] = (stopped, asyncio.create_task(self._read_partition(partition, stopped)))
+        logger.info("[PartitionedQueue:start_reader] Reading partition %d", partition)
+
+    """
+    Stops the reader between two reads, so no popped message is lost, puts the partition's prefetched
+    messages back, and only then gives up the lease.
+    """
+    async def release(self, partition):
+        stopped, reader = self.owned.pop(partition)
+        stopped.set()
+        try:
+            if partition in self._reading:
+                await asyncio.wait_for(asyncio.shield(reader), self.read_timeout + 1)
+        except asyncio.TimeoutError:
+            logger.warning("[PartitionedQueue:release] Reader of partition %d did not stop in time", partition)
+        except Exception as e:
+            logger.error("[PartitionedQueue:release] Reader of partition %d failed: %s", partition, e)
+        # A reader waiting for a prefetch slot holds no messages, so it can be cancelled right away.
+        reader.cancel()
+        try:
+            await reader
+        except (asyncio.CancelledError, Exception):
+            pass
+
+        try:
+            await self.requeue_prefetched(partition)
+        except Exception as e:
+            logger.error("[PartitionedQueue:release] Failed to put back the prefetched messages of partition %d: %s", partition, e)
+        try:
+            await self.release_lease(partition)
+        except Exception as e:
+            logger.error("[PartitionedQueue:release] Failed to release partition %d: %s", partition, e)
+        logger.info("[PartitionedQueue:release] Released partition %d", partition)
+
+    async def release_lease(self, partition):
+        if self._release_lease_script is None or self._release_lease_script.registered_client is not self.redis_client:
+            self._release_lease_script = self.redis_client.register_script(RELEASE_LEASE_SCRIPT)
+        await self._release_lease_script(keys=[self.lease_key(partition)], args=[self.consumer_id])
+
+    """
+    Takes the partition's batches out of the prefetch queue and the leftover of the current batch,
+    and pushes them back to the head of the lanes they were popped from, oldest first.
+    """
+    async def requeue_prefetched(self, partition):
+        messages_by_key = {}
+        if self._leftover and self._leftover_source[0] == partition:
+            messages_by_key[self._leftover_source[1]] = list(self._leftover)
+            self._leftover.clear()
+        batches = []
+        while not self._batches.empty():
+            batches.append(self._batches.get_nowait())
+        for batch in batches:
+            if batch[0] == partition:
+                messages_by_key.setdefault(batch[1], []).extend(batch[2])
+                self._prefetch_slots.release()
+            else:
+                self._batches.put_nowait(batch)
+
+        for key, messages in messages_by_key.items():
+            await self.partitions[partition].requeue(key, messages)
+        if messages_by_key:
+            logger.info("[PartitionedQueue:requeue_prefetched] Put back %d prefetched messages of partition %d",
+                        sum(len(messages) for messages in messages_by_key.values()), partition)
+
+    async def _read_partition(self, partition, stopped):
+        _, message_types = self._read_arguments
+        while not stopped.is_set():
+            await self._prefetch_slots.acquire()
+            if stopped.is_set():
+                self._prefetch_slots.release()
+                return
+            # Payloads are kept as stored, so they can be put back unchanged (see requeue_prefetched).
+            self._reading.add(partition)
+            try:
+                key, messages = await self.partitions[partition].subscribe_lane_batch(self.read_batch_size, self.read_timeout,
+                                                                                      raw=True, message_types=message_types)
+            finally:
+                self._reading.discard(partition)
+            if messages:
+                self._batches.put_nowait((partition, key, messages))
+            else:
+                self._prefetch_slots.release()
@@ -0,0 +1,48 @@
+import bisect
+import hashlib
+import itertools
+
+from src.utils.config import REDIS_PARTITION_VIRTUAL_NODES
+
+"""
+Maps keys to partitions with consistent hashing. Every partition owns virtual_nodes points on a
+64-bit ring and a key belongs to the first point at or after its hash, so changing the number of
+partitions only moves the keys of the partitions that were added or removed. Hashes come from MD5
+rather than hash(), which is salted per process, so every service A instance agrees.
+"""
+class ConsistentHashRing:
+    def __init__(self, partition_count, virtual_nodes=REDIS_PARTITION_VIRTUAL_NODES):
+        points = sorted((hash_key(f"{partition}#{replica}"), partition)
+                        for partition in range(partition_count) for replica in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._partitions = [partition for _, partition in points]
+
+    def get_partition(self, key):
+        index = bisect.bisect_left(self._hashes, hash_key(key))
+        return self._partitions[index % len(self._partitions)]
+
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+"""
+Returns the partition key of a decoded message: its "key" field, or its type when it has none.
+"""
+def get_partition_key(message):
+    if not isinstance(message, dict):
+        return None
+    key = message.get("key") or message.get("type")
+    return str(key) if key is not None else None
+
+
+"""
+Returns the partitions a consumer should own: partitions are dealt round-robin over the sorted
+member ids, so every live consumer computes the same assignment and the counts differ by at most one.
+"""
+def assign_partitions(partition_count, members, member):
+    members = sorted(members)
+    if member not in members:
+        return []
+    position = members.index(member)
+    return list(itertools.islice(range(partition_count), position, None, len(members)))
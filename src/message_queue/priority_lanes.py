@@ -0,0 +1,45 @@
+from src.utils.config import MESSAGE_PRIORITY_LEVELS, MESSAGE_PRIORITY_POLICY, MESSAGE_PRIORITY_WEIGHTS
+
+"""
+Maps message priorities to Redis keys and decides the order in which a consumer serves them.
+
+Every base key (the queue, or a type key with per-type routing) has one lane per priority level.
+lanes_in_order() lists the lane keys in the order they should be served; passing that list to a
+single BLPOP makes Redis pop from the first non-empty one, so the policy costs no extra round-trip.
+
+With the "weighted" policy the first lane is chosen by smooth weighted round-robin and the others
+follow in descending priority, so an empty lane never delays the rest.
+"""
+class PriorityLanes:
+    def __init__(self, levels=MESSAGE_PRIORITY_LEVELS, policy=MESSAGE_PRIORITY_POLICY, weights=MESSAGE_PRIORITY_WEIGHTS):
+        if policy not in ("strict", "weighted"):
+            raise ValueError(f"Unsupported priority policy: {policy}")
+        self.levels = max(1, levels)
+        self.policy = policy
+        self.weights = [weights[priority] if priority < len(weights) else 1 for priority in range(self.levels)]
+        self._current_weights = [0] * self.levels
+
+    def clamp(self, priority):
+        return min(max(int(priority or 0), 0), self.levels - 1)
+
+    def lane_key(self, key, priority=0):
+        priority = self.clamp(priority)
+        return f"{key}:priority:{priority}" if priority else key
+
+    def all_lanes(self, keys):
+        return [self.lane_key(key, priority) for priority in range(self.levels - 1, -1, -1) for key in keys]
+
+    def lanes_in_order(self, keys):
+        return [self.lane_key(key, priority) for priority in self.serving_order() for key in keys]
+
+    def serving_order(self):
+        priorities = list(range(self.levels - 1, -1, -1))
+        if self.policy == "strict" or self.levels == 1:
+            return priorities
+
+        total_weight = sum(self.weights)
+        for priority in range(self.levels):
+            self._current_weights[priority] += self.weights[priority]
+        first = max(priorities, key=lambda priority: self._current_weights[priority])
+        self._current_weights[first] -= total_weight
+        return [first] + [priority for priority in priorities if priority != first]
@@ -0,0 +1,81 @@
+import asyncio
+
+from src.message_queue.overflow import QueueFullError
+from src.utils.logger import get_logger
+from src.utils.config import MESSAGE_PUBLISH_BATCH_MAX_SIZE, MESSAGE_PUBLISH_BATCH_MAX_DELAY_SECONDS
+
+logger = get_logger(__name__)
+
+"""
+Collects concurrent single publish calls and flushes them with one publish_many call.
+A batch is flushed when it reaches max_batch_size or max_delay seconds after its first message,
+whichever comes first. Every caller receives the result of the batch its message was part of,
+and a batch rejected by the queue's overflow policy raises QueueFullError in every caller.
+"""
+class PublishBatcher:
+    def __init__(self, redis_queue,
+                 max_batch_size=MESSAGE_PUBLISH_BATCH_MAX_SIZE,
+                 max_delay=MESSAGE_PUBLISH_BATCH_MAX_DELAY_SECONDS):
+        self.redis_queue = redis_queue
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._flush_timer = None
+        self._flush_tasks = set()
+
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((serialized_message, message_type, priority, idempotency_key, partition_key, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush_pending()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush_pending)
+
+        return await future
+
+    async def close(self):
+        self._flush_pending()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    def _flush_pending(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._publish_batch(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _publish_batch(self, batch):
+        serialized_messages = [message for message, _, _, _, _, _ in batch]
+        message_types = [message_type for _, message_type, _, _, _, _ in batch]
+        priorities = [priority for _, _, priority, _, _, _ in batch]
+        idempotency_keys = [idempotency_key for _, _, _, idempotency_key, _, _ in batch]
+        partition_keys = [partition_key for _, _, _, _, partition_key, _ in batch]
+        rejected = False
+        try:
+            published = await self.redis_queue.publish_many(serialized_messages,
+                                                            message_types if any(message_types) else None,
+                                                            priorities if any(priorities) else None,
+                                                            idempotency_keys=idempotency_keys if any(idempotency_keys) else None,
+                                                            partition_keys=partition_keys if any(partition_keys) else None)
+        except QueueFullError:
+            published, rejected = False, True
+        except Exception as e:
+            logger.error("[PublishBatcher:publish_batch] Failed to flush %d messages: %s", len(batch), e)
+            published = False
+
+        logger.debug("[PublishBatcher:publish_batch] Flushed %d messages, published: %s", len(batch), published)
+        for _, _, _, _, _, future in batch:
+            if future.done():
+                continue
+            if rejected:
+                future.set_exception(QueueFullError("Queue is full"))
+            else:
+                future.set_result(published)
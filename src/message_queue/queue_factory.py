@@ -0,0 +1,28 @@
+from src.message_queue.redis_queue import RedisQueue
+from src.message_queue.redis_stream_queue import RedisStreamQueue
+from src.message_queue.memory_queue import InMemoryQueue
+from src.message_queue.partitioned_queue import PartitionedQueue
+from src.utils.config import REDIS_QUEUE_BACKEND, REDIS_QUEUE_PARTITIONS
+
+"""
+Creates the queue backend selected by REDIS_QUEUE_BACKEND.
+
+- "list": RedisQueue, a capped Redis list.
+- "stream": RedisStreamQueue, a Redis stream read through a consumer group with acks.
+- "memory": InMemoryQueue, kept in process memory; only for a single process running both services.
+
+With more than one partition, "list" becomes a PartitionedQueue of RedisQueue partitions.
+"""
+def create_queue(queue_name, backend=REDIS_QUEUE_BACKEND, partitions=REDIS_QUEUE_PARTITIONS, **kwargs):
+    if partitions > 1 and backend != "list":
+        raise ValueError(f"The {backend} backend does not support partitions")
+    if backend == "list":
+        if partitions > 1:
+            return PartitionedQueue(queue_name, partition_count=partitions, **kwargs)
+        return RedisQueue(queue_name, **kwargs)
+    elif backend == "stream":
+        return RedisStreamQueue(queue_name, **kwargs)
+    elif backend == "memory":
+        return InMemoryQueue(queue_name, **kwargs)
+    else:
+        raise ValueError(f"Unknown queue backend: {backend}")
@@ -0,0 +1,41 @@
+import time
+
+from src.utils.metrics import Counter, Gauge, Histogram, metrics_registry
+from src.utils.config import METRICS_SIZE_BUCKETS
+
+"""
+Metrics shared by every queue backend. Each metric is labelled with the backend name.
+"""
+connect_attempts = Counter("mq_connect_attempts_total", "Connection attempts to the queue backend.")
+connect_failures = Counter("mq_connect_failures_total", "Failed connection attempts to the queue backend.")
+publish_duration = Histogram("mq_publish_duration_seconds", "Time spent publishing a message or batch, including retries.")
+published_messages = Counter("mq_published_messages_total", "Messages published to the queue.")
+publish_retries = Counter("mq_publish_retries_total", "Publish attempts that failed and were retried.")
+publish_failures = Counter("mq_publish_failures_total", "Publishes that failed after all retries.")
+trimmed_messages = Counter("mq_trimmed_messages_total", "Messages dropped because the queue exceeded its maximum size.")
+rejected_messages = Counter("mq_rejected_messages_total", "Messages rejected because the queue was full.")
+expired_messages = Counter("mq_expired_messages_total", "Messages dropped because they expired before they were delivered.")
+duplicate_messages = Counter("mq_duplicate_messages_total", "Messages skipped because their idempotency key was already published.")
+batch_size = Histogram("mq_batch_size", "Number of messages per publish or consume batch.", buckets=METRICS_SIZE_BUCKETS)
+consume_duration = Histogram("mq_consume_duration_seconds", "Time spent in a consume call, including the blocking wait.")
+consumed_messages = Counter("mq_consumed_messages_total", "Messages consumed from the queue.")
+consume_errors = Counter("mq_consume_errors_total", "Consume calls that failed.")
+queue_depth = Gauge("mq_queue_depth", "Queue length observed by the last size query.")
+
+
+def record_published(backend, message_count, start_time, trimmed=0):
+    if not metrics_registry.enabled:
+        return
+    publish_duration.observe(time.perf_counter() - start_time, backend=backend)
+    published_messages.inc(message_count, backend=backend)
+    batch_size.observe(message_count, backend=backend, operation="publish")
+    if trimmed:
+        trimmed_messages.inc(trimmed, backend=backend)
+
+
+def record_consumed(backend, message_count, start_time):
+    if not metrics_registry.enabled:
+        return
+    consume_duration.observe(time.perf_counter() - start_time, backend=backend)
+    consumed_messages.inc(message_count, backend=backend)
+    batch_size.observe(message_count, backend=backend, operation="consume")
@@ -0,0 +1,258 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import uuid
+from redis.exceptions import WatchError
+
+from src.message_queue.codec import message_codec, to_object
+from src.message_queue.expiry import is_expired
+from src.message_queue.partitioned_queue import ACQUIRE_LEASE_SCRIPT
+from src.message_queue.redis_connection import get_retry_delay
+from src.message_queue.redis_stream_queue import STREAM_ENTRY_ID_KEY, STREAM_KEY_KEY
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.metrics import Counter
+from src.utils.config import MESSAGE_TYPE_ROUTING_ENABLED, REDELIVERY_MAX_ATTEMPTS, REDELIVERY_BASE_DELAY_SECONDS, REDELIVERY_MAX_DELAY_SECONDS, REDELIVERY_MOVER_INTERVAL_SECONDS, REDELIVERY_MOVER_BATCH_SIZE, REDELIVERY_MOVER_LEASE_SECONDS, REDELIVERY_DEAD_LETTER_MAX_SIZE, REDELIVERY_ATTEMPTS_TTL_SECONDS
+
+logger = get_logger(__name__)
+
+ATTEMPTS_FIELD = "delivery_attempts"
+LAST_ERROR_FIELD = "last_error"
+DEAD_AT_FIELD = "dead_at"
+REPLAY_WATCH_RETRIES = 5
+
+scheduled_messages = Counter("mq_redelivery_scheduled_total", "Messages put in the delay index after a failed delivery.")
+redelivered_messages = Counter("mq_redelivered_messages_total", "Delayed messages published to the queue again.")
+dead_lettered_messages = Counter("mq_dead_lettered_messages_total", "Messages moved to the dead-letter list after their last attempt.")
+
+"""
+Redelivers messages whose delivery failed, without holding up the consumer that saw the failure.
+
+schedule() stores each message in a delay index on the queue's Redis server: a sorted set
+"<queue name>:delayed" of entry ids scored by due time, and a hash "<queue name>:delayed:messages"
+holding the payloads. The due time is a jittered exponential backoff (see get_retry_delay).
+Payloads are stored and republished as they were delivered, so consumers never see the bookkeeping:
+the attempt count is kept under "<queue name>:delayed:attempts:<digest of the payload>" for
+attempts_ttl seconds. A message that has failed max_attempts times is appended to the dead-letter
+list "<queue name>:dead" instead, with its attempt count, last error and time of death, and one that
+has expired is dropped and counted like any other expired message.
+
+The mover (run()) publishes due messages back to the queue in batches and only then removes them
+from the index, so nothing is lost if it dies halfway. Each message is published with an
+idempotency key made from its entry id, so a batch published twice that way is stored once. A
+lease lets one service B instance at a time run the mover; it sleeps until the next message is
+due, at most interval seconds.
+"""
+class RedeliveryScheduler:
+    def __init__(self, queue,
+                 max_attempts=REDELIVERY_MAX_ATTEMPTS,
+                 base_delay=REDELIVERY_BASE_DELAY_SECONDS,
+                 max_delay=REDELIVERY_MAX_DELAY_SECONDS,
+                 interval=REDELIVERY_MOVER_INTERVAL_SECONDS,
+                 batch_size=REDELIVERY_MOVER_BATCH_SIZE,
+                 lease_duration=REDELIVERY_MOVER_LEASE_SECONDS,
+                 dead_letter_max_size=REDELIVERY_DEAD_LETTER_MAX_SIZE,
+                 attempts_ttl=REDELIVERY_ATTEMPTS_TTL_SECONDS,
+                 type_routing=MESSAGE_TYPE_ROUTING_ENABLED,
+                 codec=None,
+                 owner=None):
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.interval = interval
+        self.batch_size = batch_size
+        self.lease_duration = lease_duration
+        self.dead_letter_max_size = dead_letter_max_size
+        self.attempts_ttl = attempts_ttl
+        self.type_routing = type_routing
+        self.codec = codec or message_codec
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.delayed_key = f"{queue.queue_name}:delayed"
+        self.messages_key = f"{queue.queue_name}:delayed:messages"
+        self.dead_letter_key = f"{queue.queue_name}:dead"
+        self.lease_key = f"{queue.queue_name}:delayed:mover"
+        self._acquire_lease_script = None
+        self._mover_task = None
+
+    @property
+    def redis_client(self):
+        # The queue creates its client on connect, so it is looked up on every use.
+        return self.queue.redis_client
+
+    async def start(self):
+        if self._mover_task is None:
+            self._mover_task = asyncio.create_task(self.run())
+            logger.info("[RedeliveryScheduler:start] Mover started. queue name: %s", self.queue.queue_name)
+
+    async def stop(self):
+        if self._mover_task:
+            self._mover_task.cancel()
+            try:
+                await self._mover_task
+            except asyncio.CancelledError:
+                pass
+            self._mover_task = None
+
+    def attempts_key(self, payload):
+        digest = hashlib.sha1(payload.encode() if isinstance(payload, str) else payload).hexdigest()
+        return f"{self.queue.queue_name}:delayed:attempts:{digest}"
+
+    """
+    Stores messages whose delivery failed with error for a later attempt, or dead-letters them.
+    Returns the number of messages scheduled for redelivery.
+    """
+    async def schedule(self, messages, error):
+        now = time.time()
+        failed = []
+        for message in messages:
+            if is_expired(message, now, self.codec):
+                continue
+            message = {key: value for key, value in to_object(message).items() if key not in (STREAM_ENTRY_ID_KEY, STREAM_KEY_KEY)}
+            payload = self.codec.encode(message)
+            failed.append((message, payload, self.attempts_key(payload)))
+        if len(failed) < len(messages):
+            self.queue.record_expired(len(messages) - len(failed))
+        if not failed:
+            return 0
+
+        delayed = {}
+        due_times = {}
+        attempt_counts = {}
+        dead_letters = []
+        finished = []
+        previous_attempts = await self.redis_client.mget([attempts_key for _, _, attempts_key in failed])
+        for (message, payload, attempts_key), previous in zip(failed, previous_attempts):
+            attempts = int(previous or 0) + 1
+            if attempts >= self.max_attempts:
+                dead_letters.append(self.codec.encode({**message, ATTEMPTS_FIELD: attempts, LAST_ERROR_FIELD: str(error), DEAD_AT_FIELD: round(now, 3)}))
+                finished.append(attempts_key)
+                continue
+            entry_id = uuid.uuid4().hex
+            delayed[entry_id] = payload
+            due_times[entry_id] = now + get_retry_delay(attempts, self.base_delay, self.max_delay)
+            attempt_counts[attempts_key] = attempts
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            if delayed:
+                pipe.hset(self.messages_key, mapping=delayed)
+                pipe.zadd(self.delayed_key, due_times)
+                for attempts_key, attempts in attempt_counts.items():
+                    pipe.set(attempts_key, attempts, ex=self.attempts_ttl)
+            if dead_letters:
+                pipe.rpush(self.dead_letter_key, *dead_letters)
+                pipe.ltrim(self.dead_letter_key, -self.dead_letter_max_size, -1)
+                pipe.delete(*finished)
+            await pipe.execute()
+
+        scheduled_messages.inc(len(delayed))
+        if dead_letters:
+            dead_lettered_messages.inc(len(dead_letters))
+            logger.warning("[RedeliveryScheduler:schedule] Dead-lettered %d messages after %d attempts: %s",
+                           len(dead_letters), self.max_attempts, error, extra=SAMPLED)
+        logger.info("[RedeliveryScheduler:schedule] Scheduled %d messages for redelivery: %s", len(delayed), error, extra=SAMPLED)
+        return len(delayed)
+
+    async def run(self):
+        while True:
+            delay = self.interval
+            try:
+                if await self.acquire_lease():
+                    while await self.promote_due() == self.batch_size:
+                        pass
+                    delay = await self.get_next_delay()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[RedeliveryScheduler:run] Failed to redeliver messages: %s", e)
+            await asyncio.sleep(delay)
+
+    async def acquire_lease(self):
+        if self._acquire_lease_script is None or self._acquire_lease_script.registered_client is not self.redis_client:
+            self._acquire_lease_script = self.redis_client.register_script(ACQUIRE_LEASE_SCRIPT)
+        return bool(await self._acquire_lease_script(keys=[self.lease_key], args=[self.owner, int(self.lease_duration * 1000)]))
+
+    async def get_next_delay(self):
+        entries = await self.redis_client.zrange(self.delayed_key, 0, 0, withscores=True)
+        if not entries:
+            return self.interval
+        return min(self.interval, max(0.0, entries[0][1] - time.time()))
+
+    """
+    Publishes up to batch_size due messages, in due order, and removes them from the delay index.
+    Returns the number of entries taken from the index.
+    """
+    async def promote_due(self):
+        entry_ids = await self.redis_client.zrangebyscore(self.delayed_key, "-inf", time.time(), start=0, num=self.batch_size)
+        if not entry_ids:
+            return 0
+        entries = [(entry_id, payload) for entry_id, payload in zip(entry_ids, await self.redis_client.hmget(self.messages_key, entry_ids))
+                   if payload is not None]
+        payloads = [payload for _, payload in entries]
+        if payloads:
+            messages = [self.codec.decode(payload) for payload in payloads]
+            message_types = [message.get("type") for message in messages] if self.type_routing else None
+            priorities = [message.get("priority", 0) for message in messages]
+            idempotency_keys = [f"redelivery:{entry_id.decode() if isinstance(entry_id, bytes) else entry_id}" for entry_id, _ in entries]
+            if not await self.queue.publish_many(payloads, message_types, priorities if any(priorities) else None,
+                                                 idempotency_keys=idempotency_keys):
+                raise RuntimeError("the queue is unavailable")
+
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.zrem(self.delayed_key, *entry_ids)
+            pipe.hdel(self.messages_key, *entry_ids)
+            await pipe.execute()
+        redelivered_messages.inc(len(payloads))
+        logger.info("[RedeliveryScheduler:promote_due] Redelivered %d messages. queue name: %s",
+                    len(payloads), self.queue.queue_name, extra=SAMPLED)
+        return len(entry_ids)
+
+    async def get_stats(self):
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self.delayed_key)
+            pipe.llen(self.dead_letter_key)
+            delayed, dead_letters = await pipe.execute()
+        return {"delayed": delayed, "dead_letters": dead_letters}
+
+    async def list_dead_letters(self, offset=0, limit=100):
+        payloads = await self.redis_client.lrange(self.dead_letter_key, offset, offset + limit - 1)
+        return [self.codec.decode(payload) for payload in payloads]
+
+    """
+    Moves up to count of the oldest dead letters back into the delay index, due now and with their
+    attempt count reset, so the mover publishes them again. The move is one transaction that is
+    retried if the dead-letter list changes meanwhile. Returns the number of messages moved.
+    """
+    async def replay_dead_letters(self, count=100):
+        for _ in range(REPLAY_WATCH_RETRIES):
+            try:
+                async with self.redis_client.pipeline(transaction=True) as pipe:
+                    await pipe.watch(self.dead_letter_key)
+                    payloads = await pipe.lrange(self.dead_letter_key, 0, count - 1)
+                    if not payloads:
+                        return 0
+                    now = time.time()
+                    replayed = {}
+                    for payload in payloads:
+                        message = {key: value for key, value in self.codec.decode(payload).items()
+                                   if key not in (ATTEMPTS_FIELD, LAST_ERROR_FIELD, DEAD_AT_FIELD)}
+                        replayed[uuid.uuid4().hex] = self.codec.encode(message)
+                    pipe.multi()
+                    pipe.hset(self.messages_key, mapping=replayed)
+                    pipe.zadd(self.delayed_key, {entry_id: now for entry_id in replayed})
+                    pipe.ltrim(self.dead_letter_key, len(payloads), -1)
+                    await pipe.execute()
+                logger.info("[RedeliveryScheduler:replay_dead_letters] Replaying %d dead letters. queue name: %s",
+                            len(replayed), self.queue.queue_name)
+                return len(replayed)
+            except WatchError:
+                continue
+        raise RuntimeError("the dead-letter list kept changing")
+
+    async def purge_dead_letters(self):
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.llen(self.dead_letter_key)
+            pipe.delete(self.dead_letter_key)
+            purged, _ = await pipe.execute()
+        return purged
@@ -0,0 +1,38 @@
+import redis.asyncio as redis
+from redis.backoff import EqualJitterBackoff
+
+from src.utils.config import (REDIS_RETRY_DELAY_SECONDS, REDIS_RETRY_MAX_DELAY_SECONDS, REDIS_POOL_TIMEOUT_SECONDS,
+                              REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS, REDIS_SOCKET_TIMEOUT_SECONDS, REDIS_SOCKET_KEEPALIVE,
+                              REDIS_HEALTH_CHECK_INTERVAL_SECONDS)
+
+"""
+Creates a Redis client backed by its own bounded connection pool.
+
+When all max_connections are in use, callers wait up to REDIS_POOL_TIMEOUT_SECONDS for one to be
+released instead of opening more. Queues create two of these: one for regular commands and one,
+with blocking=True, for blocking reads. Blocking connections have no socket timeout, since a BLPOP
+legitimately stays silent for the whole subscribe timeout, and keeping them in a separate pool
+means consumers parked in BLPOP can never take every connection away from publishers.
+"""
+def create_redis_client(connection_url, max_connections, blocking=False):
+    connection_pool = redis.BlockingConnectionPool.from_url(
+        connection_url,
+        max_connections=max_connections,
+        timeout=REDIS_POOL_TIMEOUT_SECONDS,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS,
+        socket_timeout=None if blocking else REDIS_SOCKET_TIMEOUT_SECONDS,
+        socket_keepalive=REDIS_SOCKET_KEEPALIVE,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL_SECONDS,
+    )
+    return redis.Redis.from_pool(connection_pool)
+
+
+"""
+Returns the delay before retry number `retry` (starting at 1): the base delay doubled on every
+attempt, capped at max_delay, with the upper half randomized so that clients which failed together
+do not all retry at the same moment.
+"""
+def get_retry_delay(retry, base_delay=REDIS_RETRY_DELAY_SECONDS, max_delay=REDIS_RETRY_MAX_DELAY_SECONDS):
+    if base_delay <= 0:
+        return 0
+    return EqualJitterBackoff(cap=max_delay, base=base_delay).compute(retry - 1)
@@ -1,93 +1,460 @@
-import redis.asyncio as redis
 import asyncio
-import json
+import logging
+import time
 from redis.exceptions import RedisError
 
-from src.utils.logger import logger
-from src.utils.config import REDIS_CONNECTION_URL, REDIS_MAX_RETRIES, REDIS_RETRY_DELAY_SECONDS, REDIS_MESSAGE_QUEUE_MAX_SIZE, REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.codec import message_codec
+from src.message_queue.redis_connection import create_redis_client, get_retry_delay
+from src.message_queue.type_routing import TypeRouter
+from src.message_queue.priority_lanes import PriorityLanes
+from src.message_queue.overflow import QueueFullError, validate_overflow_policy, push_with_overflow_policy
+from src.message_queue.idempotency import IDEMPOTENT_PUSH_SCRIPT, idempotency_key_name
+from src.message_queue.expiry import SWEEP_EXPIRED_SCRIPT
+from src.message_queue import queue_metrics
+from src.utils.logger import get_logger, log_payload, SAMPLED
+from src.utils.config import REDIS_CONNECTION_URL, REDIS_MAX_CONNECTIONS, REDIS_BLOCKING_MAX_CONNECTIONS, REDIS_MAX_RETRIES, REDIS_RETRY_DELAY_SECONDS, REDIS_MESSAGE_QUEUE_MAX_SIZE, REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, REDIS_MESSAGE_DRAIN_BATCH_SIZE, REDIS_QUEUE_OVERFLOW_POLICY, REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS, MESSAGE_IDEMPOTENCY_WINDOW_SECONDS, MESSAGE_EXPIRY_SWEEP_BATCH_SIZE
+
+logger = get_logger(__name__)
+
+"""
+Pushes every message only if each target list still has room for all of its messages, so a batch
+is admitted or rejected as a whole. KEYS are the lists, optionally followed by a checkpoint key.
+ARGV is max_size, the checkpoint value ("" for none) and then, for every list, its message count
+and its messages. The checkpoint is set together with the push. Returns 1 when the messages were
+pushed, 0 otherwise.
+"""
+PUSH_IF_ROOM_SCRIPT = """
+local max_size = tonumber(ARGV[1])
+local checkpoint = ARGV[2]
+local list_count = #KEYS
+if checkpoint ~= '' then
+    list_count = list_count - 1
+end
+local index = 3
+for i = 1, list_count do
+    local count = tonumber(ARGV[index])
+    if redis.call('LLEN', KEYS[i]) + count > max_size then
+        return 0
+    end
+    index = index + count + 1
+end
+index = 3
+for i = 1, list_count do
+    local count = tonumber(ARGV[index])
+    local first, last = index + 1, index + count
+    -- unpack() is limited by the Lua stack size, so long batches are pushed in chunks.
+    while first <= last do
+        local chunk_last = math.min(first + 999, last)
+        redis.call('RPUSH', KEYS[i], unpack(ARGV, first, chunk_last))
+        first = chunk_last + 1
+    end
+    index = last + 1
+end
+if checkpoint ~= '' then
+    redis.call('SET', KEYS[#KEYS], checkpoint)
+end
+return 1
+"""
+
+class RedisQueue(MessageQueue):
+    backend_name = "list"
 
-class RedisQueue:
     def __init__(self, queue_name=None, 
                  redis_client=REDIS_CONNECTION_URL, 
                  max_retries=REDIS_MAX_RETRIES, 
                  retry_delay=REDIS_RETRY_DELAY_SECONDS, 
                  connection_url=REDIS_CONNECTION_URL, 
-                 max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE):
-        
+                 max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                 codec=None,
+                 blocking_client=None,
+                 max_connections=REDIS_MAX_CONNECTIONS,
+                 blocking_max_connections=REDIS_BLOCKING_MAX_CONNECTIONS,
+                 priority_lanes=None,
+                 overflow_policy=REDIS_QUEUE_OVERFLOW_POLICY,
+                 overflow_block_timeout=REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS,
+                 idempotency_window=MESSAGE_IDEMPOTENCY_WINDOW_SECONDS):
+
         self.redis_client = redis_client
+        self.blocking_client = blocking_client
         self.queue_name = queue_name
         self.max_retries = max_retries
         self.retry_delay = retry_delay
         self.connection_url = connection_url
         self.max_queue_size = max_queue_size
+        self.max_connections = max_connections
+        self.blocking_max_connections = blocking_max_connections
+        self.codec = codec or message_codec
+        self.type_router = TypeRouter(queue_name)
+        self.priority_lanes = priority_lanes or PriorityLanes()
+        self.overflow_policy = validate_overflow_policy(overflow_policy)
+        self.overflow_block_timeout = overflow_block_timeout
+        self.idempotency_window = idempotency_window
+        self.dropped_messages = 0
+        self.expired_messages = 0
+        self.duplicate_messages = 0
+        self._push_if_room_script = None
+        self._idempotent_push_script = None
+        self._sweep_expired_script = None
+        self._consume_failures = 0
 
+    """
+    The connection pools are created once; failed attempts only repeat the ping, and the pools are
+    closed when every attempt failed.
+    """
     async def connect(self):
+        self.redis_client = create_redis_client(self.connection_url, self.max_connections)
+        self.blocking_client = create_redis_client(self.connection_url, self.blocking_max_connections, blocking=True)
         for retry in range(1, self.max_retries + 1):
             try:
-                self.redis_client = await redis.from_url(self.connection_url)
+                queue_metrics.connect_attempts.inc(backend=self.backend_name)
+                await self.redis_client.ping()
                 logger.info("[RedisQueue:connect] Connected to Redis successfully")
                 return True
             except Exception as e:
+                queue_metrics.connect_failures.inc(backend=self.backend_name)
                 logger.error("[RedisQueue:connect] Redis connection failed: %s", e)
                 if retry < self.max_retries:
-                    logger.info("[RedisQueue:connect] Retrying in %d seconds...", self.retry_delay)
-                    await asyncio.sleep(self.retry_delay)
+                    retry_delay = get_retry_delay(retry, self.retry_delay)
+                    logger.info("[RedisQueue:connect] Retrying in %.2f seconds...", retry_delay)
+                    await asyncio.sleep(retry_delay)
                 else:
                     logger.error("[RedisQueue:connect] All %d attempts failed.", self.max_retries)
+                    await self.redis_client.aclose()
+                    await self.blocking_client.aclose()
                     self.redis_client = None
+                    self.blocking_client = None
                     return False
 
+    """
+    Blocking reads go through their own connection pool (see create_redis_client). A queue built
+    around an injected redis_client and no blocking_client uses that client for everything.
+    """
+    def get_blocking_client(self):
+        return self.blocking_client or self.redis_client
+
     async def disconnect(self):
         if not self.redis_client:
             logger.error("[RedisQueue:disconnect] Redis is not connected.")
             return False
         try:
             await self.redis_client.aclose()
+            if self.blocking_client:
+                await self.blocking_client.aclose()
             logger.info("[RedisQueue:disconnect] Disconnected from Redis successfully")
             return True
         except Exception as e:
             logger.error("[RedisQueue:disconnect] Failed to disconnect from Redis: %s", e)
             return False
 
-    async def publish(self, serialized_message):
+    """
+    Returns True once the message is stored, False when Redis stays unavailable after all retries,
+    and raises QueueFullError when the overflow policy rejects it (see overflow.py). The message is
+    pushed and the queue trimmed in one atomic step (see publish_many), so a retry after a lost
+    reply never leaves an untrimmed queue behind.
+    """
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        published = await self.publish_many([serialized_message], [message_type] if message_type else None, [priority] if priority else None,
+                                            idempotency_keys=[idempotency_key] if idempotency_key else None)
+        if published:
+            logger.info("[RedisQueue:publish] Produced a message. queue name: %s, message: %s",
+                        self.queue_name, log_payload(serialized_message), extra=SAMPLED)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[RedisQueue:publish] Produced a message. queue size: %s", await self.get_queue_size())
+        return published
+
+    """
+    With "drop_oldest", pushes all messages and trims the queue once inside a single MULTI/EXEC
+    transaction, so a batch costs one round-trip regardless of its size. With "reject_new" and
+    "block", PUSH_IF_ROOM_SCRIPT checks the room and pushes in one atomic call instead, and nothing
+    needs trimming. When message_types is given, each message goes to the key of its type (see
+    TypeRouter), and priorities place it in that key's priority lane (see PriorityLanes). Every lane
+    is capped at max_queue_size, and order is preserved within each lane.
+    checkpoint, a (key, value) pair, is written in the same atomic step as the messages, so a caller
+    replaying messages (see SpillLog) can tell afterwards whether a batch was stored.
+    When idempotency_keys gives a key for any message, the batch goes through IDEMPOTENT_PUSH_SCRIPT
+    instead, which drops messages whose key was already published within idempotency_window seconds,
+    so retrying a batch whose reply was lost does not store it twice.
+    """
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, checkpoint=None, idempotency_keys=None, partition_keys=None):
+        if not serialized_messages:
+            return True
+
+        messages_by_key = {}
+        for index, serialized_message in enumerate(serialized_messages):
+            key = self.type_router.key_for(message_types[index] if message_types else None)
+            if priorities:
+                key = self.priority_lanes.lane_key(key, priorities[index])
+            messages_by_key.setdefault(key, []).append(serialized_message)
+        if idempotency_keys and not any(idempotency_keys):
+            idempotency_keys = None
+
+        start_time = time.perf_counter()
         for retry in range(1, self.max_retries + 1):
             try:
-                await self.redis_client.rpush(self.queue_name, serialized_message)
-                await self.redis_client.ltrim(self.queue_name, -self.max_queue_size, -1)
-                logger.info("[RedisQueue:publish] Produced a message. queue name: %s, message: %s",
-                            self.queue_name, serialized_message)
-                logger.debug("[RedisQueue:publish] Produced a message. queue size: %s", await self.get_queue_size())
+                if idempotency_keys:
+                    trimmed = await self.publish_idempotent(serialized_messages, idempotency_keys, message_types, priorities, checkpoint)
+                elif self.overflow_policy == "drop_oldest":
+                    async with self.redis_client.pipeline(transaction=True) as pipe:
+                        for key, messages in messages_by_key.items():
+                            pipe.rpush(key, *messages)
+                            pipe.ltrim(key, -self.max_queue_size, -1)
+                        if message_types:
+                            pipe.sadd(self.type_router.types_key, *dict.fromkeys(message_type for message_type in message_types if message_type))
+                        if checkpoint:
+                            pipe.set(*checkpoint)
+                        results = await pipe.execute()
+                    trimmed = self.record_dropped(results[:2 * len(messages_by_key):2])
+                else:
+                    await push_with_overflow_policy(lambda: self.push_if_room(messages_by_key, checkpoint),
+                                                    self.overflow_policy, self.overflow_block_timeout)
+                    if message_types:
+                        await self.redis_client.sadd(self.type_router.types_key, *dict.fromkeys(message_type for message_type in message_types if message_type))
+                    trimmed = 0
+                queue_metrics.record_published(self.backend_name, len(serialized_messages), start_time, trimmed)
+                logger.info("[RedisQueue:publish_many] Produced %d messages. queue name: %s",
+                            len(serialized_messages), self.queue_name, extra=SAMPLED)
                 return True
+            except QueueFullError:
+                queue_metrics.rejected_messages.inc(len(serialized_messages), backend=self.backend_name)
+                logger.warning("[RedisQueue:publish_many] Queue is full, rejected %d messages. queue name: %s",
+                               len(serialized_messages), self.queue_name, extra=SAMPLED)
+                raise
             except Exception as e:
-                logger.error("[RedisQueue:publish] Failed to publish a message: %s", e)
+                logger.error("[RedisQueue:publish_many] Failed to publish %d messages: %s", len(serialized_messages), e)
                 if retry < self.max_retries:
-                    logger.info("[RedisQueue:publish] Retrying in %d seconds...", self.retry_delay)
-                    await asyncio.sleep(self.retry_delay)
+                    queue_metrics.publish_retries.inc(backend=self.backend_name)
+                    retry_delay = get_retry_delay(retry, self.retry_delay)
+                    logger.info("[RedisQueue:publish_many] Retrying in %.2f seconds...", retry_delay)
+                    await asyncio.sleep(retry_delay)
                 else:
-                    logger.error("[RedisQueue:publish] All %d attempts failed.", self.max_retries)
+                    queue_metrics.publish_failures.inc(backend=self.backend_name)
+                    logger.error("[RedisQueue:publish_many] All %d attempts failed.", self.max_retries)
                     return False
-    
+
+    async def publish_idempotent(self, serialized_messages, idempotency_keys, message_types, priorities, checkpoint):
+        messages_by_key = {}
+        for index, serialized_message in enumerate(serialized_messages):
+            key = self.type_router.key_for(message_types[index] if message_types else None)
+            if priorities:
+                key = self.priority_lanes.lane_key(key, priorities[index])
+            messages_by_key.setdefault(key, []).append((serialized_message, idempotency_keys[index]))
+
+        results = []
+        async def try_push():
+            results.append(await self.push_idempotent(messages_by_key, checkpoint))
+            return results[-1] is not None
+        await push_with_overflow_policy(try_push, self.overflow_policy, self.overflow_block_timeout)
+        if message_types:
+            await self.redis_client.sadd(self.type_router.types_key, *dict.fromkeys(message_type for message_type in message_types if message_type))
+
+        pushed, trimmed = results[-1]
+        duplicates = len(serialized_messages) - pushed
+        if duplicates:
+            self.duplicate_messages += duplicates
+            queue_metrics.duplicate_messages.inc(duplicates, backend=self.backend_name)
+            logger.info("[RedisQueue:publish_idempotent] Skipped %d messages already published. queue name: %s",
+                        duplicates, self.queue_name, extra=SAMPLED)
+        if trimmed:
+            self.dropped_messages += trimmed
+            logger.warning("[RedisQueue:publish_idempotent] Queue is full, dropped the %d oldest messages (%d in total). queue name: %s",
+                           trimmed, self.dropped_messages, self.queue_name, extra=SAMPLED)
+        return trimmed
+
+    """
+    queue_lengths are the lengths returned by RPUSH, before trimming, so anything above
+    max_queue_size was dropped by the following LTRIM.
+    """
+    def count_trimmed(self, queue_lengths):
+        return sum(max(0, length - self.max_queue_size) for length in queue_lengths if isinstance(length, int))
+
+    def record_dropped(self, queue_lengths):
+        dropped = self.count_trimmed(queue_lengths)
+        if dropped:
+            self.dropped_messages += dropped
+            logger.warning("[RedisQueue:record_dropped] Queue is full, dropped the %d oldest messages (%d in total). queue name: %s",
+                           dropped, self.dropped_messages, self.queue_name, extra=SAMPLED)
+        return dropped
+
+    async def push_if_room(self, messages_by_key, checkpoint=None):
+        # The script object caches its SHA and is re-registered if the client is replaced (see connect).
+        if self._push_if_room_script is None or self._push_if_room_script.registered_client is not self.redis_client:
+            self._push_if_room_script = self.redis_client.register_script(PUSH_IF_ROOM_SCRIPT)
+        keys = list(messages_by_key)
+        arguments = [self.max_queue_size, ""]
+        if checkpoint:
+            keys.append(checkpoint[0])
+            arguments[1] = checkpoint[1]
+        for messages in messages_by_key.values():
+            arguments.append(len(messages))
+            arguments.extend(messages)
+        return bool(await self._push_if_room_script(keys=keys, args=arguments))
+
+    """
+    messages_by_key maps every list to (message, idempotency key or None) pairs. Returns None when
+    the overflow policy rejects the batch for lack of room, otherwise (pushed, trimmed).
+    """
+    async def push_idempotent(self, messages_by_key, checkpoint=None):
+        if self._idempotent_push_script is None or self._idempotent_push_script.registered_client is not self.redis_client:
+            self._idempotent_push_script = self.redis_client.register_script(IDEMPOTENT_PUSH_SCRIPT)
+        keys = list(messages_by_key)
+        arguments = [self.max_queue_size, checkpoint[1] if checkpoint else "",
+                     int(self.overflow_policy != "drop_oldest"), self.idempotency_window, len(keys)]
+        for messages in messages_by_key.values():
+            arguments.append(len(messages))
+            for message, idempotency_key in messages:
+                if idempotency_key:
+                    keys.append(idempotency_key_name(self.queue_name, idempotency_key))
+                arguments.extend((int(bool(idempotency_key)), message))
+        if checkpoint:
+            keys.append(checkpoint[0])
+        result = await self._idempotent_push_script(keys=keys, args=arguments)
+        if result == -1:
+            return None
+        return int(result[0]), int(result[1])
+
     """
     Retries are handled by the polling loop in the WebSocket endpoint.
-    """    
-    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS):
+    message_types restricts the read to the keys of those types or glob patterns (see TypeRouter).
+    Messages are published to the tail and popped from the head, so every lane is FIFO, and one
+    BLPOP over all priority lanes serves them in the order chosen by PriorityLanes. Expired messages
+    are dropped and the read continues until subscribe_timeout has passed.
+    """
+    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, message_types=None):
+        start_time = time.perf_counter()
         try:
-            response = await self.redis_client.brpop(self.queue_name, timeout=subscribe_timeout)
-            if response:
-                queue_name, message = response
-                deserialized_message = json.loads(message)
-                logger.info("[RedisQueue:subscribe] Consumed a message. queue name: %s, message: %s",
-                            self.queue_name, response)
-                return deserialized_message
-            logger.info("[RedisQueue:subscribe] No message found in queue.")
-            return None
+            keys = await self.type_router.resolve_keys(self.redis_client, message_types)
+            if not keys:
+                await asyncio.sleep(subscribe_timeout)
+                return None
+
+            lanes = self.priority_lanes.lanes_in_order(keys)
+            deadline = time.monotonic() + subscribe_timeout
+            timeout = subscribe_timeout
+            while True:
+                response = await self.get_blocking_client().blpop(lanes if len(lanes) > 1 else lanes[0], timeout=timeout)
+                if not response:
+                    logger.info("[RedisQueue:subscribe] No message found in queue.", extra=SAMPLED)
+                    return None
+                key, message = response
+                if self.drop_expired([message]):
+                    break
+                # BLPOP blocks forever with a timeout of 0, so an exhausted wait ends here.
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return None
+
+            deserialized_message = self.codec.decode(message)
+            queue_metrics.record_consumed(self.backend_name, 1, start_time)
+            logger.info("[RedisQueue:subscribe] Consumed a message. queue name: %s, message: %s",
+                        key, log_payload(message), extra=SAMPLED)
+            return deserialized_message
         except Exception as e:
+            queue_metrics.consume_errors.inc(backend=self.backend_name)
             logger.error("[RedisQueue:subscribe] Failed to subscribe a message: %s", e)
             return None
 
+    """
+    Blocks until at least one message is available on any lane of the keys selected by message_types,
+    then drains up to max_count - 1 more from the head of that same lane without blocking, so a batch
+    never mixes priorities and the next call re-checks the higher lanes. Returns an empty list on timeout.
+    With raw=True the payloads are returned as stored, without decoding. Expired messages are dropped
+    before they are decoded, so the batch may come back shorter, or empty.
+    On a Redis error it backs off (see get_retry_delay), longer after every consecutive failure,
+    before returning so that a continuous consumer loop does not spin while Redis is unavailable.
+    """
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        _, messages = await self.subscribe_lane_batch(max_count, subscribe_timeout, raw, message_types)
+        return messages
+
+    """
+    subscribe_batch that also returns the lane the batch was popped from (None when it is empty),
+    so the batch can be put back there with requeue().
+    """
+    async def subscribe_lane_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        start_time = time.perf_counter()
+        try:
+            keys = await self.type_router.resolve_keys(self.redis_client, message_types)
+            if not keys:
+                await asyncio.sleep(subscribe_timeout)
+                return None, []
+
+            lanes = self.priority_lanes.lanes_in_order(keys)
+            response = await self.get_blocking_client().blpop(lanes if len(lanes) > 1 else lanes[0], timeout=subscribe_timeout)
+            self._consume_failures = 0
+            if not response:
+                return None, []
+
+            key, message = response
+            messages = [message]
+            if max_count > 1:
+                messages.extend(await self.redis_client.lpop(key, max_count - 1) or [])
+            messages = self.drop_expired(messages)
+            if not messages:
+                return None, []
+            queue_metrics.record_consumed(self.backend_name, len(messages), start_time)
+
+            logger.info("[RedisQueue:subscribe_batch] Consumed %d messages. queue name: %s",
+                        len(messages), key, extra=SAMPLED)
+            if raw:
+                return key, messages
+            return key, [self.codec.decode(message) for message in messages]
+        except Exception as e:
+            queue_metrics.consume_errors.inc(backend=self.backend_name)
+            logger.error("[RedisQueue:subscribe_batch] Failed to subscribe messages: %s", e)
+            self._consume_failures += 1
+            await asyncio.sleep(get_retry_delay(self._consume_failures, self.retry_delay))
+            return None, []
+
+    """
+    Puts raw payloads popped from key back at its head, in their original order, so they are the
+    next ones read from that lane.
+    """
+    async def requeue(self, key, messages):
+        if messages:
+            await self.redis_client.lpush(key, *reversed(messages))
+
+    """
+    Messages popped from a list cannot be redelivered, so there is nothing to acknowledge.
+    """
+    async def ack(self, messages):
+        return True
+
+    """
+    Scans every lane in chunks of batch_size with SWEEP_EXPIRED_SCRIPT. Each chunk is atomic, so only
+    entries that are expired at that moment are removed; consumers popping concurrently may shift
+    the list, in which case a few entries are left for the next sweep or the consumer to drop.
+    """
+    async def sweep_expired(self, batch_size=MESSAGE_EXPIRY_SWEEP_BATCH_SIZE):
+        if self._sweep_expired_script is None or self._sweep_expired_script.registered_client is not self.redis_client:
+            self._sweep_expired_script = self.redis_client.register_script(SWEEP_EXPIRED_SCRIPT)
+        keys = await self.type_router.get_all_keys(self.redis_client)
+        now = time.time()
+        swept = 0
+        for lane in self.priority_lanes.all_lanes(keys):
+            start = 0
+            while True:
+                scanned, removed = await self._sweep_expired_script(keys=[lane], args=[start, batch_size, now])
+                swept += removed
+                start += scanned - removed
+                if scanned < batch_size:
+                    break
+        if swept:
+            self.record_expired(swept)
+        return swept
+
+    """
+    Counts every priority lane of the untyped key and of every recorded type key.
+    """
     async def get_queue_size(self):
         try:
-            return await self.redis_client.llen(self.queue_name)
+            lanes = self.priority_lanes.all_lanes(await self.type_router.get_all_keys(self.redis_client))
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for lane in lanes:
+                    pipe.llen(lane)
+                queue_size = sum(await pipe.execute())
+            queue_metrics.queue_depth.set(queue_size, backend=self.backend_name)
+            return queue_size
         except Exception as e:
             logger.error("[RedisQueue:get_queue_size] Failed to get queue size: %s", e)
             return 0
\ No newline at end of file
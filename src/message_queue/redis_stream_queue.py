@@ -0,0 +1,345 @@
+import asyncio
+import os
+import socket
+import time
+from redis.exceptions import ResponseError
+
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.codec import message_codec
+from src.message_queue.expiry import is_expired
+from src.message_queue.idempotency import IDEMPOTENT_XADD_SCRIPT, idempotency_key_name
+from src.message_queue.redis_connection import create_redis_client, get_retry_delay
+from src.message_queue.type_routing import TypeRouter
+from src.message_queue.priority_lanes import PriorityLanes
+from src.message_queue import queue_metrics
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.config import REDIS_CONNECTION_URL, REDIS_MAX_CONNECTIONS, REDIS_BLOCKING_MAX_CONNECTIONS, REDIS_MAX_RETRIES, REDIS_RETRY_DELAY_SECONDS, REDIS_MESSAGE_QUEUE_MAX_SIZE, REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, REDIS_MESSAGE_DRAIN_BATCH_SIZE, REDIS_STREAM_CONSUMER_GROUP, REDIS_STREAM_CLAIM_MIN_IDLE_SECONDS, REDIS_STREAM_CLAIM_INTERVAL_SECONDS, REDIS_QUEUE_OVERFLOW_POLICY, MESSAGE_IDEMPOTENCY_WINDOW_SECONDS
+
+logger = get_logger(__name__)
+
+STREAM_ENTRY_ID_KEY = "_stream_id"
+STREAM_KEY_KEY = "_stream"
+STREAM_DATA_FIELD = "data"
+
+"""
+Redis Streams backend with the same publish/subscribe interface as RedisQueue.
+
+Messages are appended with XADD and trimmed approximately (MAXLEN ~), and read through a consumer
+group with XREADGROUP so several service B instances share the work. A message stays pending until
+ack() is called after delivery; entries left pending by a dead consumer for longer than
+claim_min_idle seconds are taken over with XAUTOCLAIM, which gives at-least-once delivery.
+
+Each consumed message carries its stream entry id under STREAM_ENTRY_ID_KEY so it can be acked
+and so clients can discard duplicates. For the same reason messages are always decoded, even when
+subscribe_batch is called with raw=True. With per-type routing every type has its own stream, and
+messages read from a stream other than queue_name also carry its name under STREAM_KEY_KEY.
+
+Acked entries stay in the stream until they are trimmed, so its length says nothing about how much
+is still waiting and only the "drop_oldest" overflow policy is supported.
+"""
+class RedisStreamQueue(MessageQueue):
+    backend_name = "stream"
+
+    def __init__(self, queue_name=None,
+                 redis_client=REDIS_CONNECTION_URL,
+                 max_retries=REDIS_MAX_RETRIES,
+                 retry_delay=REDIS_RETRY_DELAY_SECONDS,
+                 connection_url=REDIS_CONNECTION_URL,
+                 max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                 consumer_group=REDIS_STREAM_CONSUMER_GROUP,
+                 consumer_name=None,
+                 claim_min_idle=REDIS_STREAM_CLAIM_MIN_IDLE_SECONDS,
+                 claim_interval=REDIS_STREAM_CLAIM_INTERVAL_SECONDS,
+                 codec=None,
+                 blocking_client=None,
+                 max_connections=REDIS_MAX_CONNECTIONS,
+                 blocking_max_connections=REDIS_BLOCKING_MAX_CONNECTIONS,
+                 priority_lanes=None,
+                 overflow_policy=REDIS_QUEUE_OVERFLOW_POLICY,
+                 idempotency_window=MESSAGE_IDEMPOTENCY_WINDOW_SECONDS):
+
+        if overflow_policy != "drop_oldest":
+            raise ValueError(f"The stream backend does not support the {overflow_policy} overflow policy")
+        self.redis_client = redis_client
+        self.blocking_client = blocking_client
+        self.queue_name = queue_name
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.connection_url = connection_url
+        self.max_queue_size = max_queue_size
+        self.max_connections = max_connections
+        self.blocking_max_connections = blocking_max_connections
+        self.consumer_group = consumer_group
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.claim_min_idle = claim_min_idle
+        self.claim_interval = claim_interval
+        self.codec = codec or message_codec
+        self.type_router = TypeRouter(queue_name)
+        self.priority_lanes = priority_lanes or PriorityLanes()
+        self.idempotency_window = idempotency_window
+        self.expired_messages = 0
+        self.duplicate_messages = 0
+        self._consume_failures = 0
+        self._idempotent_xadd_script = None
+        self._grouped_keys = set()
+        self._last_claim_time = 0
+
+    # Like RedisQueue.connect, only the ping and the group creation are retried.
+    async def connect(self):
+        self.redis_client = create_redis_client(self.connection_url, self.max_connections)
+        self.blocking_client = create_redis_client(self.connection_url, self.blocking_max_connections, blocking=True)
+        for retry in range(1, self.max_retries + 1):
+            try:
+                queue_metrics.connect_attempts.inc(backend=self.backend_name)
+                await self.redis_client.ping()
+                await self.create_consumer_group()
+                logger.info("[RedisStreamQueue:connect] Connected to Redis successfully")
+                return True
+            except Exception as e:
+                queue_metrics.connect_failures.inc(backend=self.backend_name)
+                logger.error("[RedisStreamQueue:connect] Redis connection failed: %s", e)
+                if retry < self.max_retries:
+                    retry_delay = get_retry_delay(retry, self.retry_delay)
+                    logger.info("[RedisStreamQueue:connect] Retrying in %.2f seconds...", retry_delay)
+                    await asyncio.sleep(retry_delay)
+                else:
+                    logger.error("[RedisStreamQueue:connect] All %d attempts failed.", self.max_retries)
+                    await self.redis_client.aclose()
+                    await self.blocking_client.aclose()
+                    self.redis_client = None
+                    self.blocking_client = None
+                    return False
+
+    async def create_consumer_group(self, key=None):
+        key = key or self.queue_name
+        try:
+            await self.redis_client.xgroup_create(key, self.consumer_group, id="0", mkstream=True)
+            logger.info("[RedisStreamQueue:create_consumer_group] Created consumer group: %s on %s", self.consumer_group, key)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._grouped_keys.add(key)
+
+    def get_blocking_client(self):
+        return self.blocking_client or self.redis_client
+
+    async def disconnect(self):
+        if not self.redis_client:
+            logger.error("[RedisStreamQueue:disconnect] Redis is not connected.")
+            return False
+        try:
+            await self.redis_client.aclose()
+            if self.blocking_client:
+                await self.blocking_client.aclose()
+            logger.info("[RedisStreamQueue:disconnect] Disconnected from Redis successfully")
+            return True
+        except Exception as e:
+            logger.error("[RedisStreamQueue:disconnect] Failed to disconnect from Redis: %s", e)
+            return False
+
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        return await self.publish_many([serialized_message], [message_type] if message_type else None,
+                                       [priority] if priority else None, idempotency_keys=[idempotency_key] if idempotency_key else None)
+
+    """
+    checkpoint, a (key, value) pair, is written in the same transaction as the messages (see RedisQueue.publish_many).
+    When idempotency_keys gives a key for any message, the batch is appended by IDEMPOTENT_XADD_SCRIPT,
+    which drops messages whose key was already published within idempotency_window seconds.
+    """
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, checkpoint=None, idempotency_keys=None, partition_keys=None):
+        if not serialized_messages:
+            return True
+        if idempotency_keys and not any(idempotency_keys):
+            idempotency_keys = None
+
+        start_time = time.perf_counter()
+        for retry in range(1, self.max_retries + 1):
+            try:
+                if idempotency_keys:
+                    await self.publish_idempotent(serialized_messages, idempotency_keys, message_types, priorities, checkpoint)
+                else:
+                    async with self.redis_client.pipeline(transaction=True) as pipe:
+                        for index, serialized_message in enumerate(serialized_messages):
+                            key = self.type_router.key_for(message_types[index] if message_types else None)
+                            if priorities:
+                                key = self.priority_lanes.lane_key(key, priorities[index])
+                            pipe.xadd(key, {STREAM_DATA_FIELD: serialized_message},
+                                      maxlen=self.max_queue_size, approximate=True)
+                        if message_types:
+                            pipe.sadd(self.type_router.types_key, *dict.fromkeys(message_type for message_type in message_types if message_type))
+                        if checkpoint:
+                            pipe.set(*checkpoint)
+                        await pipe.execute()
+                queue_metrics.record_published(self.backend_name, len(serialized_messages), start_time)
+                logger.info("[RedisStreamQueue:publish_many] Produced %d messages. stream name: %s",
+                            len(serialized_messages), self.queue_name, extra=SAMPLED)
+                return True
+            except Exception as e:
+                logger.error("[RedisStreamQueue:publish_many] Failed to publish %d messages: %s", len(serialized_messages), e)
+                if retry < self.max_retries:
+                    queue_metrics.publish_retries.inc(backend=self.backend_name)
+                    retry_delay = get_retry_delay(retry, self.retry_delay)
+                    logger.info("[RedisStreamQueue:publish_many] Retrying in %.2f seconds...", retry_delay)
+                    await asyncio.sleep(retry_delay)
+                else:
+                    queue_metrics.publish_failures.inc(backend=self.backend_name)
+                    logger.error("[RedisStreamQueue:publish_many] All %d attempts failed.", self.max_retries)
+                    return False
+
+    async def publish_idempotent(self, serialized_messages, idempotency_keys, message_types, priorities, checkpoint):
+        messages_by_key = {}
+        for index, serialized_message in enumerate(serialized_messages):
+            key = self.type_router.key_for(message_types[index] if message_types else None)
+            if priorities:
+                key = self.priority_lanes.lane_key(key, priorities[index])
+            messages_by_key.setdefault(key, []).append((serialized_message, idempotency_keys[index]))
+
+        if self._idempotent_xadd_script is None or self._idempotent_xadd_script.registered_client is not self.redis_client:
+            self._idempotent_xadd_script = self.redis_client.register_script(IDEMPOTENT_XADD_SCRIPT)
+        keys = list(messages_by_key)
+        arguments = [self.max_queue_size, checkpoint[1] if checkpoint else "", self.idempotency_window, len(keys)]
+        for messages in messages_by_key.values():
+            arguments.append(len(messages))
+            for message, idempotency_key in messages:
+                if idempotency_key:
+                    keys.append(idempotency_key_name(self.queue_name, idempotency_key))
+                arguments.extend((int(bool(idempotency_key)), message))
+        if checkpoint:
+            keys.append(checkpoint[0])
+        pushed = int(await self._idempotent_xadd_script(keys=keys, args=arguments))
+        if message_types:
+            await self.redis_client.sadd(self.type_router.types_key, *dict.fromkeys(message_type for message_type in message_types if message_type))
+
+        duplicates = len(serialized_messages) - pushed
+        if duplicates:
+            self.duplicate_messages += duplicates
+            queue_metrics.duplicate_messages.inc(duplicates, backend=self.backend_name)
+            logger.info("[RedisStreamQueue:publish_idempotent] Skipped %d messages already published. stream name: %s",
+                        duplicates, self.queue_name, extra=SAMPLED)
+
+    async def subscribe(self, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, message_types=None):
+        messages = await self.subscribe_batch(1, subscribe_timeout, message_types=message_types)
+        return messages[0] if messages else None
+
+    """
+    Returns up to max_count messages: entries reclaimed from dead consumers first (checked every
+    claim_interval seconds), otherwise new entries read with a blocking XREADGROUP COUNT over every
+    priority lane of the streams selected by message_types. XREADGROUP returns entries from every
+    stream that has some, in the order the streams were requested, so a batch is ordered by lane.
+    """
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE, subscribe_timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS, raw=False, message_types=None):
+        start_time = time.perf_counter()
+        try:
+            keys = await self.type_router.resolve_keys(self.redis_client, message_types)
+            if not keys:
+                await asyncio.sleep(subscribe_timeout)
+                return []
+            keys = self.priority_lanes.lanes_in_order(keys)
+            for key in keys:
+                if key not in self._grouped_keys:
+                    await self.create_consumer_group(key)
+
+            streams = await self.claim_stale_entries(keys, max_count)
+            if not streams:
+                streams = await self.get_blocking_client().xreadgroup(self.consumer_group, self.consumer_name,
+                                                                     {key: ">" for key in keys}, count=max_count,
+                                                                     block=int(subscribe_timeout * 1000)) or []
+
+            streams = await self.ack_expired_entries(streams)
+            messages = [self.deserialize_entry(key, entry_id, fields)
+                        for key, entries in streams for entry_id, fields in entries if fields]
+            self._consume_failures = 0
+            if messages:
+                queue_metrics.record_consumed(self.backend_name, len(messages), start_time)
+                logger.info("[RedisStreamQueue:subscribe_batch] Consumed %d messages. stream name: %s",
+                            len(messages), self.queue_name, extra=SAMPLED)
+            return messages
+        except Exception as e:
+            queue_metrics.consume_errors.inc(backend=self.backend_name)
+            logger.error("[RedisStreamQueue:subscribe_batch] Failed to subscribe messages: %s", e)
+            self._consume_failures += 1
+            await asyncio.sleep(get_retry_delay(self._consume_failures, self.retry_delay))
+            return []
+
+    """
+    Acks expired entries straight away, so they are neither delivered nor reclaimed later, and
+    returns the streams without them. Entries are checked before they are decoded (see get_expires_at).
+    Expired entries that are never read stay in the stream until it is trimmed.
+    """
+    async def ack_expired_entries(self, streams):
+        now = time.time()
+        fresh_streams = []
+        for key, entries in streams:
+            fresh_entries = []
+            expired_ids = []
+            for entry_id, fields in entries:
+                if fields and is_expired(self.get_payload(fields), now, self.codec):
+                    expired_ids.append(entry_id)
+                else:
+                    fresh_entries.append((entry_id, fields))
+            if expired_ids:
+                await self.redis_client.xack(key, self.consumer_group, *expired_ids)
+                self.record_expired(len(expired_ids))
+            fresh_streams.append((key, fresh_entries))
+        return fresh_streams
+
+    async def claim_stale_entries(self, keys, max_count):
+        now = time.monotonic()
+        if now - self._last_claim_time < self.claim_interval:
+            return []
+        self._last_claim_time = now
+
+        streams = []
+        remaining = max_count
+        for key in keys:
+            if remaining <= 0:
+                break
+            response = await self.redis_client.xautoclaim(key, self.consumer_group, self.consumer_name,
+                                                          min_idle_time=int(self.claim_min_idle * 1000),
+                                                          start_id="0-0", count=remaining)
+            entries = response[1]
+            remaining -= len(entries)
+            if entries:
+                logger.warning("[RedisStreamQueue:claim_stale_entries] Reclaimed %d pending messages from %s.", len(entries), key)
+                streams.append((key, entries))
+        return streams
+
+    async def ack(self, messages):
+        entry_ids_by_key = {}
+        for message in messages:
+            if STREAM_ENTRY_ID_KEY in message:
+                key = message.get(STREAM_KEY_KEY, self.queue_name)
+                entry_ids_by_key.setdefault(key, []).append(message[STREAM_ENTRY_ID_KEY])
+        if not entry_ids_by_key:
+            return True
+        try:
+            for key, entry_ids in entry_ids_by_key.items():
+                await self.redis_client.xack(key, self.consumer_group, *entry_ids)
+            return True
+        except Exception as e:
+            logger.error("[RedisStreamQueue:ack] Failed to ack messages: %s", e)
+            return False
+
+    async def get_queue_size(self):
+        try:
+            lanes = self.priority_lanes.all_lanes(await self.type_router.get_all_keys(self.redis_client))
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for lane in lanes:
+                    pipe.xlen(lane)
+                queue_size = sum(await pipe.execute())
+            queue_metrics.queue_depth.set(queue_size, backend=self.backend_name)
+            return queue_size
+        except Exception as e:
+            logger.error("[RedisStreamQueue:get_queue_size] Failed to get queue size: %s", e)
+            return 0
+
+    def get_payload(self, fields):
+        return fields.get(STREAM_DATA_FIELD.encode()) or fields.get(STREAM_DATA_FIELD)
+
+    def deserialize_entry(self, key, entry_id, fields):
+        message = self.codec.decode(self.get_payload(fields))
+        message[STREAM_ENTRY_ID_KEY] = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        key = key.decode() if isinstance(key, bytes) else key
+        if key != self.queue_name:
+            message[STREAM_KEY_KEY] = key
+        return message
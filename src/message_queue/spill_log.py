@@ -0,0 +1,356 @@
+import asyncio
+import os
+import struct
+import uuid
+import zlib
+from collections import namedtuple
+
+from src.message_queue.overflow import QueueFullError
+from src.utils.logger import get_logger
+from src.utils.config import MESSAGE_SPILL_DIRECTORY, MESSAGE_SPILL_SEGMENT_MAX_BYTES, MESSAGE_SPILL_FSYNC_INTERVAL_SECONDS, MESSAGE_SPILL_REPLAY_BATCH_SIZE, MESSAGE_SPILL_REPLAY_INTERVAL_SECONDS
+
+logger = get_logger(__name__)
+
+"""
+Record layout
+
+Every record is a frame: FRAME_HEADER (body length, sequence number, CRC32 of the body) followed by
+the body. The body is BODY_HEADER (flags, priority, length of the message type), the UTF-8 message
+type and the serialized message. FLAG_TEXT marks messages that were str rather than bytes.
+FLAG_IDEMPOTENCY_KEY marks records whose message type is followed by KEY_HEADER (the key's length)
+and the UTF-8 idempotency key.
+A frame that is cut short or fails its CRC marks the end of the valid data in a segment.
+"""
+FRAME_HEADER = struct.Struct(">IQI")
+BODY_HEADER = struct.Struct(">BBH")
+KEY_HEADER = struct.Struct(">H")
+FLAG_TEXT = 1
+FLAG_IDEMPOTENCY_KEY = 2
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+CHECKPOINT_FILE = "checkpoint"
+LOG_ID_FILE = "log_id"
+
+SpillRecord = namedtuple("SpillRecord", ["sequence", "serialized_message", "message_type", "priority", "idempotency_key"])
+
+
+def encode_record(sequence, serialized_message, message_type=None, priority=0, idempotency_key=None):
+    flags = 0
+    if isinstance(serialized_message, str):
+        serialized_message = serialized_message.encode()
+        flags |= FLAG_TEXT
+    type_bytes = message_type.encode() if message_type else b""
+    key_bytes = b""
+    if idempotency_key:
+        flags |= FLAG_IDEMPOTENCY_KEY
+        key_bytes = idempotency_key.encode()
+        key_bytes = KEY_HEADER.pack(len(key_bytes)) + key_bytes
+    body = BODY_HEADER.pack(flags, priority, len(type_bytes)) + type_bytes + key_bytes + serialized_message
+    return FRAME_HEADER.pack(len(body), sequence, zlib.crc32(body)) + body
+
+
+"""
+Yields (record, end_offset) for every valid frame of a segment file, starting at offset.
+"""
+def read_records(path, offset=0):
+    with open(path, "rb") as segment_file:
+        segment_file.seek(offset)
+        while True:
+            header = segment_file.read(FRAME_HEADER.size)
+            if len(header) < FRAME_HEADER.size:
+                return
+            length, sequence, checksum = FRAME_HEADER.unpack(header)
+            body = segment_file.read(length)
+            if len(body) < length or zlib.crc32(body) != checksum:
+                return
+
+            flags, priority, type_length = BODY_HEADER.unpack_from(body)
+            type_end = BODY_HEADER.size + type_length
+            message_type = body[BODY_HEADER.size:type_end].decode() or None
+            idempotency_key = None
+            message_start = type_end
+            if flags & FLAG_IDEMPOTENCY_KEY:
+                key_length, = KEY_HEADER.unpack_from(body, type_end)
+                key_start = type_end + KEY_HEADER.size
+                message_start = key_start + key_length
+                idempotency_key = body[key_start:message_start].decode()
+            serialized_message = body[message_start:]
+            if flags & FLAG_TEXT:
+                serialized_message = serialized_message.decode()
+            offset += FRAME_HEADER.size + length
+            yield SpillRecord(sequence, serialized_message, message_type, priority, idempotency_key), offset
+
+
+"""
+An append-only log on local disk that holds publishes while Redis is unavailable.
+
+Records get consecutive sequence numbers and are written to segment files named after the first
+sequence number they hold; a new segment is started once the current one reaches segment_max_bytes.
+Appends are buffered and made durable by one fsync per fsync_interval shared by every append in that
+window (group commit); append_many returns only after its records are on disk.
+
+Replay progress is kept as the last replayed sequence number. Segments that only hold replayed
+records are deleted. On open, a torn or corrupt tail left by a crash is truncated.
+"""
+class SpillLog:
+    def __init__(self, directory=MESSAGE_SPILL_DIRECTORY,
+                 segment_max_bytes=MESSAGE_SPILL_SEGMENT_MAX_BYTES,
+                 fsync_interval=MESSAGE_SPILL_FSYNC_INTERVAL_SECONDS):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_interval
+        self.log_id = None
+        self.next_sequence = 1
+        self.synced_sequence = 0
+        self.replayed_sequence = 0
+        self._segments = []
+        self._file = None
+        self._sync_future = None
+        self._sync_task = None
+        self._sync_lock = asyncio.Lock()
+        self._read_position = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.log_id = self._read_or_create_log_id()
+        self.replayed_sequence = self._read_checkpoint()
+        self._segments = sorted(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+                                if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+        last_sequence = self.replayed_sequence
+        if self._segments:
+            last_sequence = max(last_sequence, self._recover_segment(self._segments[-1]))
+        self.next_sequence = last_sequence + 1
+        self.synced_sequence = last_sequence
+        self._read_position = (self._segments[0], 0) if self._segments else None
+        if not self._segments:
+            self._start_segment()
+        else:
+            self._file = open(self._segment_path(self._segments[-1]), "ab")
+        logger.info("[SpillLog:open] Opened spill log %s. pending records: %d", self.directory, self.get_pending_count())
+
+    async def close(self):
+        if self._file is None:
+            return
+        if self._sync_future is not None:
+            await self._sync_future
+        async with self._sync_lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def is_active(self):
+        return self.replayed_sequence < self.next_sequence - 1
+
+    def get_pending_count(self):
+        return self.next_sequence - 1 - self.replayed_sequence
+
+    async def append_many(self, serialized_messages, message_types=None, priorities=None, idempotency_keys=None):
+        for index, serialized_message in enumerate(serialized_messages):
+            self._file.write(encode_record(self.next_sequence, serialized_message,
+                                           message_types[index] if message_types else None,
+                                           priorities[index] if priorities else 0,
+                                           idempotency_keys[index] if idempotency_keys else None))
+            self.next_sequence += 1
+
+        if self._sync_future is None:
+            self._sync_future = asyncio.get_running_loop().create_future()
+            asyncio.get_running_loop().call_later(self.fsync_interval, self._schedule_sync)
+        await asyncio.shield(self._sync_future)
+
+    """
+    Returns up to max_count durable records after the last replayed one, in order.
+    """
+    def read_batch(self, max_count=MESSAGE_SPILL_REPLAY_BATCH_SIZE):
+        records = []
+        if self._read_position is None:
+            return records
+
+        first_sequence, offset = self._read_position
+        for segment in self._segments[self._segments.index(first_sequence):]:
+            if segment != first_sequence:
+                offset = 0
+            for record, end_offset in read_records(self._segment_path(segment), offset):
+                if record.sequence > self.synced_sequence:
+                    return records
+                if record.sequence <= self.replayed_sequence:
+                    # Replayed records are skipped for good, so later reads start after them.
+                    self._read_position = (segment, end_offset)
+                    continue
+                records.append(record)
+                if len(records) >= max_count:
+                    return records
+        return records
+
+    def mark_replayed(self, sequence):
+        if sequence <= self.replayed_sequence:
+            return
+        self.replayed_sequence = min(sequence, self.next_sequence - 1)
+        self._write_checkpoint()
+        # A segment is fully replayed once the next one starts at or before the following sequence number.
+        while len(self._segments) > 1 and self._segments[1] <= self.replayed_sequence + 1:
+            os.remove(self._segment_path(self._segments.pop(0)))
+            if self._read_position and self._read_position[0] not in self._segments:
+                self._read_position = (self._segments[0], 0)
+
+    def _schedule_sync(self):
+        self._sync_task = asyncio.create_task(self._sync())
+
+    async def _sync(self):
+        future, self._sync_future = self._sync_future, None
+        async with self._sync_lock:
+            sequence = self.next_sequence - 1
+            segment_file = self._file
+            try:
+                segment_file.flush()
+                # Rotate before the fsync so that appends made meanwhile go to the new segment.
+                if segment_file.tell() >= self.segment_max_bytes:
+                    self._start_segment()
+                await asyncio.to_thread(os.fsync, segment_file.fileno())
+                if segment_file is not self._file:
+                    segment_file.close()
+                self.synced_sequence = sequence
+                future.set_result(sequence)
+            except Exception as e:
+                logger.error("[SpillLog:sync] Failed to write the spill log: %s", e)
+                future.set_exception(e)
+
+    def _start_segment(self):
+        self._segments.append(self.next_sequence)
+        self._file = open(self._segment_path(self.next_sequence), "ab")
+        if self._read_position is None:
+            self._read_position = (self.next_sequence, 0)
+
+    def _recover_segment(self, first_sequence):
+        path = self._segment_path(first_sequence)
+        last_sequence, valid_length = first_sequence - 1, 0
+        for record, end_offset in read_records(path):
+            last_sequence, valid_length = record.sequence, end_offset
+        if valid_length < os.path.getsize(path):
+            logger.warning("[SpillLog:recover_segment] Truncating a torn record at the end of %s", path)
+            os.truncate(path, valid_length)
+        return last_sequence
+
+    def _segment_path(self, first_sequence):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_sequence:020d}{SEGMENT_SUFFIX}")
+
+    def _read_or_create_log_id(self):
+        path = os.path.join(self.directory, LOG_ID_FILE)
+        if os.path.exists(path):
+            with open(path) as log_id_file:
+                return log_id_file.read().strip()
+        log_id = uuid.uuid4().hex
+        with open(path, "w") as log_id_file:
+            log_id_file.write(log_id)
+        return log_id
+
+    def _read_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path) as checkpoint_file:
+            return int(checkpoint_file.read().strip() or 0)
+
+    def _write_checkpoint(self):
+        # Not fsynced: Redis holds the authoritative checkpoint (see SpillReplayer), this one only saves rescanning.
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "w") as checkpoint_file:
+            checkpoint_file.write(str(self.replayed_sequence))
+        os.replace(path + ".tmp", path)
+
+
+"""
+Replays a SpillLog into the queue in order, reconnecting first if the queue never connected.
+
+Every batch is published together with a checkpoint key in Redis holding its last sequence number,
+in the same transaction (see RedisQueue.publish_many). Before the first batch the checkpoint is read
+back, so records that reached Redis just before a crash are skipped instead of published twice.
+"""
+class SpillReplayer:
+    def __init__(self, spill_log, redis_queue,
+                 batch_size=MESSAGE_SPILL_REPLAY_BATCH_SIZE,
+                 retry_interval=MESSAGE_SPILL_REPLAY_INTERVAL_SECONDS,
+                 connected=True):
+        self.spill_log = spill_log
+        self.redis_queue = redis_queue
+        self.batch_size = batch_size
+        self.retry_interval = retry_interval
+        self.connected = connected
+        self._checkpoint_loaded = False
+        self._has_records = asyncio.Event()
+        self._replay_task = None
+
+    @property
+    def checkpoint_key(self):
+        return f"{self.redis_queue.queue_name}:spill:{self.spill_log.log_id}"
+
+    async def start(self):
+        if self._replay_task is None:
+            self._replay_task = asyncio.create_task(self._replay_loop())
+            self.notify()
+
+    async def stop(self):
+        if self._replay_task:
+            self._replay_task.cancel()
+            try:
+                await self._replay_task
+            except asyncio.CancelledError:
+                pass
+            self._replay_task = None
+
+    def notify(self):
+        self._has_records.set()
+
+    async def _replay_loop(self):
+        while True:
+            await self._has_records.wait()
+            if not self.spill_log.is_active():
+                self._has_records.clear()
+                continue
+            try:
+                if not await self.replay_batch():
+                    await asyncio.sleep(self.retry_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[SpillReplayer:replay_loop] Error: %s", e)
+                await asyncio.sleep(self.retry_interval)
+
+    async def replay_batch(self):
+        if not self.connected:
+            self.connected = await self.redis_queue.connect()
+            if not self.connected:
+                return False
+
+        if not self._checkpoint_loaded:
+            checkpoint = await self.redis_queue.redis_client.get(self.checkpoint_key)
+            self.spill_log.mark_replayed(int(checkpoint or 0))
+            self._checkpoint_loaded = True
+
+        records = self.spill_log.read_batch(self.batch_size)
+        if not records:
+            # The remaining records are not durable yet; they are replayed after the next fsync.
+            await asyncio.sleep(self.spill_log.fsync_interval)
+            return True
+
+        message_types = [record.message_type for record in records]
+        priorities = [record.priority for record in records]
+        idempotency_keys = [record.idempotency_key for record in records]
+        last_sequence = records[-1].sequence
+        try:
+            published = await self.redis_queue.publish_many([record.serialized_message for record in records],
+                                                            message_types if any(message_types) else None,
+                                                            priorities if any(priorities) else None,
+                                                            checkpoint=(self.checkpoint_key, last_sequence),
+                                                            idempotency_keys=idempotency_keys if any(idempotency_keys) else None)
+        except QueueFullError:
+            published = False
+        if not published:
+            return False
+
+        self.spill_log.mark_replayed(last_sequence)
+        logger.info("[SpillReplayer:replay_batch] Replayed %d spilled messages, %d left.",
+                    len(records), self.spill_log.get_pending_count())
+        return True
@@ -0,0 +1,53 @@
+import fnmatch
+import time
+
+from src.utils.config import MESSAGE_TYPE_KEY_REFRESH_SECONDS
+
+GLOB_CHARACTERS = "*?["
+
+"""
+Maps message types to Redis keys when per-type routing is enabled.
+
+A message of type "orders" published to queue "message_queue" is stored under "message_queue:type:orders",
+and the type is recorded in the "message_queue:types" set. Type keys have their own ":type:" namespace,
+so a type such as "types" or "dead" cannot land on one of the queue's internal keys. Subscribers declare the types they want,
+either literally or as glob patterns. Patterns are resolved against that set, and the result is
+cached for refresh_interval seconds, so new types show up after at most one refresh.
+"""
+class TypeRouter:
+    def __init__(self, queue_name, refresh_interval=MESSAGE_TYPE_KEY_REFRESH_SECONDS):
+        self.queue_name = queue_name
+        self.refresh_interval = refresh_interval
+        self.types_key = f"{queue_name}:types"
+        self._known_types = []
+        self._last_refresh_time = None
+
+    def key_for(self, message_type):
+        return f"{self.queue_name}:type:{message_type}" if message_type else self.queue_name
+
+    async def resolve_keys(self, redis_client, message_types):
+        if not message_types:
+            return [self.queue_name]
+
+        patterns = [message_type for message_type in message_types if any(c in message_type for c in GLOB_CHARACTERS)]
+        resolved_types = [message_type for message_type in message_types if message_type not in patterns]
+        if patterns:
+            for known_type in await self.get_known_types(redis_client):
+                if known_type not in resolved_types and any(fnmatch.fnmatchcase(known_type, pattern) for pattern in patterns):
+                    resolved_types.append(known_type)
+
+        return [self.key_for(message_type) for message_type in resolved_types]
+
+    """
+    Returns the untyped key followed by the key of every type recorded so far.
+    """
+    async def get_all_keys(self, redis_client):
+        return [self.queue_name] + [self.key_for(message_type) for message_type in await self.get_known_types(redis_client)]
+
+    async def get_known_types(self, redis_client):
+        now = time.monotonic()
+        if self._last_refresh_time is None or now - self._last_refresh_time >= self.refresh_interval:
+            members = await redis_client.smembers(self.types_key)
+            self._known_types = sorted(member.decode() if isinstance(member, bytes) else member for member in members)
+            self._last_refresh_time = now
+        return self._known_types
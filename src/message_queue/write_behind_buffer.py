@@ -0,0 +1,128 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+
+from src.message_queue.overflow import QueueFullError
+from src.message_queue.redis_connection import get_retry_delay
+from src.utils.logger import get_logger, SAMPLED
+from src.utils.config import MESSAGE_WRITE_BEHIND_BUFFER_SIZE, MESSAGE_WRITE_BEHIND_BATCH_SIZE, MESSAGE_WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS, REDIS_RETRY_DELAY_SECONDS
+
+logger = get_logger(__name__)
+
+"""
+Accepts messages into a bounded in-process buffer and writes them to the queue from a background
+task, so the caller never waits for Redis.
+
+The flusher hands up to max_batch_size messages per call to publisher.publish_many, in the order they
+were accepted. The publisher is normally the MessagePublisher, so flushed batches are counted and, with
+a spill log, spilled like any other publish. A message stays in the buffer until its batch is written;
+when the publish fails or the queue is full the flusher backs off (see get_retry_delay) and retries the same batch. close() stops accepting
+messages and gives the flusher shutdown_timeout seconds to write what is left.
+Messages still buffered when the process dies are lost.
+"""
+class WriteBehindBuffer:
+    def __init__(self, publisher,
+                 max_size=MESSAGE_WRITE_BEHIND_BUFFER_SIZE,
+                 max_batch_size=MESSAGE_WRITE_BEHIND_BATCH_SIZE,
+                 retry_delay=REDIS_RETRY_DELAY_SECONDS,
+                 shutdown_timeout=MESSAGE_WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS):
+        self.publisher = publisher
+        self.max_size = max_size
+        self.max_batch_size = max_batch_size
+        self.retry_delay = retry_delay
+        self.shutdown_timeout = shutdown_timeout
+        self._entries = deque()
+        self._has_entries = asyncio.Event()
+        self._flusher_task = None
+        self._closing = False
+        self._flush_failures = 0
+
+    async def start(self):
+        if self._flusher_task is None:
+            self._closing = False
+            self._flusher_task = asyncio.create_task(self._flush_loop())
+            logger.info("[WriteBehindBuffer:start] Flusher started. buffer size: %d", self.max_size)
+
+    async def close(self):
+        if self._flusher_task is None:
+            return
+        self._closing = True
+        self._has_entries.set()
+        try:
+            await asyncio.wait_for(self._flusher_task, self.shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.error("[WriteBehindBuffer:close] Shutdown timed out, %d buffered messages were not written.", len(self._entries))
+        self._flusher_task = None
+        logger.info("[WriteBehindBuffer:close] Flusher stopped.")
+
+    """
+    Returns False, without buffering anything, when the messages do not all fit or the buffer is closing.
+    """
+    def offer_many(self, serialized_messages, message_types=None, priorities=None, idempotency_keys=None, partition_keys=None):
+        if self._closing or len(self._entries) + len(serialized_messages) > self.max_size:
+            return False
+
+        enqueued_at = time.monotonic()
+        for index, serialized_message in enumerate(serialized_messages):
+            self._entries.append((serialized_message,
+                                  message_types[index] if message_types else None,
+                                  priorities[index] if priorities else 0,
+                                  idempotency_keys[index] if idempotency_keys else None,
+                                  partition_keys[index] if partition_keys else None,
+                                  enqueued_at))
+        self._has_entries.set()
+        return True
+
+    def offer(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        return self.offer_many([serialized_message], [message_type], [priority], [idempotency_key], [partition_key])
+
+    def get_depth(self):
+        return len(self._entries)
+
+    def get_oldest_age(self):
+        return time.monotonic() - self._entries[0][5] if self._entries else 0
+
+    async def _flush_loop(self):
+        while True:
+            await self._has_entries.wait()
+            if not self._entries:
+                if self._closing:
+                    return
+                self._has_entries.clear()
+                continue
+            try:
+                await self.flush_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[WriteBehindBuffer:flush_loop] Error: %s", e)
+
+    async def flush_batch(self):
+        batch = list(itertools.islice(self._entries, self.max_batch_size))
+        message_types = [message_type for _, message_type, _, _, _, _ in batch]
+        priorities = [priority for _, _, priority, _, _, _ in batch]
+        idempotency_keys = [idempotency_key for _, _, _, idempotency_key, _, _ in batch]
+        partition_keys = [partition_key for _, _, _, _, partition_key, _ in batch]
+        try:
+            published = await self.publisher.publish_many([message for message, _, _, _, _, _ in batch],
+                                                          message_types if any(message_types) else None,
+                                                          priorities if any(priorities) else None,
+                                                          idempotency_keys=idempotency_keys if any(idempotency_keys) else None,
+                                                          partition_keys=partition_keys if any(partition_keys) else None)
+        except QueueFullError:
+            published = False
+
+        if not published:
+            self._flush_failures += 1
+            retry_delay = get_retry_delay(self._flush_failures, self.retry_delay)
+            logger.warning("[WriteBehindBuffer:flush_batch] Failed to write %d messages, %d buffered. Retrying in %.2f seconds...",
+                           len(batch), len(self._entries), retry_delay, extra=SAMPLED)
+            await asyncio.sleep(retry_delay)
+            return False
+
+        self._flush_failures = 0
+        for _ in batch:
+            self._entries.popleft()
+        logger.debug("[WriteBehindBuffer:flush_batch] Wrote %d messages, %d buffered.", len(batch), len(self._entries))
+        return True
@@ -1,20 +1,41 @@
-from fastapi import FastAPI, HTTPException, status
+import math
+import time
+from fastapi import FastAPI, HTTPException, Header, Request, Response, status
+from fastapi.responses import PlainTextResponse, JSONResponse
 from contextlib import asynccontextmanager
-import json
+from typing import List, Optional
+from pydantic import ValidationError
 
 from src.service_a.message import Message
 from src.service_a.message_publisher import MessagePublisher
-from src.utils.config import MESSAGE_MAX_CONTENT_LENGTH
-from src.utils.logger import logger
+from src.service_a.rate_limiter import TokenBucketRateLimiter
+from src.service_a.stream_ingest import ChunkedPublisher, read_ndjson, read_msgpack, msgpack, MSGPACK_CONTENT_TYPES
+from src.message_queue.codec import message_codec
+from src.message_queue.expiry import build_envelope
+from src.message_queue.overflow import QueueFullError
+from src.utils.config import MESSAGE_MAX_CONTENT_LENGTH, MESSAGE_MAX_BATCH_SIZE, MESSAGE_TYPE_ROUTING_ENABLED, QUEUE_FULL_RETRY_AFTER_SECONDS, RATE_LIMIT_ENABLED, RATE_LIMIT_KEY, MESSAGE_STREAM_MAX_REPORTED_ERRORS, MESSAGE_IDEMPOTENCY_KEY_MAX_LENGTH, MESSAGE_DEFAULT_TTL_SECONDS
+from src.utils.logger import get_logger, log_payload, SAMPLED
+from src.utils.metrics import Counter, Gauge, metrics_registry
+from src.utils.tracing import tracer
+
+logger = get_logger(__name__)
+
+rate_limited_messages = Counter("service_a_rate_limited_messages_total", "Messages rejected by the rate limiter before reaching the queue.")
+invalid_stream_records = Counter("service_a_stream_invalid_records_total", "Records of a streamed request body skipped because they failed validation.")
 
 message_publisher = MessagePublisher()
+rate_limiter = TokenBucketRateLimiter() if RATE_LIMIT_ENABLED else None
+write_behind_depth = Gauge("service_a_write_behind_depth_messages", "Messages accepted but not yet written to the queue.",
+                           callback=message_publisher.get_buffer_depth)
+write_behind_age = Gauge("service_a_write_behind_oldest_age_seconds", "Age of the oldest message waiting in the write-behind buffer.",
+                         callback=message_publisher.get_buffer_age)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     if await message_publisher.connect():
         logger.info("[serviceA:Lifespan] Message publisher connected")
     else:
-        logger.error("[serviceA:Lifespan] Failed to connect to message publisher")        
+        logger.error("[serviceA:Lifespan] Failed to connect to message publisher")
         raise RuntimeError()
 
     yield
@@ -26,25 +47,260 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(lifespan=lifespan)
 
-@app.post('/messages')
-async def produce_message(message:Message):
-
+def get_message_error(message: Message):
     if not message.content.strip() or not message.type.strip():
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
-                            detail="message or type is empty")
-    
+        return "message or type is empty"
     if len(message.content) > MESSAGE_MAX_CONTENT_LENGTH:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
-                            detail="message is too long")
-    
-    message_data_dict = message.model_dump()
+        return "message is too long"
+    if message.deadline is not None and message.deadline <= time.time():
+        return "deadline has already passed"
+    return None
+
+def validate_message(message: Message):
+    error = get_message_error(message)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=error)
+
+"""
+Returns (message, None) for a valid stream record, otherwise (None, the reason it was rejected).
+"""
+def parse_stream_record(record, parse):
+    if record is None:
+        return None, "record is too long"
+    try:
+        message = parse(record)
+    except ValidationError as e:
+        error = e.errors()[0]
+        location = ".".join(str(part) for part in error["loc"])
+        return None, f"{location}: {error['msg']}" if location else error["msg"]
+    error = get_message_error(message)
+    return (None, error) if error else (message, None)
+
+"""
+Sheds load before it reaches Redis: one token bucket per client address, or per message type
+when RATE_LIMIT_KEY is "type" (see TokenBucketRateLimiter).
+"""
+def check_rate_limit(request: Request, messages: List[Message]):
+    if rate_limiter is None:
+        return
+
+    if RATE_LIMIT_KEY == "type":
+        costs = {}
+        for message in messages:
+            costs[message.type] = costs.get(message.type, 0) + 1
+    else:
+        costs = {request.client.host if request.client else "unknown": len(messages)}
+
+    allowed, retry_after = rate_limiter.try_acquire(costs)
+    if not allowed:
+        rate_limited_messages.inc(len(messages))
+        logger.warning("[serviceA:check_rate_limit] Rate limit exceeded, rejected %d messages", len(messages), extra=SAMPLED)
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail="rate limit exceeded",
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+def queue_full_error():
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                         detail="queue is full",
+                         headers={"Retry-After": str(QUEUE_FULL_RETRY_AFTER_SECONDS)})
+
+"""
+Stores the message in an envelope (see build_envelope): the enqueue time, the expiry derived
+from ttl_seconds, deadline or MESSAGE_DEFAULT_TTL_SECONDS, placed first so consumers can drop
+expired messages without decoding them, and the trace context when the message is sampled.
+"""
+def serialize_message(message: Message, trace=None):
+    # Fields left at their default (priority 0) are not stored with the message.
+    message_data_dict = build_envelope(message.model_dump(exclude_defaults=True, exclude={"ttl_seconds", "deadline"}),
+                                       time.time(), message.ttl_seconds or MESSAGE_DEFAULT_TTL_SECONDS, message.deadline, trace)
+    # An in-process queue hands the object to service B by reference, so there is nothing to encode.
+    if message_publisher.redis_queue.stores_objects:
+        return message_data_dict
+    return message_codec.encode(message_data_dict)
+
+def get_idempotency_keys(messages):
+    idempotency_keys = [message.idempotency_key for message in messages]
+    return idempotency_keys if any(idempotency_keys) else None
+
+"""
+A partitioned queue places messages by their key, or by their type when they have none (see
+get_partition_key); handing it the keys saves decoding every payload again.
+"""
+def get_partition_keys(messages):
+    return [message.key or message.type for message in messages]
+
+"""
+In write-behind mode the message is only buffered (see WriteBehindBuffer) and the endpoint answers
+202 Accepted without waiting for Redis; a full buffer is reported like a full queue.
+"""
+def accept_messages(response: Response, serialized_messages, message_types, priorities, idempotency_keys, partition_keys):
+    if not message_publisher.enqueue_many(serialized_messages, message_types, priorities, idempotency_keys, partition_keys):
+        raise queue_full_error()
+    response.status_code = status.HTTP_202_ACCEPTED
+
+@app.post('/messages')
+async def produce_message(message:Message, request: Request, response: Response,
+                          idempotency_key: Optional[str] = Header(default=None, max_length=MESSAGE_IDEMPOTENCY_KEY_MAX_LENGTH)):
+    received_at = time.time()
+    if idempotency_key and not message.idempotency_key:
+        message.idempotency_key = idempotency_key
+
+    validate_message(message)
+    check_rate_limit(request, [message])
+
+    trace = tracer.start_trace(received_at)
+    serialized_message = serialize_message(message, trace)
+    logger.info("[serviceA:produce_message] Serialized message: %s", log_payload(serialized_message), extra=SAMPLED)
 
-    serialized_message = json.dumps(message_data_dict)
-    logger.info("[serviceA:produce_message] Serialized message: %s", serialized_message)
 
+    message_type = message.type if MESSAGE_TYPE_ROUTING_ENABLED else None
+    publish_start = time.time()
+    if message_publisher.write_behind:
+        accept_messages(response, [serialized_message], [message_type], [message.priority], [message.idempotency_key],
+                        get_partition_keys([message]))
+        tracer.finish_publish([trace], publish_start)
+        return {"status": "accepted", "detail": "Message accepted"}
 
-    if not await message_publisher.publish(serialized_message):
+    try:
+        published = await message_publisher.publish(serialized_message, message_type, message.priority, message.idempotency_key,
+                                                    message.key or message.type)
+    except QueueFullError:
+        raise queue_full_error()
+    if not published:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                             detail="Failed to publish the message")
 
-    return {"status": "success", "detail": "Message queued"}
\ No newline at end of file
+    tracer.finish_publish([trace], publish_start)
+    return {"status": "success", "detail": "Message queued"}
+
+@app.post('/messages/batch')
+async def produce_messages(messages:List[Message], request: Request, response: Response):
+
+    received_at = time.time()
+    if not messages:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="batch is empty")
+
+    if len(messages) > MESSAGE_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="batch is too large")
+
+    for message in messages:
+        validate_message(message)
+    check_rate_limit(request, messages)
+
+    traces = [tracer.start_trace(received_at) for _ in messages]
+    serialized_messages = [serialize_message(message, trace) for message, trace in zip(messages, traces)]
+    logger.info("[serviceA:produce_messages] Serialized %d messages", len(serialized_messages), extra=SAMPLED)
+
+    message_types = [message.type for message in messages] if MESSAGE_TYPE_ROUTING_ENABLED else None
+    priorities = [message.priority for message in messages]
+    idempotency_keys = get_idempotency_keys(messages)
+    partition_keys = get_partition_keys(messages)
+    publish_start = time.time()
+    if message_publisher.write_behind:
+        accept_messages(response, serialized_messages, message_types, priorities, idempotency_keys, partition_keys)
+        tracer.finish_publish(traces, publish_start)
+        return {"status": "accepted", "detail": f"{len(serialized_messages)} messages accepted"}
+
+    try:
+        published = await message_publisher.publish_many(serialized_messages, message_types, priorities if any(priorities) else None,
+                                                          idempotency_keys, partition_keys)
+    except QueueFullError:
+        raise queue_full_error()
+    if not published:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                            detail="Failed to publish the messages")
+
+    tracer.finish_publish(traces, publish_start)
+    return {"status": "success", "detail": f"{len(serialized_messages)} messages queued"}
+
+"""
+Ingests an NDJSON body, or concatenated msgpack objects with Content-Type application/msgpack, while
+it is still arriving: valid records are published in chunks of MESSAGE_STREAM_CHUNK_SIZE (see
+ChunkedPublisher), so memory does not grow with the body. Invalid records are skipped and reported by
+line. When a chunk cannot be published the stream stops with that error, and last_line tells the
+client where to resume.
+"""
+@app.post('/messages/stream')
+async def produce_message_stream(request: Request):
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                                detail="msgpack is not installed")
+        records, parse = read_msgpack(request.stream()), Message.model_validate
+    else:
+        records, parse = read_ndjson(request.stream()), Message.model_validate_json
+
+    async def publish_chunk(messages):
+        received_at = time.time()
+        check_rate_limit(request, messages)
+        traces = [tracer.start_trace(received_at) for _ in messages]
+        serialized_messages = [serialize_message(message, trace) for message, trace in zip(messages, traces)]
+        message_types = [message.type for message in messages] if MESSAGE_TYPE_ROUTING_ENABLED else None
+        priorities = [message.priority for message in messages]
+        idempotency_keys = get_idempotency_keys(messages)
+        partition_keys = get_partition_keys(messages)
+        publish_start = time.time()
+        if message_publisher.write_behind:
+            if not message_publisher.enqueue_many(serialized_messages, message_types, priorities, idempotency_keys, partition_keys):
+                raise queue_full_error()
+            tracer.finish_publish(traces, publish_start)
+            return
+
+        try:
+            published = await message_publisher.publish_many(serialized_messages, message_types, priorities if any(priorities) else None,
+                                                              idempotency_keys, partition_keys)
+        except QueueFullError:
+            raise queue_full_error()
+        if not published:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="Failed to publish the messages")
+        tracer.finish_publish(traces, publish_start)
+
+    publisher = ChunkedPublisher(publish_chunk)
+    errors = []
+    rejected = last_line = 0
+    failure = None
+    try:
+        async for line, record in records:
+            last_line = line
+            message, error = parse_stream_record(record, parse)
+            if error:
+                rejected += 1
+                if len(errors) < MESSAGE_STREAM_MAX_REPORTED_ERRORS:
+                    errors.append({"line": line, "error": error})
+                continue
+            await publisher.add(message, line)
+    except HTTPException as e:
+        failure = e
+    except ValueError as e:
+        # The records before a malformed msgpack record are still published.
+        failure = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if failure is None or failure.status_code == status.HTTP_400_BAD_REQUEST:
+        try:
+            await publisher.flush()
+        except HTTPException as e:
+            failure = e
+
+    invalid_stream_records.inc(rejected)
+    logger.info("[serviceA:produce_message_stream] Accepted %d records, rejected %d", publisher.accepted, rejected, extra=SAMPLED)
+    summary = {"accepted": publisher.accepted, "rejected": rejected, "errors": errors}
+    if failure is not None:
+        return JSONResponse(status_code=failure.status_code, headers=failure.headers,
+                            content={"status": "error", "detail": failure.detail, "last_line": publisher.last_line, **summary})
+    if not last_line:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="stream is empty")
+
+    if message_publisher.write_behind:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED,
+                            content={"status": "accepted", "detail": f"{publisher.accepted} messages accepted", "last_line": last_line, **summary})
+    return {"status": "success", "detail": f"{publisher.accepted} messages queued", "last_line": last_line, **summary}
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
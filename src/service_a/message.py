@@ -1,5 +1,18 @@
-from pydantic import BaseModel
+from typing import Optional
+from pydantic import BaseModel, Field
+
+from src.utils.config import MESSAGE_PRIORITY_LEVELS, MESSAGE_IDEMPOTENCY_KEY_MAX_LENGTH
 
 class Message(BaseModel):
     type: str
-    content: str
\ No newline at end of file
+    content: str
+    priority: int = Field(default=0, ge=0, le=MESSAGE_PRIORITY_LEVELS - 1)
+    # Messages with the same key keep their order on a partitioned queue; defaults to the type.
+    key: Optional[str] = None
+    # A message whose key was already published within MESSAGE_IDEMPOTENCY_WINDOW_SECONDS is dropped,
+    # so clients can safely retry a request whose response was lost.
+    idempotency_key: Optional[str] = Field(default=None, min_length=1, max_length=MESSAGE_IDEMPOTENCY_KEY_MAX_LENGTH)
+    # Seconds the message stays deliverable, and/or an absolute deadline (seconds since the epoch).
+    # Service B drops the message once the earlier of the two has passed.
+    ttl_seconds: Optional[float] = Field(default=None, gt=0)
+    deadline: Optional[float] = Field(default=None, gt=0)
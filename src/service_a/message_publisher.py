@@ -1,22 +1,136 @@
-from src.message_queue.redis_queue import RedisQueue
-from src.utils.logger import logger
-from src.utils.config import REDIS_MESSAGE_QUEUE_NAME
+import logging
 
+from src.message_queue.queue_factory import create_queue
+from src.message_queue.publish_batcher import PublishBatcher
+from src.message_queue.write_behind_buffer import WriteBehindBuffer
+from src.message_queue.spill_log import SpillLog, SpillReplayer
+from src.message_queue.overflow import QueueFullError
+from src.utils.logger import get_logger, log_payload, SAMPLED
+from src.utils.metrics import Counter
+from src.utils.config import REDIS_MESSAGE_QUEUE_NAME, REDIS_QUEUE_BACKEND, MESSAGE_PUBLISH_AUTO_BATCH_ENABLED, MESSAGE_WRITE_BEHIND_ENABLED, MESSAGE_SPILL_ENABLED
+
+logger = get_logger(__name__)
+
+published_messages = Counter("service_a_published_messages_total", "Messages handed to the queue by service A, by result.")
+
+"""
+With a spill log (see SpillLog), publishes that cannot reach Redis are appended to local disk and
+reported as successful, and service A starts even when Redis is down. Once something is spilled,
+new publishes go to the log as well until the replayer has caught up, so the queue order is kept.
+The queue is created without retries then, so a publish is spilled on its first failure instead
+of sitting through the retry backoff; the replayer does the retrying.
+"""
 class MessagePublisher:
-    def __init__(self, redis_queue=None):
-        self.redis_queue = redis_queue or RedisQueue(REDIS_MESSAGE_QUEUE_NAME)
+    def __init__(self, redis_queue=None, auto_batch=MESSAGE_PUBLISH_AUTO_BATCH_ENABLED, write_behind=MESSAGE_WRITE_BEHIND_ENABLED,
+                 spill_log=None, spill=MESSAGE_SPILL_ENABLED):
+        self.spill_log = spill_log or (SpillLog() if spill else None)
+        queue_options = {"max_retries": 1} if self.spill_log and REDIS_QUEUE_BACKEND != "memory" else {}
+        self.redis_queue = redis_queue or create_queue(REDIS_MESSAGE_QUEUE_NAME, **queue_options)
+        self.batcher = PublishBatcher(self.redis_queue) if auto_batch else None
+        # The buffer flushes through publish_many, so its batches are spilled and counted too.
+        self.write_behind = WriteBehindBuffer(self) if write_behind else None
+        self.spill_replayer = None
 
     async def connect(self):
-        return await self.redis_queue.connect()
+        connected = await self.redis_queue.connect()
+        if self.spill_log:
+            self.spill_log.open()
+            self.spill_replayer = SpillReplayer(self.spill_log, self.redis_queue, connected=connected)
+            await self.spill_replayer.start()
+            if not connected:
+                logger.warning("[MessagePublisher:connect] Redis is unavailable, spilling messages to %s", self.spill_log.directory)
+        elif not connected:
+            return False
+        if self.write_behind:
+            await self.write_behind.start()
+        return True
 
     async def disconnect(self):
-        return await self.redis_queue.disconnect()        
+        # The write-behind buffer is flushed first, while the queue is still connected.
+        if self.write_behind:
+            await self.write_behind.close()
+        if self.batcher:
+            await self.batcher.close()
+        if self.spill_replayer:
+            await self.spill_replayer.stop()
+            await self.spill_log.close()
+        return await self.redis_queue.disconnect()
+
+    def is_spilling(self):
+        return self.spill_replayer is not None and (self.spill_log.is_active() or not self.spill_replayer.connected)
+
+    async def spill(self, serialized_messages, message_types=None, priorities=None, idempotency_keys=None):
+        try:
+            await self.spill_log.append_many(serialized_messages, message_types, priorities, idempotency_keys)
+        except Exception as e:
+            published_messages.inc(len(serialized_messages), result="failure")
+            logger.error("[MessagePublisher:spill] failed to spill %d messages: %s", len(serialized_messages), e)
+            return False
+        self.spill_replayer.notify()
+        published_messages.inc(len(serialized_messages), result="spilled")
+        logger.warning("[MessagePublisher:spill] spilled %d messages, %d waiting for replay",
+                       len(serialized_messages), self.spill_log.get_pending_count(), extra=SAMPLED)
+        return True
+
+    """
+    Write-behind mode: hands the messages to the buffer and returns without waiting for Redis.
+    Returns False when the buffer has no room for them.
+    """
+    def enqueue_many(self, serialized_messages, message_types=None, priorities=None, idempotency_keys=None, partition_keys=None):
+        if self.write_behind.offer_many(serialized_messages, message_types, priorities, idempotency_keys, partition_keys):
+            published_messages.inc(len(serialized_messages), result="buffered")
+            return True
+        published_messages.inc(len(serialized_messages), result="rejected")
+        logger.warning("[MessagePublisher:enqueue_many] write-behind buffer is full, rejected %d messages",
+                       len(serialized_messages), extra=SAMPLED)
+        return False
+
+    def get_buffer_depth(self):
+        return self.write_behind.get_depth() if self.write_behind else 0
+
+    def get_buffer_age(self):
+        return self.write_behind.get_oldest_age() if self.write_behind else 0
+
+    async def publish(self, serialized_message, message_type=None, priority=0, idempotency_key=None, partition_key=None):
+        logger.info("[MessagePublisher:publish] execute publish", extra=SAMPLED)
+        if self.is_spilling():
+            return await self.spill([serialized_message], [message_type], [priority], [idempotency_key])
+        try:
+            published = await (self.batcher or self.redis_queue).publish(serialized_message, message_type, priority, idempotency_key, partition_key)
+        except QueueFullError:
+            published_messages.inc(result="rejected")
+            logger.warning("[MessagePublisher:publish] queue is full, rejected a message", extra=SAMPLED)
+            raise
+        if published:
+            published_messages.inc(result="success")
+            logger.info("[MessagePublisher:publish] produced a message : %s", log_payload(serialized_message), extra=SAMPLED)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[MessagePublisher:publish] queue size : %s", await self.redis_queue.get_queue_size())
+            return True
+        elif self.spill_replayer:
+            return await self.spill([serialized_message], [message_type], [priority], [idempotency_key])
+        else:
+            published_messages.inc(result="failure")
+            logger.error("[MessagePublisher:publish] failed to publish a message %s", log_payload(serialized_message))
+            return False
 
-    async def publish(self, serialized_message):
-        logger.info("[MessagePublisher:publish] execute publish")        
-        if await self.redis_queue.publish(serialized_message):
-            logger.info("[MessagePublisher:publish] produced a message : %s, queue size : %s", serialized_message, await self.redis_queue.get_queue_size())
+    async def publish_many(self, serialized_messages, message_types=None, priorities=None, idempotency_keys=None, partition_keys=None):
+        logger.info("[MessagePublisher:publish_many] execute publish_many with %d messages", len(serialized_messages), extra=SAMPLED)
+        if self.is_spilling():
+            return await self.spill(serialized_messages, message_types, priorities, idempotency_keys)
+        try:
+            published = await self.redis_queue.publish_many(serialized_messages, message_types, priorities,
+                                                            idempotency_keys=idempotency_keys, partition_keys=partition_keys)
+        except QueueFullError:
+            published_messages.inc(len(serialized_messages), result="rejected")
+            logger.warning("[MessagePublisher:publish_many] queue is full, rejected %d messages", len(serialized_messages), extra=SAMPLED)
+            raise
+        if published:
+            published_messages.inc(len(serialized_messages), result="success")
             return True
+        elif self.spill_replayer:
+            return await self.spill(serialized_messages, message_types, priorities, idempotency_keys)
         else:
-            logger.error("[MessagePublisher:publish] failed to publish a message %s", serialized_message)
-            return False
\ No newline at end of file
+            published_messages.inc(len(serialized_messages), result="failure")
+            logger.error("[MessagePublisher:publish_many] failed to publish %d messages", len(serialized_messages))
+            return False
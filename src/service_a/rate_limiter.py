@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+
+from src.utils.config import RATE_LIMIT_MESSAGES_PER_SECOND, RATE_LIMIT_BURST, RATE_LIMIT_MAX_TRACKED_KEYS
+
+"""
+Token buckets keyed by client or message type. Every bucket holds up to burst tokens and refills at
+rate tokens per second, and a message costs one token.
+
+A request is admitted when every bucket it touches holds enough tokens for its messages, so a
+rejected request costs nothing. A batch larger than burst is admitted by a full bucket and leaves it
+in debt, so the client still pays for every message before it is admitted again.
+Only the max_keys most recently used buckets are kept; a forgotten key starts again with a full bucket.
+"""
+class TokenBucketRateLimiter:
+    def __init__(self, rate=RATE_LIMIT_MESSAGES_PER_SECOND,
+                 burst=RATE_LIMIT_BURST,
+                 max_keys=RATE_LIMIT_MAX_TRACKED_KEYS,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+
+    """
+    costs maps every bucket key to the number of messages the request adds to it.
+    Returns (True, 0) when the request is admitted, otherwise (False, seconds until it would be).
+    """
+    def try_acquire(self, costs):
+        now = self.clock()
+        levels = {key: self._refill(key, now) for key in costs}
+
+        retry_after = 0
+        for key, cost in costs.items():
+            required = min(cost, self.burst)
+            if levels[key] < required:
+                retry_after = max(retry_after, (required - levels[key]) / self.rate)
+        if retry_after:
+            return False, retry_after
+
+        for key, cost in costs.items():
+            self._buckets[key] = (levels[key] - cost, now)
+        return True, 0
+
+    def _refill(self, key, now):
+        tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return tokens
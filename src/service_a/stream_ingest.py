@@ -0,0 +1,109 @@
+import asyncio
+
+from src.utils.config import MESSAGE_STREAM_CHUNK_SIZE, MESSAGE_STREAM_MAX_RECORD_BYTES
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+"""
+Splits a streamed NDJSON body into lines and yields (line number, line). The body is never held in
+memory: only the unfinished last line is buffered, and a line longer than max_line_bytes is dropped
+while it arrives and yielded as None. Blank lines are counted but not yielded.
+"""
+async def read_ndjson(chunks, max_line_bytes=MESSAGE_STREAM_MAX_RECORD_BYTES):
+    buffer = b""
+    line_number = 0
+    too_long = False
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            line_number += 1
+            if too_long:
+                too_long = False
+                yield line_number, None
+            elif line.strip():
+                yield line_number, line
+        if len(buffer) > max_line_bytes:
+            too_long = True
+            buffer = b""
+
+    if too_long:
+        yield line_number + 1, None
+    elif buffer.strip():
+        yield line_number + 1, buffer
+
+
+"""
+Yields (record number, object) for a streamed body of concatenated msgpack objects. The unpacker
+buffers at most max_record_bytes; a larger or malformed record cannot be skipped and raises ValueError.
+"""
+async def read_msgpack(chunks, max_record_bytes=MESSAGE_STREAM_MAX_RECORD_BYTES):
+    if msgpack is None:
+        raise ValueError("msgpack is not installed")
+
+    unpacker = msgpack.Unpacker(max_buffer_size=max_record_bytes)
+    record_number = 0
+    step = max(1, max_record_bytes // 2)
+    async for chunk in chunks:
+        for start in range(0, len(chunk), step):
+            try:
+                unpacker.feed(chunk[start:start + step])
+                records = list(unpacker)
+            except msgpack.BufferFull:
+                raise ValueError(f"record {record_number + 1} is too large")
+            except (msgpack.UnpackException, ValueError) as e:
+                raise ValueError(f"record {record_number + 1} is malformed: {e}")
+            for record in records:
+                record_number += 1
+                yield record_number, record
+
+
+"""
+Publishes records in chunks of chunk_size while the caller keeps reading the body. A full chunk is
+published by a background task and the next full chunk waits for it, so chunks are published in
+order and at most two are held in memory.
+
+publish(records) raises to stop the stream. accepted and last_line only cover published chunks,
+so a client can resume after last_line.
+"""
+class ChunkedPublisher:
+    def __init__(self, publish, chunk_size=MESSAGE_STREAM_CHUNK_SIZE):
+        self.publish = publish
+        self.chunk_size = chunk_size
+        self.accepted = 0
+        self.last_line = 0
+        self._chunk = []
+        self._chunk_line = 0
+        self._pending = None
+
+    async def add(self, record, line):
+        self._chunk.append(record)
+        self._chunk_line = line
+        if len(self._chunk) >= self.chunk_size:
+            await self.submit()
+
+    async def submit(self):
+        await self.wait()
+        if self._chunk:
+            chunk, self._chunk = self._chunk, []
+            self._pending = asyncio.create_task(self._publish(chunk, self._chunk_line))
+
+    async def wait(self):
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            await pending
+
+    async def flush(self):
+        await self.submit()
+        await self.wait()
+
+    async def _publish(self, chunk, line):
+        await self.publish(chunk)
+        self.accepted += len(chunk)
+        self.last_line = line
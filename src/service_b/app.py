@@ -1,15 +1,27 @@
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, HTTPException, Query, WebSocket, status
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import asyncio
 import json
 
 from src.service_b.message_subscriber import MessageSubscriber
+from src.service_b.message_hub import MessageHub
+from src.service_b.replay_buffer import create_replay_buffer
+from src.message_queue.redelivery import RedeliveryScheduler
 from src.websocket.websocket_handler import WebSocketHandler
-from src.utils.logger import logger
-from src.utils.config import WEBSOCKET_POLL_INTERVAL_SECONDS, WEBSOCKET_MAX_RETRIES, WEBSOCKET_RETRY_DELAY_SECONDS
+from src.utils.logger import get_logger
+from src.utils.metrics import Gauge, metrics_registry
+from src.utils.config import WEBSOCKET_POLL_INTERVAL_SECONDS, WEBSOCKET_MAX_RETRIES, WEBSOCKET_RETRY_DELAY_SECONDS, WEBSOCKET_CONSUMER_MODE, MESSAGE_EXPIRY_SWEEP_INTERVAL_SECONDS, REDELIVERY_ENABLED
+
+logger = get_logger(__name__)
 
 message_subscriber = MessageSubscriber()
+# The delay index and dead-letter list live on the queue's Redis server, so the memory backend has no redelivery.
+redelivery_scheduler = RedeliveryScheduler(message_subscriber.redis_queue) if REDELIVERY_ENABLED and message_subscriber.redis_queue.backend_name != "memory" else None
+replay_buffer = create_replay_buffer()
+message_hub = MessageHub(message_subscriber, redelivery_scheduler=redelivery_scheduler, replay_buffer=replay_buffer)
+send_backlog = Gauge("ws_send_backlog_messages", "Messages waiting in all hub send queues.", callback=message_hub.get_backlog)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -19,9 +31,20 @@ async def lifespan(app: FastAPI):
 
     logger.info("[serviceB:Lifespan] Message subscriber connected.")
 
+    if WEBSOCKET_CONSUMER_MODE == "hub":
+        await message_hub.start()
+    if redelivery_scheduler:
+        await redelivery_scheduler.start()
+    expiry_sweeper = asyncio.create_task(message_subscriber.run_expiry_sweep()) if MESSAGE_EXPIRY_SWEEP_INTERVAL_SECONDS else None
+
     yield
 
     logger.info("[serviceB:Lifespan] Shutting down...")
+    if expiry_sweeper:
+        expiry_sweeper.cancel()
+    await message_hub.stop()
+    if redelivery_scheduler:
+        await redelivery_scheduler.stop()
     if await message_subscriber.disconnect():
         logger.info("[serviceB:Lifespan] Message subscriber disconnected.")
 
@@ -29,41 +52,136 @@ app = FastAPI(lifespan=lifespan)
 
 app.mount("/client", StaticFiles(directory="src/client", html=True), name="client")
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+def get_redelivery_scheduler():
+    if redelivery_scheduler is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="redelivery is disabled")
+    return redelivery_scheduler
+
+@app.get("/admin/redelivery")
+async def redelivery_stats():
+    return await get_redelivery_scheduler().get_stats()
+
+@app.get("/admin/dead-letters")
+async def list_dead_letters(offset: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=1000)):
+    scheduler = get_redelivery_scheduler()
+    stats = await scheduler.get_stats()
+    return {"total": stats["dead_letters"], "messages": await scheduler.list_dead_letters(offset, limit)}
+
+@app.post("/admin/dead-letters/replay")
+async def replay_dead_letters(count: int = Query(100, ge=1, le=10000)):
+    replayed = await get_redelivery_scheduler().replay_dead_letters(count)
+    return {"status": "success", "detail": f"{replayed} messages scheduled for redelivery", "replayed": replayed}
+
+@app.delete("/admin/dead-letters")
+async def purge_dead_letters():
+    purged = await get_redelivery_scheduler().purge_dead_letters()
+    return {"status": "success", "detail": f"{purged} dead letters deleted", "purged": purged}
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     web_socket_handler = WebSocketHandler(websocket)
     await web_socket_handler.accept_connection()
     logger.info("[websocket_endpoint] WebSocket connected.")
 
+    if WEBSOCKET_CONSUMER_MODE == "hub":
+        await serve_hub_client(web_socket_handler, get_resume_offset(websocket))
+        return
+
+    failures = 0
     while True:
-        # This loop implements a polling mechanism to check for new messages in the Redis queue.
-        # A delay is applied between each iteration using WEBSOCKET_POLL_INTERVAL_SECONDS.        
         try:
-            serialized_message = await message_subscriber.subscribe()
-            if serialized_message:
-                await web_socket_handler.send_message(serialized_message)
-
-            await asyncio.sleep(WEBSOCKET_POLL_INTERVAL_SECONDS)
+            if WEBSOCKET_CONSUMER_MODE == "poll":
+                await poll_messages(web_socket_handler)
+            else:
+                await push_messages(web_socket_handler)
+            failures = 0
 
         except Exception as e:
             logger.warning("[websocket_endpoint] Error: %s", e)
-            reconnected = await handle_reconnection(web_socket_handler)
-            if not reconnected:
+            failures += 1
+            if not await handle_reconnection(web_socket_handler, failures):
                 await web_socket_handler.close_connection()
                 return
 
 
-async def handle_reconnection(web_socket_handler):
-    for attempt in range(WEBSOCKET_MAX_RETRIES):
-        try:
-            logger.info("[serviceB:handle_reconnection] Reconnecting (Attempt %s/%s", attempt + 1, WEBSOCKET_MAX_RETRIES, ")")
-            await web_socket_handler.accept_connection()
-            logger.info("[serviceB:handle_reconnection] Reconnected successfully.")
-            return True
-        except Exception as reconnect_error:
-            logger.error("[serviceB:handle_reconnection] Reconnection failed: %s", reconnect_error)
-            await asyncio.sleep(WEBSOCKET_RETRY_DELAY_SECONDS)
-
-    logger.error("[serviceB:handle_reconnection] Max retries reached. Closing WebSocket.")
-    return False
+def get_resume_offset(websocket):
+    # A reconnecting client passes the last offset it saw as ?offset=<n>; anything else starts it at the live messages.
+    offset = websocket.query_params.get("offset")
+    try:
+        return int(offset) if offset is not None else None
+    except ValueError:
+        logger.warning("[websocket_endpoint] Ignoring invalid resume offset: %s", offset)
+        return None
+
+
+async def poll_messages(web_socket_handler):
+    # This implements a polling mechanism to check for new messages in the Redis queue.
+    # A delay is applied between each iteration using WEBSOCKET_POLL_INTERVAL_SECONDS.
+    serialized_message = await message_subscriber.subscribe()
+    if serialized_message:
+        await send_or_redeliver(web_socket_handler.send_message(serialized_message), [serialized_message])
+        await message_subscriber.ack([serialized_message])
+
+    await asyncio.sleep(WEBSOCKET_POLL_INTERVAL_SECONDS)
+
+
+async def push_messages(web_socket_handler):
+    # Blocks on Redis until messages arrive and forwards them immediately.
+    # The next read only starts once this batch has been written to the socket.
+    messages = await message_subscriber.subscribe_batch()
+    await send_or_redeliver(web_socket_handler.send_messages(messages), messages)
+    await message_subscriber.ack(messages)
+
+
+async def send_or_redeliver(send, messages):
+    # A failed send hands the messages to the redelivery scheduler instead of losing them; they are
+    # acked once stored there, and the error still ends this connection.
+    try:
+        await send
+    except Exception as e:
+        if redelivery_scheduler and messages:
+            try:
+                await redelivery_scheduler.schedule(messages, e)
+                await message_subscriber.ack(messages)
+            except Exception as schedule_error:
+                logger.error("[serviceB:send_or_redeliver] Failed to schedule %d messages for redelivery: %s", len(messages), schedule_error)
+        raise
+
+
+async def serve_hub_client(web_socket_handler, resume_offset=None):
+    # The hub owns the Redis consumer; this socket only drains its own send queue
+    # until either the client disconnects or a send fails.
+    hub_client = message_hub.register(web_socket_handler, resume_offset)
+    sender = asyncio.create_task(hub_client.run())
+    receiver = asyncio.create_task(web_socket_handler.wait_for_disconnect())
+    try:
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception():
+                logger.warning("[websocket_endpoint] Error: %s", task.exception())
+    finally:
+        message_hub.unregister(hub_client)
+        sender.cancel()
+        receiver.cancel()
+        await web_socket_handler.close_connection()
+
+
+async def handle_reconnection(web_socket_handler, failures):
+    # A WebSocket cannot be accepted twice: once its client is gone, the client has to open a new
+    # connection (and resume from its last offset). Only errors that left the client connected,
+    # e.g. Redis being unavailable, are retried, up to WEBSOCKET_MAX_RETRIES times in a row.
+    if not web_socket_handler.is_connected():
+        logger.info("[serviceB:handle_reconnection] Client disconnected. It has to reconnect.")
+        return False
+    if failures > WEBSOCKET_MAX_RETRIES:
+        logger.error("[serviceB:handle_reconnection] Max retries reached. Closing WebSocket.")
+        return False
+
+    logger.info("[serviceB:handle_reconnection] Retrying (Attempt %s/%s)", failures, WEBSOCKET_MAX_RETRIES)
+    await asyncio.sleep(WEBSOCKET_RETRY_DELAY_SECONDS)
+    return web_socket_handler.is_connected()
         
\ No newline at end of file
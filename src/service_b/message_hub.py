@@ -0,0 +1,327 @@
+import asyncio
+
+from src.utils.logger import get_logger
+from src.utils.tracing import tracer
+from src.utils.metrics import Counter, Gauge, Histogram
+from src.utils.config import MESSAGE_HUB_DELIVERY_MODE, MESSAGE_HUB_CLIENT_QUEUE_SIZE, MESSAGE_HUB_OVERFLOW_POLICY, MESSAGE_HUB_COMPETING_OVERFLOW_POLICY, METRICS_SIZE_BUCKETS, WEBSOCKET_BATCH_WINDOW_SECONDS
+
+logger = get_logger(__name__)
+
+connected_clients = Gauge("ws_connected_clients", "WebSockets registered with the message hub.")
+client_backlog = Histogram("ws_client_backlog_messages", "Per-client send queue length observed when a message is enqueued.", buckets=METRICS_SIZE_BUCKETS)
+dropped_messages = Counter("ws_dropped_messages_total", "Messages dropped by a client's overflow policy.")
+disconnected_clients = Counter("ws_slow_clients_disconnected_total", "Clients disconnected because their send queue was full.")
+
+"""
+A connected WebSocket registered with the MessageHub.
+Messages are buffered in a bounded send queue and written to the socket by run().
+When the queue is full the overflow policy decides what happens:
+
+- "drop_oldest": The oldest buffered message is discarded to make room.
+- "disconnect": The client is considered too slow and enqueue() returns False, so the hub closes it.
+- "block": The hub waits until the client has room (this slows down every client).
+
+When the client negotiated a batching subprotocol, run() waits up to batch_window seconds after the
+first message and then sends everything queued in as few frames as possible.
+
+Messages passed as catch_up (a resuming client's missed messages) are sent first, before anything
+that is enqueued. Every enqueued message is then reported exactly once: to on_sent once it has been
+written to the socket, to on_dropped if the overflow policy discards it, or in the list returned by
+close(), which holds the ones being sent when the client was closed (they may or may not have reached
+the client) and the ones still queued.
+"""
+class HubClient:
+    def __init__(self, web_socket_handler,
+                 queue_size=MESSAGE_HUB_CLIENT_QUEUE_SIZE,
+                 overflow_policy=MESSAGE_HUB_OVERFLOW_POLICY,
+                 batch_window=WEBSOCKET_BATCH_WINDOW_SECONDS,
+                 catch_up=None,
+                 on_sent=None,
+                 on_dropped=None):
+        self.web_socket_handler = web_socket_handler
+        self.catch_up = catch_up or []
+        self.on_sent = on_sent
+        self.on_dropped = on_dropped
+        self.overflow_policy = overflow_policy
+        self.batch_window = batch_window
+        self.send_queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped_messages = 0
+        self.closed = False
+        self.in_flight = []
+
+    def is_full(self):
+        return self.send_queue.full()
+
+    async def enqueue(self, message):
+        if self.closed:
+            return False
+
+        client_backlog.observe(self.send_queue.qsize())
+        if not self.send_queue.full():
+            self.send_queue.put_nowait(message)
+            return True
+
+        if self.overflow_policy == "block":
+            await self.send_queue.put(message)
+            return not self.closed
+        elif self.overflow_policy == "drop_oldest":
+            dropped = self.send_queue.get_nowait()
+            self.send_queue.put_nowait(message)
+            self.dropped_messages += 1
+            dropped_messages.inc(policy=self.overflow_policy)
+            logger.debug("[HubClient:enqueue] Dropped the oldest message. dropped: %d", self.dropped_messages)
+            if self.on_dropped:
+                await self.on_dropped([dropped])
+            return True
+        else:
+            logger.warning("[HubClient:enqueue] Send queue is full. Disconnecting slow consumer.")
+            disconnected_clients.inc()
+            # The hub unregisters the client, which closes it and takes care of its queued messages.
+            return False
+
+    async def run(self):
+        if self.catch_up:
+            self.in_flight, self.catch_up = self.catch_up, []
+            await self.web_socket_handler.send_messages(self.in_flight)
+            self.in_flight = []
+        while True:
+            message = await self.send_queue.get()
+            if message is None:
+                return
+            if self.web_socket_handler.framing == "single":
+                self.in_flight = [message]
+                await self.web_socket_handler.send_message(message)
+                await self.report_sent()
+                continue
+
+            if self.batch_window and self.send_queue.qsize() + 1 < self.web_socket_handler.max_batch_messages:
+                await asyncio.sleep(self.batch_window)
+            messages = [message]
+            while not self.send_queue.empty():
+                message = self.send_queue.get_nowait()
+                if message is None:
+                    return
+                messages.append(message)
+            self.in_flight = messages
+            await self.web_socket_handler.send_messages(messages)
+            await self.report_sent()
+
+    async def report_sent(self):
+        sent, self.in_flight = self.in_flight, []
+        if self.on_sent:
+            await self.on_sent(sent)
+
+    def close(self):
+        if self.closed:
+            return []
+        self.closed = True
+        undelivered, self.in_flight = self.in_flight, []
+        self.catch_up = []
+        # Drain the queue so a hub blocked in put() is released, then wake run() with the sentinel.
+        while not self.send_queue.empty():
+            message = self.send_queue.get_nowait()
+            if message is not None:
+                undelivered.append(message)
+        self.send_queue.put_nowait(None)
+        return undelivered
+
+
+"""
+Reads from Redis with a single consumer task and distributes the messages to the registered clients.
+
+- "broadcast": Every client receives every message.
+- "competing": Each message is delivered to exactly one client, in round-robin order,
+               skipping clients whose send queue is full when another one has room.
+
+The consumer only reads from Redis while at least one client is registered, so messages are
+not drained into an empty hub. In "competing" mode the messages a client had not delivered when it
+is unregistered, those dropped by its overflow policy and those read after the last client left are
+handed to the redelivery scheduler, if there is one; in "broadcast" mode the other clients still have
+their copies. Unless overflow_policy is given, "competing" clients block when full
+(MESSAGE_HUB_COMPETING_OVERFLOW_POLICY), so a slow consumer leaves messages in Redis.
+
+A message is acked on the queue only once it is settled: sent by every client it was handed to
+(clients that went away count as done in "broadcast" mode), or stored by the redelivery scheduler.
+Messages that are neither are left unacked, so the stream backend reclaims them after a crash.
+
+With a replay_buffer, "broadcast" messages are stamped with an offset and kept, and a client
+registered with the last offset it saw is sent the messages after it before the live ones.
+"""
+class MessageHub:
+    def __init__(self, message_subscriber,
+                 delivery_mode=MESSAGE_HUB_DELIVERY_MODE,
+                 client_queue_size=MESSAGE_HUB_CLIENT_QUEUE_SIZE,
+                 overflow_policy=None,
+                 redelivery_scheduler=None,
+                 replay_buffer=None):
+        self.message_subscriber = message_subscriber
+        self.redelivery_scheduler = redelivery_scheduler
+        self.replay_buffer = replay_buffer
+        self.delivery_mode = delivery_mode
+        self.client_queue_size = client_queue_size
+        self.overflow_policy = overflow_policy or (MESSAGE_HUB_OVERFLOW_POLICY if delivery_mode == "broadcast" else MESSAGE_HUB_COMPETING_OVERFLOW_POLICY)
+        self.clients = []
+        self._next_client = 0
+        self._has_clients = asyncio.Event()
+        self._consumer_task = None
+        self._background_tasks = set()
+        # id(message) -> [message, clients still holding it]; holding the message keeps its id unique.
+        self._unacked = {}
+
+    async def start(self):
+        if self._consumer_task is None:
+            self._consumer_task = asyncio.create_task(self._consume())
+            logger.info("[MessageHub:start] Consumer started. delivery mode: %s", self.delivery_mode)
+
+    async def stop(self):
+        if self._consumer_task:
+            self._consumer_task.cancel()
+            try:
+                await self._consumer_task
+            except asyncio.CancelledError:
+                pass
+            self._consumer_task = None
+        for client in list(self.clients):
+            self.unregister(client)
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks)
+        logger.info("[MessageHub:stop] Consumer stopped.")
+
+    def register(self, web_socket_handler, resume_offset=None):
+        catch_up = None
+        if self.replay_buffer and self.delivery_mode == "broadcast" and resume_offset is not None:
+            # Nothing awaits between reading the window and adding the client, so every message is
+            # either in its catch-up or dispatched to it, never both.
+            catch_up = self.replay_buffer.read_after(resume_offset)
+            logger.info("[MessageHub:register] Client resumed after offset %d. missed: %d", resume_offset, len(catch_up))
+        client = HubClient(web_socket_handler, self.client_queue_size, self.overflow_policy, catch_up=catch_up,
+                           on_sent=self.settle, on_dropped=self.on_dropped)
+        self.clients.append(client)
+        self._has_clients.set()
+        connected_clients.set(len(self.clients))
+        logger.info("[MessageHub:register] Client registered. clients: %d", len(self.clients))
+        return client
+
+    def unregister(self, client):
+        undelivered = client.close()
+        if undelivered:
+            # unregister is synchronous, so the messages are redelivered or acked in the background.
+            self.run_in_background(self.settle(undelivered) if self.delivery_mode == "broadcast" else self.redeliver(undelivered))
+        if client in self.clients:
+            self.clients.remove(client)
+            connected_clients.set(len(self.clients))
+            logger.info("[MessageHub:unregister] Client unregistered. clients: %d", len(self.clients))
+        if not self.clients:
+            self._has_clients.clear()
+
+    def run_in_background(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    """
+    Hands messages no client delivered to the redelivery scheduler and acks them once it stored them.
+    Without a scheduler, or when it fails, they are left unacked.
+    """
+    async def redeliver(self, messages, reason="client disconnected"):
+        if not self.redelivery_scheduler:
+            self.forget(messages)
+            return
+        try:
+            await self.redelivery_scheduler.schedule(messages, reason)
+        except Exception as e:
+            logger.error("[MessageHub:redeliver] Failed to schedule %d undelivered messages: %s", len(messages), e)
+            self.forget(messages)
+            return
+        await self.settle(messages, force=True)
+
+    def track(self, message, clients):
+        self._unacked[id(message)] = [message, clients]
+
+    """
+    Records that one client is done with each of the messages, and acks those no client holds anymore.
+    force acks them regardless of the other clients.
+    """
+    async def settle(self, messages, force=False):
+        settled = []
+        for message in messages:
+            entry = self._unacked.get(id(message))
+            if entry is None or entry[0] is not message:
+                continue
+            entry[1] -= 1
+            if entry[1] <= 0 or force:
+                del self._unacked[id(message)]
+                settled.append(message)
+        if settled:
+            await self.message_subscriber.ack(settled)
+
+    def forget(self, messages):
+        for message in messages:
+            entry = self._unacked.get(id(message))
+            if entry is not None and entry[0] is message:
+                del self._unacked[id(message)]
+
+    async def on_dropped(self, messages):
+        if self.delivery_mode == "broadcast":
+            await self.settle(messages)
+        else:
+            await self.redeliver(messages, "dropped by a full send queue")
+
+    def get_backlog(self):
+        return sum(client.send_queue.qsize() for client in self.clients)
+
+    """
+    Hands the message to the clients and returns whether one took it.
+    """
+    async def dispatch(self, message):
+        if self.delivery_mode == "broadcast":
+            if self.replay_buffer:
+                stamped = self.replay_buffer.append(message)
+                tracer.on_replaced(message, stamped)
+                message = stamped
+            clients = list(self.clients)
+            if not clients:
+                return False
+            self.track(message, len(clients))
+            for client in clients:
+                if not await client.enqueue(message):
+                    self.unregister(client)
+                    await self.settle([message])
+            return True
+
+        self.track(message, 1)
+        while self.clients:
+            client = self._select_client()
+            if await client.enqueue(message):
+                return True
+            self.unregister(client)
+        if not self.redelivery_scheduler:
+            logger.warning("[MessageHub:dispatch] No client available. Message dropped.")
+        return False
+
+    def _select_client(self):
+        count = len(self.clients)
+        start = self._next_client % count
+        for offset in range(count):
+            index = (start + offset) % count
+            if not self.clients[index].is_full():
+                self._next_client = index + 1
+                return self.clients[index]
+        self._next_client = start + 1
+        return self.clients[start]
+
+    async def _consume(self):
+        while True:
+            try:
+                await self._has_clients.wait()
+                messages = await self.message_subscriber.subscribe_batch()
+                undelivered = [message for message in messages if not await self.dispatch(message)]
+                if undelivered and self.delivery_mode == "broadcast":
+                    # Nobody was listening; a resuming client still finds them in the replay buffer.
+                    await self.message_subscriber.ack(undelivered)
+                elif undelivered:
+                    await self.redeliver(undelivered, "no client available")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("[MessageHub:consume] Error: %s", e)
@@ -1,13 +1,27 @@
+import asyncio
 import redis.asyncio as redis
 
-from src.message_queue.redis_queue import RedisQueue
-from src.utils.config import REDIS_MESSAGE_QUEUE_NAME, MESSAGE_FILTER_MODE, ALLOWED_TYPE
-from src.utils.logger import logger
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.queue_factory import create_queue
+from src.utils.config import REDIS_MESSAGE_QUEUE_NAME, REDIS_MESSAGE_DRAIN_BATCH_SIZE, MESSAGE_FILTER_MODE, ALLOWED_TYPE, MESSAGE_FORWARD_RAW, MESSAGE_TYPE_ROUTING_ENABLED, MESSAGE_SUBSCRIBED_TYPES, MESSAGE_EXPIRY_SWEEP_INTERVAL_SECONDS
+from src.utils.logger import get_logger, log_payload, SAMPLED
+from src.utils.metrics import Counter
+from src.utils.tracing import tracer
+
+logger = get_logger(__name__)
+
+filtered_messages = Counter("service_b_filtered_messages_total", "Messages consumed and discarded by the type filter.")
 
 class MessageSubscriber:
-    def __init__(self, redis_queue: RedisQueue=None, filter_mode=MESSAGE_FILTER_MODE):
-        self.redis_queue = redis_queue or RedisQueue(REDIS_MESSAGE_QUEUE_NAME)
+    def __init__(self, redis_queue: MessageQueue=None, filter_mode=MESSAGE_FILTER_MODE, forward_raw=MESSAGE_FORWARD_RAW,
+                 type_routing=MESSAGE_TYPE_ROUTING_ENABLED, subscribed_types=MESSAGE_SUBSCRIBED_TYPES):
+        self.redis_queue = redis_queue or create_queue(REDIS_MESSAGE_QUEUE_NAME)
         self.filter_mode = filter_mode
+        # With type routing the queue only returns subscribed types, so messages need no filtering here.
+        self.type_routing = type_routing
+        self.subscribed_types = (subscribed_types or self.default_subscribed_types()) if type_routing else None
+        # Raw payloads skip the decode step, which is only possible when no field is inspected.
+        self.forward_raw = forward_raw and (filter_mode == "allow_all" or type_routing)
 
     async def connect(self):
         return await self.redis_queue.connect()
@@ -17,18 +31,63 @@ class MessageSubscriber:
 
     async def subscribe(self):
         try:
-            logger.info("[MessageSubscriber:subscribe] execute subscribe")                
-            deserialized_message = await self.redis_queue.subscribe()
+            logger.info("[MessageSubscriber:subscribe] execute subscribe", extra=SAMPLED)                
+            deserialized_message = await self.redis_queue.subscribe(message_types=self.subscribed_types)
             if deserialized_message:
-                if self.is_allowed_message_type(deserialized_message):
-                    logger.info("[MessageSubscriber:subscribe] Consumed a message: %s", deserialized_message)                                    
+                if self.type_routing or self.is_allowed_message_type(deserialized_message):
+                    tracer.on_dequeued([deserialized_message])
+                    logger.info("[MessageSubscriber:subscribe] Consumed a message: %s", log_payload(deserialized_message), extra=SAMPLED)                                    
                     return deserialized_message
                 else:
+                    filtered_messages.inc()
+                    await self.redis_queue.ack([deserialized_message])
                     return None            
         except Exception as e:
             logger.error("[MessageSubscriber:subscribe] Exception : %s", e)            
             return None
-            
+
+    async def subscribe_batch(self, max_count=REDIS_MESSAGE_DRAIN_BATCH_SIZE):
+        try:
+            if self.forward_raw or self.type_routing:
+                messages = await self.redis_queue.subscribe_batch(max_count, raw=self.forward_raw, message_types=self.subscribed_types)
+                tracer.on_dequeued(messages)
+                return messages
+
+            deserialized_messages = await self.redis_queue.subscribe_batch(max_count)
+            allowed_messages = [message for message in deserialized_messages if self.is_allowed_message_type(message)]
+            if len(allowed_messages) < len(deserialized_messages):
+                filtered_messages.inc(len(deserialized_messages) - len(allowed_messages))
+                await self.redis_queue.ack([message for message in deserialized_messages if not self.is_allowed_message_type(message)])
+            tracer.on_dequeued(allowed_messages)
+            if allowed_messages:
+                logger.info("[MessageSubscriber:subscribe_batch] Consumed %d messages", len(allowed_messages), extra=SAMPLED)
+            return allowed_messages
+        except Exception as e:
+            logger.error("[MessageSubscriber:subscribe_batch] Exception : %s", e)
+            return []
+
+    async def ack(self, messages):
+        return await self.redis_queue.ack(messages)
+
+    """
+    Evicts expired messages from the queue every interval seconds (see MessageQueue.sweep_expired),
+    so that after a backlog consumers spend their reads on messages that can still be delivered.
+    """
+    async def run_expiry_sweep(self, interval=MESSAGE_EXPIRY_SWEEP_INTERVAL_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                swept = await self.redis_queue.sweep_expired()
+                if swept:
+                    logger.info("[MessageSubscriber:run_expiry_sweep] Evicted %d expired messages", swept)
+            except Exception as e:
+                logger.error("[MessageSubscriber:run_expiry_sweep] Exception : %s", e)
+
+    def default_subscribed_types(self):
+        if self.filter_mode == "specific_type":
+            return [ALLOWED_TYPE]
+        return ["*"]
+
     def is_allowed_message_type(self, message):
         if self.filter_mode == "allow_all":
             return True
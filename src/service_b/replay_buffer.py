@@ -0,0 +1,81 @@
+import time
+from collections import deque
+from itertools import islice
+
+from src.message_queue.codec import is_tagged, to_object
+from src.utils.logger import get_logger
+from src.utils.config import WEBSOCKET_RESUME_WINDOW_SIZE, WEBSOCKET_DEFAULT_RESUME_WINDOW_SIZE, WEBSOCKET_CONSUMER_MODE, MESSAGE_HUB_DELIVERY_MODE
+
+logger = get_logger(__name__)
+
+OFFSET_FIELD = "offset"
+
+"""
+The last messages broadcast by the MessageHub, each stamped with a delivery offset, so a client that
+reconnects with the last offset it saw receives only the messages it missed.
+
+Offsets grow by one per message and start at the wall-clock time in microseconds, so the offsets of
+a restarted service B continue above those of the previous process (unless it averaged more than a
+million messages per second). A client whose offset is older than the window gets the whole window
+and can tell from the jump in offsets how many messages it lost.
+"""
+class ReplayBuffer:
+    def __init__(self, max_size=WEBSOCKET_DEFAULT_RESUME_WINDOW_SIZE, first_offset=None):
+        self.messages = deque(maxlen=max_size)
+        self.next_offset = first_offset if first_offset is not None else time.time_ns() // 1000
+
+    @property
+    def last_offset(self):
+        return self.next_offset - 1
+
+    """
+    Stamps the message with the next offset, keeps it in the window and returns the stamped message.
+    """
+    def append(self, message):
+        message = stamp_offset(message, self.next_offset)
+        self.messages.append(message)
+        self.next_offset += 1
+        return message
+
+    """
+    Returns the messages in the window after offset, oldest first. Only the missed messages are
+    visited, so a resume costs what the client missed rather than the size of the window.
+    """
+    def read_after(self, offset):
+        missed = min(self.last_offset - offset, len(self.messages))
+        if missed <= 0:
+            return []
+        messages = list(islice(reversed(self.messages), missed))
+        messages.reverse()
+        return messages
+
+
+"""
+Creates the ReplayBuffer for service B, or returns None when resuming is off.
+Offsets only mean the same to every client when each of them gets every message, so resuming needs
+the hub in "broadcast" mode. A window_size of None uses the default window there and turns resuming
+off quietly elsewhere; a window set explicitly in another mode is logged as a warning.
+"""
+def create_replay_buffer(window_size=WEBSOCKET_RESUME_WINDOW_SIZE, consumer_mode=WEBSOCKET_CONSUMER_MODE, delivery_mode=MESSAGE_HUB_DELIVERY_MODE):
+    if consumer_mode != "hub" or delivery_mode != "broadcast":
+        if window_size:
+            logger.warning("[create_replay_buffer] Resuming needs the hub in broadcast mode and is disabled. consumer mode: %s, delivery mode: %s",
+                           consumer_mode, delivery_mode)
+        return None
+    if window_size is None:
+        window_size = WEBSOCKET_DEFAULT_RESUME_WINDOW_SIZE
+    return ReplayBuffer(window_size) if window_size else None
+
+
+def stamp_offset(message, offset):
+    # JSON payloads are stamped as text, the way they are forwarded; the offset goes last so that it
+    # wins over a field of the same name. Objects and other encodings get a stamped copy.
+    if isinstance(message, (bytes, bytearray)) and not is_tagged(message):
+        message = message.decode()
+    if isinstance(message, str):
+        text = message.rstrip()
+        if text.endswith("}"):
+            body = text[:-1].rstrip()
+            separator = "" if body.endswith("{") else ","
+            return f'{body}{separator}"{OFFSET_FIELD}":{offset}}}'
+    return {**to_object(message), OFFSET_FIELD: offset}
@@ -2,17 +2,164 @@
 REDIS_MESSAGE_QUEUE_NAME = "message_queue"  # The name of the Redis queue used for message storage.
 REDIS_CONNECTION_URL = "redis://redis:6379"  # Redis server connection URL.
 REDIS_MAX_RETRIES = 3  # Maximum number of retries when interacting with Redis.
-REDIS_RETRY_DELAY_SECONDS = 2  # Delay (in seconds) between retry attempts.
+REDIS_RETRY_DELAY_SECONDS = 2  # Base delay (in seconds) between retry attempts; doubled per attempt with jitter.
+REDIS_RETRY_MAX_DELAY_SECONDS = 30  # Upper bound (in seconds) for the exponential retry delay.
 REDIS_MESSAGE_QUEUE_MAX_SIZE = 50  # Maximum size of the Redis message queue.
-REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS = 2  # Timeout for the Redis BRPOP operation in seconds.
+REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS = 2  # Timeout for the Redis BLPOP operation in seconds.
+REDIS_MESSAGE_DRAIN_BATCH_SIZE = 100  # Maximum number of messages drained per blocking read in push mode.
+REDIS_QUEUE_BACKEND = "list"  # Queue backend: "list" (capped Redis list), "memory" (in-process, see InMemoryQueue) or "stream" (Redis Streams with consumer groups).
+REDIS_STREAM_CONSUMER_GROUP = "service_b"  # Consumer group shared by all service B instances in "stream" mode.
+REDIS_STREAM_CLAIM_MIN_IDLE_SECONDS = 30  # Pending messages idle for longer than this are reclaimed from dead consumers.
+REDIS_STREAM_CLAIM_INTERVAL_SECONDS = 10  # Interval (in seconds) between checks for messages to reclaim.
+REDIS_QUEUE_OVERFLOW_POLICY = "drop_oldest"  # What a full queue does with new messages: "drop_oldest", "reject_new" or "block".
+REDIS_QUEUE_OVERFLOW_BLOCK_TIMEOUT_SECONDS = 1  # With "block", how long a publish waits for room before it is rejected.
+REDIS_QUEUE_OVERFLOW_POLL_INTERVAL_SECONDS = 0.05  # With "block", interval (in seconds) between checks for room.
+
+# Redis Connection Pool Configuration
+REDIS_MAX_CONNECTIONS = 50  # Connections shared by non-blocking commands (publish, trim, ack, ...).
+REDIS_BLOCKING_MAX_CONNECTIONS = 10  # Separate connections reserved for blocking reads (BLPOP, XREADGROUP BLOCK).
+REDIS_POOL_TIMEOUT_SECONDS = 5  # Time (in seconds) to wait for a free pooled connection before failing.
+REDIS_SOCKET_CONNECT_TIMEOUT_SECONDS = 5  # Timeout (in seconds) for opening a connection.
+REDIS_SOCKET_TIMEOUT_SECONDS = 5  # Timeout (in seconds) for non-blocking commands; blocking reads have none.
+REDIS_SOCKET_KEEPALIVE = True  # Enable TCP keepalive so dead peers are detected on idle connections.
+REDIS_HEALTH_CHECK_INTERVAL_SECONDS = 30  # Idle connections are PINGed before reuse after this many seconds.
+
+
+"""
+With REDIS_QUEUE_PARTITIONS above 1 the "list" backend is split into that many partitions (see
+PartitionedQueue). A message goes to the partition of its "key" field, or of its type when it has
+no key, so messages with the same key stay in order. Partitions are placed round-robin on
+REDIS_PARTITION_URLS, and every service B instance consumes the partitions assigned to it.
+"""
+REDIS_QUEUE_PARTITIONS = 1  # Number of partitions of the queue; 1 keeps a single Redis list.
+REDIS_PARTITION_URLS = []  # Redis servers the partitions are spread over; empty uses REDIS_CONNECTION_URL only.
+REDIS_PARTITION_VIRTUAL_NODES = 64  # Points per partition on the consistent hash ring that maps keys to partitions.
+REDIS_PARTITION_REBALANCE_INTERVAL_SECONDS = 5  # Interval (in seconds) between consumer heartbeats and partition rebalancing.
+REDIS_PARTITION_LEASE_SECONDS = 15  # A consumer that misses heartbeats for this long loses its partitions to the others.
+REDIS_PARTITION_PREFETCH_BATCHES = 4  # Batches read ahead per consumer; partition readers wait while this many are queued.
+
+# Publisher Configuration
+MESSAGE_PUBLISH_AUTO_BATCH_ENABLED = False  # Coalesce concurrent single publishes into one pipelined batch.
+MESSAGE_PUBLISH_BATCH_MAX_SIZE = 100  # Maximum number of messages flushed together by the auto-batcher.
+MESSAGE_PUBLISH_BATCH_MAX_DELAY_SECONDS = 0.005  # Maximum time (in seconds) a message waits for its batch to fill.
+
+# Write-Behind Configuration (service A)
+MESSAGE_WRITE_BEHIND_ENABLED = False  # Accept messages into a local buffer and answer 202 before they are written to Redis.
+MESSAGE_WRITE_BEHIND_BUFFER_SIZE = 10000  # Maximum number of messages held in the buffer; beyond it requests get a 429.
+MESSAGE_WRITE_BEHIND_BATCH_SIZE = 100  # Maximum number of messages written to Redis per flush.
+MESSAGE_WRITE_BEHIND_SHUTDOWN_TIMEOUT_SECONDS = 10  # Time (in seconds) allowed on shutdown to flush what is left in the buffer.
+
+# Spill Log Configuration (service A)
+MESSAGE_SPILL_ENABLED = False  # Append publishes to a local log while Redis is unavailable and replay them when it is back.
+MESSAGE_SPILL_DIRECTORY = "spill"  # Directory holding the spill log segments.
+MESSAGE_SPILL_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # A new segment is started once the current one reaches this size.
+MESSAGE_SPILL_FSYNC_INTERVAL_SECONDS = 0.005  # Appends within this window share one fsync (group commit).
+MESSAGE_SPILL_REPLAY_BATCH_SIZE = 100  # Maximum number of spilled messages replayed into Redis per transaction.
+MESSAGE_SPILL_REPLAY_INTERVAL_SECONDS = 1  # Delay (in seconds) between replay attempts while Redis is unavailable.
+
+# Admission Control Configuration (service A)
+QUEUE_FULL_RETRY_AFTER_SECONDS = 1  # Retry-After sent with a 429 when the queue rejects a message.
+RATE_LIMIT_ENABLED = False  # Shed load with a token bucket before it reaches Redis.
+RATE_LIMIT_KEY = "client"  # One bucket per "client" (remote address) or per message "type".
+RATE_LIMIT_MESSAGES_PER_SECOND = 100  # Sustained rate allowed per bucket.
+RATE_LIMIT_BURST = 200  # Bucket capacity, i.e. the largest burst allowed per bucket.
+RATE_LIMIT_MAX_TRACKED_KEYS = 10000  # Least recently used buckets beyond this are forgotten.
 
 # WebSocket Configuration
 WEBSOCKET_MAX_RETRIES = 2  # Maximum number of retries for WebSocket connection attempts.
 WEBSOCKET_POLL_INTERVAL_SECONDS = 2  # Interval (in seconds) between WebSocket polling attempts.
 WEBSOCKET_RETRY_DELAY_SECONDS = 1  # Delay (in seconds) before retrying a failed WebSocket connection.
 
+
+"""
+WEBSOCKET_CONSUMER_MODE defines how service B reads messages for each WebSocket.
+
+- "push": Blocks on Redis and forwards every available message as soon as it arrives, with no sleep.
+          The next read starts only after the previous batch has been sent (backpressure).
+- "poll": Reads at most one message, then sleeps WEBSOCKET_POLL_INTERVAL_SECONDS (legacy behavior).
+- "hub": A single shared consumer reads from Redis and fans messages out to every connected
+         WebSocket through bounded per-client send queues (see MESSAGE_HUB_* below).
+"""
+WEBSOCKET_CONSUMER_MODE = "hub"
+
+# Message Hub Configuration (used when WEBSOCKET_CONSUMER_MODE is "hub")
+MESSAGE_HUB_DELIVERY_MODE = "competing"  # "broadcast" (every client gets every message) or "competing" (one client per message).
+MESSAGE_HUB_CLIENT_QUEUE_SIZE = 100  # Maximum number of messages buffered per WebSocket client.
+MESSAGE_HUB_OVERFLOW_POLICY = "drop_oldest"  # Policy when a client's queue is full in "broadcast" mode: "drop_oldest", "disconnect" or "block".
+MESSAGE_HUB_COMPETING_OVERFLOW_POLICY = "block"  # The same in "competing" mode; "block" stops reading Redis while every client is full.
+
+
+"""
+WebSocket framing, chosen by each client with a subprotocol (see websocket_handler.SUBPROTOCOLS).
+Clients that request none get one JSON text frame per message. Clients that request a batching
+subprotocol get the messages queued for them coalesced into one frame, up to the limits below.
+"""
+WEBSOCKET_BATCH_MAX_MESSAGES = 100  # Maximum number of messages coalesced into one frame.
+WEBSOCKET_BATCH_MAX_BYTES = 65536  # A frame is closed once its encoded messages reach this size.
+WEBSOCKET_BATCH_WINDOW_SECONDS = 0.002  # How long a hub client waits for more messages before sending a frame (0 sends what is queued).
+
+
+"""
+Resuming after a reconnect. The hub stamps every message with an increasing "offset" and keeps the
+last messages in a window; a client that reconnects with ws://.../ws?offset=<last offset seen> first
+receives the messages it missed, in one batch, then the live ones.
+This only works in broadcast mode (WEBSOCKET_CONSUMER_MODE "hub" and MESSAGE_HUB_DELIVERY_MODE
+"broadcast"). Left at None, WEBSOCKET_RESUME_WINDOW_SIZE keeps WEBSOCKET_DEFAULT_RESUME_WINDOW_SIZE
+messages in broadcast mode and disables resuming in the other modes; a window set explicitly in a
+mode that cannot honour it is logged as a warning at startup.
+"""
+WEBSOCKET_RESUME_WINDOW_SIZE = None  # Messages kept for resuming clients (None uses the default in broadcast mode, 0 disables offsets and resuming).
+WEBSOCKET_DEFAULT_RESUME_WINDOW_SIZE = 10000  # Window used in broadcast mode when WEBSOCKET_RESUME_WINDOW_SIZE is None.
+
+
+"""
+Redelivery of messages whose WebSocket send failed (see RedeliveryScheduler). A failed message is
+put in a delay index and published again after a jittered exponential backoff; after
+REDELIVERY_MAX_ATTEMPTS failed deliveries it goes to a dead-letter list instead, which the admin API
+of service B can list and replay. Needs a Redis backend ("list" or "stream").
+"""
+REDELIVERY_ENABLED = True
+REDELIVERY_MAX_ATTEMPTS = 5  # Failed deliveries after which a message is dead-lettered.
+REDELIVERY_BASE_DELAY_SECONDS = 1  # Backoff before the first redelivery; doubles with every further attempt.
+REDELIVERY_MAX_DELAY_SECONDS = 300  # Upper bound of the backoff.
+REDELIVERY_MOVER_INTERVAL_SECONDS = 1  # Longest time the mover sleeps between checks for due messages.
+REDELIVERY_MOVER_BATCH_SIZE = 500  # Due messages published again per batch.
+REDELIVERY_MOVER_LEASE_SECONDS = 5  # Lease that lets one service B instance at a time run the mover.
+REDELIVERY_DEAD_LETTER_MAX_SIZE = 10000  # Maximum number of dead letters kept; the oldest are dropped beyond this.
+REDELIVERY_ATTEMPTS_TTL_SECONDS = 86400  # How long the attempt count of a redelivered message is remembered.
+
+# Logging Configuration
+LOG_LEVEL = "INFO"  # Level of the application logger.
+LOG_MODULE_LEVELS = {}  # Per-module levels, e.g. {"message_queue": "WARNING", "websocket.websocket_handler": "DEBUG"}.
+LOG_SAMPLED_RECORDS_PER_SECOND = 10  # Maximum per-message log records per second for each log statement.
+LOG_PAYLOAD_MAX_LENGTH = 0  # Maximum number of payload characters written to logs (0 logs only the payload size).
+
+# Metrics Configuration
+METRICS_ENABLED = True  # Record metrics and expose them on /metrics. When disabled, recording is a no-op.
+METRICS_LATENCY_BUCKETS_SECONDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Histogram buckets for latencies.
+METRICS_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # Histogram buckets for batch sizes.
+
+# Tracing Configuration
+TRACING_SAMPLE_RATE = 0.0  # Fraction of messages traced from service A to the WebSocket send (0 disables tracing).
+TRACING_EXPORTER = "json"  # "json" appends traces to TRACING_JSON_PATH; "otel" emits OpenTelemetry spans (needs opentelemetry-api).
+TRACING_JSON_PATH = "logs/traces.jsonl"  # File the JSON exporter appends to, one trace per line.
+TRACING_MAX_PENDING = 10000  # Traced messages remembered between dequeue and send; the oldest are forgotten beyond this.
+
 # Message Settings
 MESSAGE_MAX_CONTENT_LENGTH = 512  # Maximum allowed length (in characters) for message content.
+MESSAGE_MAX_BATCH_SIZE = 500  # Maximum number of messages accepted by a single batch request.
+MESSAGE_STREAM_CHUNK_SIZE = 500  # Valid records of a POST /messages/stream body published per publish_many call.
+MESSAGE_STREAM_MAX_RECORD_BYTES = 65536  # Longer NDJSON lines or msgpack records are rejected without being buffered.
+MESSAGE_STREAM_MAX_REPORTED_ERRORS = 100  # Invalid records listed in the stream response; further ones are only counted.
+MESSAGE_CODEC_FORMAT = "json"  # Payload format: "json", "orjson" or "msgpack" (the last two need the package installed).
+MESSAGE_CODEC_COMPRESSION = "none"  # Payload compression: "none", "zlib", "zstd" or "lz4" (zstd/lz4 need the package installed).
+MESSAGE_CODEC_COMPRESSION_THRESHOLD_BYTES = 1024  # Payloads smaller than this are stored uncompressed.
+MESSAGE_FORWARD_RAW = True  # Forward payloads to WebSockets without decoding them when no type filter is applied.
+MESSAGE_IDEMPOTENCY_KEY_MAX_LENGTH = 128  # Maximum allowed length (in characters) for a message's idempotency key.
+MESSAGE_IDEMPOTENCY_WINDOW_SECONDS = 3600  # The queue drops messages whose idempotency key was published within this window.
+MESSAGE_DEFAULT_TTL_SECONDS = 0  # Lifetime of messages published without ttl_seconds or deadline (0 means they never expire).
+MESSAGE_EXPIRY_SWEEP_INTERVAL_SECONDS = 30  # Interval (in seconds) between sweeps evicting expired messages from the queue (0 disables it).
+MESSAGE_EXPIRY_SWEEP_BATCH_SIZE = 1000  # Queue entries examined per atomic sweep step.
 
 
 """
@@ -26,4 +173,32 @@ To filter messages by type, set the mode to "specific_type".
 In this case, only messages with a 'type' of "serviceB" will be forwarded. If you want to allow all messages, set the mode to "allow_all".
 """
 MESSAGE_FILTER_MODE = "allow_all"
-ALLOWED_TYPE = "serviceB"
\ No newline at end of file
+ALLOWED_TYPE = "serviceB"
+
+
+"""
+MESSAGE_TYPE_ROUTING_ENABLED stores every message type under its own Redis key ("<queue name>:type:<type>").
+
+Service B then only reads the keys of the types it subscribes to, so filtering costs an index lookup
+instead of consuming and discarding non-matching messages. MESSAGE_SUBSCRIBED_TYPES lists the types
+or glob patterns (e.g. "order.*") to read. When it is None it is derived from MESSAGE_FILTER_MODE:
+"allow_all" subscribes to "*" and "specific_type" subscribes to ALLOWED_TYPE.
+"""
+MESSAGE_TYPE_ROUTING_ENABLED = False
+MESSAGE_SUBSCRIBED_TYPES = None
+MESSAGE_TYPE_KEY_REFRESH_SECONDS = 5  # Interval (in seconds) between refreshes of the known types matched by glob patterns.
+
+
+"""
+MESSAGE_PRIORITY_LEVELS sets how many priority lanes a queue has. A message with priority p > 0 is stored
+under "<key>:priority:<p>", priority 0 under the key itself, and each lane is trimmed separately, so a
+backlog of bulk traffic never pushes urgent messages out. Within a lane messages are strictly FIFO.
+
+MESSAGE_PRIORITY_POLICY decides which lane a consumer serves first:
+- "strict": Always the highest non-empty lane. Lower lanes wait while higher ones have messages.
+- "weighted": Lanes take turns in proportion to MESSAGE_PRIORITY_WEIGHTS (indexed by priority),
+              so lower lanes keep a share of the throughput. Empty lanes are skipped.
+"""
+MESSAGE_PRIORITY_LEVELS = 3
+MESSAGE_PRIORITY_POLICY = "strict"
+MESSAGE_PRIORITY_WEIGHTS = (1, 4, 16)
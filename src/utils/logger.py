@@ -1,8 +1,101 @@
+import atexit
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from src.utils.config import LOG_LEVEL, LOG_MODULE_LEVELS, LOG_SAMPLED_RECORDS_PER_SECOND, LOG_PAYLOAD_MAX_LENGTH
+
+LOGGER_NAME = "asynchronous-message-queue"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Pass as extra= on per-message log calls so they are rate-limited by SampledRecordFilter.
+SAMPLED = {"sampled": True}
+
+"""
+Rate-limits records logged with extra=SAMPLED to max_per_second per logger and message template.
+Records that exceed the limit are dropped before they are formatted, and the number of dropped
+records is appended to the next record that gets through. Other records are never limited.
+"""
+class SampledRecordFilter(logging.Filter):
+    def __init__(self, max_per_second=LOG_SAMPLED_RECORDS_PER_SECOND):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False):
+            return True
+
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window_start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - window_start >= 1:
+                window_start, count = now, 0
+            if count >= self.max_per_second:
+                self._windows[key] = (window_start, count, suppressed + 1)
+                return False
+            self._windows[key] = (window_start, count + 1, 0)
+
+        if suppressed:
+            record.msg = f"{record.msg} (%d similar records suppressed)"
+            record.args = (record.args or ()) + (suppressed,)
+        return True
+
+
+"""
+Defers formatting of a message payload until the record is actually emitted, and truncates it to
+LOG_PAYLOAD_MAX_LENGTH characters. With a limit of 0 only the payload size is logged.
+"""
+class LogPayload:
+    __slots__ = ("payload", "max_length")
+
+    def __init__(self, payload, max_length=LOG_PAYLOAD_MAX_LENGTH):
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self):
+        text = self.payload.decode(errors="replace") if isinstance(self.payload, (bytes, bytearray)) else str(self.payload)
+        if self.max_length <= 0:
+            return f"<{len(text)} chars>"
+        if len(text) > self.max_length:
+            return f"{text[:self.max_length]}...<{len(text)} chars>"
+        return text
+
+
+def log_payload(payload):
+    return LogPayload(payload)
+
+
+def get_logger(module_name):
+    if module_name.startswith("src."):
+        module_name = module_name[len("src."):]
+    return logger.getChild(module_name)
+
+
+# Records are queued by the caller and written to stderr by a background thread, so the event loop
+# never blocks on the stream.
+_log_queue = queue.SimpleQueue()
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_queue_handler = logging.handlers.QueueHandler(_log_queue)
+# The listener's handler does the formatting; without this basicConfig would format every record twice.
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+_queue_handler.addFilter(SampledRecordFilter())
+_listener = logging.handlers.QueueListener(_log_queue, _stream_handler, respect_handler_level=True)
 
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[_queue_handler],
     level=logging.INFO
 )
 
-logger = logging.getLogger("asynchronous-message-queue")
\ No newline at end of file
+logger = logging.getLogger(LOGGER_NAME)
+logger.setLevel(LOG_LEVEL)
+for module_name, level in LOG_MODULE_LEVELS.items():
+    logging.getLogger(f"{LOGGER_NAME}.{module_name}").setLevel(level)
+
+_listener.start()
+atexit.register(_listener.stop)
@@ -0,0 +1,149 @@
+import math
+import threading
+
+from src.utils.config import METRICS_ENABLED, METRICS_LATENCY_BUCKETS_SECONDS
+
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Metrics are created once at import time and registered in metrics_registry. Recording a value is a
+dictionary update keyed by the label values; when the registry is disabled every record call returns
+after a single attribute check, so instrumentation can stay on the hot path.
+"""
+class MetricsRegistry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            return self.metrics[metric.name]
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+metrics_registry = MetricsRegistry()
+
+
+def format_labels(label_items, extra=()):
+    items = tuple(label_items) + tuple(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, registry=metrics_registry):
+        self.name = name
+        self.documentation = documentation
+        self.registry = registry
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self):
+        return [f"{self.name}{format_labels(key)} {format_value(value)}" for key, value in self.values.items()]
+
+    def reset(self):
+        self.values = {}
+
+
+"""
+A gauge either holds values set by the caller or, when callback is given, reads its value at
+scrape time. Callbacks keep the cost of tracking things like backlog off the hot path.
+"""
+class Gauge(Counter):
+    type = "gauge"
+
+    def __init__(self, name, documentation, registry=metrics_registry, callback=None):
+        super().__init__(name, documentation, registry)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        self.values[tuple(sorted(labels.items()))] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.callback is not None:
+            return [f"{self.name} {format_value(self.callback())}"]
+        return super().render()
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=METRICS_LATENCY_BUCKETS_SECONDS, registry=metrics_registry):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.registry = registry
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def get_count(self, **labels):
+        state = self.values.get(tuple(sorted(labels.items())))
+        return state[2] if state else 0
+
+    def render(self):
+        lines = []
+        for key, (bucket_counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(key, (('le', format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+    def reset(self):
+        self.values = {}
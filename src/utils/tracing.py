@@ -0,0 +1,182 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from src.message_queue.codec import message_codec, is_tagged
+from src.message_queue.expiry import TRACE_FIELD, ENQUEUED_AT_FIELD
+from src.utils.logger import get_logger
+from src.utils.metrics import Histogram
+from src.utils.config import TRACING_SAMPLE_RATE, TRACING_EXPORTER, TRACING_JSON_PATH, TRACING_MAX_PENDING
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = get_logger(__name__)
+
+# A string value containing "trace": is escaped in JSON, so only the field itself matches.
+TRACE_MARKER = f'"{TRACE_FIELD}":'
+TRACE_MARKER_BYTES = TRACE_MARKER.encode()
+
+stage_duration = Histogram("trace_stage_duration_seconds", "Time traced messages spent in each stage, by stage.")
+
+"""
+End-to-end tracing of sampled messages.
+
+Service A decides per message whether to trace it (sample_rate) and stores the trace context in the
+message envelope as {"id": <32 hex digits>, "received_at": <epoch seconds>}; the envelope's
+enqueued_at marks the start of the publish. Each service exports the stages it observed under the
+trace id, so the two halves are joined by id:
+
+- service_a.handle    request received -> publish started (validation, serialization)
+- service_a.publish   publish started -> publish returned (including RedisQueue retries; in
+                      write-behind mode, handing the message to the buffer)
+- queue.wait          publish started -> dequeued by service B (time in Redis, and the poll sleep)
+- service_b.dispatch  dequeued -> WebSocket send started (hub queue and frame coalescing)
+- websocket.send      WebSocket send started -> finished
+
+Every stage duration is also observed in trace_stage_duration_seconds, so the stage behind the p99
+can be read from /metrics. Stage boundaries in different services are wall-clock times, so
+queue.wait includes any clock skew between the hosts.
+"""
+class Tracer:
+    def __init__(self, sample_rate=TRACING_SAMPLE_RATE, exporter=TRACING_EXPORTER, max_pending=TRACING_MAX_PENDING, codec=None):
+        self.sample_rate = sample_rate
+        self.exporter = create_exporter(exporter) if sample_rate > 0 else None
+        self.max_pending = max_pending
+        self.codec = codec or message_codec
+        # id(message) -> (message, trace context, enqueued_at, dequeued_at); holding the message keeps its id unique.
+        self.pending = {}
+
+    """
+    Returns a new trace context for a sampled message, otherwise None.
+    """
+    def start_trace(self, received_at=None):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        return {"id": uuid.uuid4().hex, "received_at": round(received_at or time.time(), 6)}
+
+    def finish_publish(self, traces, publish_start):
+        now = time.time()
+        for trace in traces:
+            if trace:
+                self.export(trace["id"], [("service_a.handle", trace["received_at"], publish_start),
+                                          ("service_a.publish", publish_start, now)])
+
+    """
+    Remembers the traced messages among those just consumed, until on_sent sees them. Untraced JSON
+    payloads are recognized without decoding them.
+    """
+    def on_dequeued(self, messages):
+        if self.exporter is None or not messages:
+            return
+        now = time.time()
+        for message in messages:
+            trace, enqueued_at = self.get_trace(message)
+            if trace:
+                self.pending[id(message)] = (message, trace, enqueued_at, now)
+        while len(self.pending) > self.max_pending:
+            del self.pending[next(iter(self.pending))]
+
+    def on_sent(self, messages, send_start):
+        if not self.pending:
+            return
+        now = time.time()
+        for message in messages:
+            entry = self.pending.pop(id(message), None)
+            if entry is None:
+                continue
+            _, trace, enqueued_at, dequeued_at = entry
+            self.export(trace["id"], [("queue.wait", enqueued_at or dequeued_at, dequeued_at),
+                                      ("service_b.dispatch", dequeued_at, send_start),
+                                      ("websocket.send", send_start, now)])
+
+    def on_replaced(self, message, replacement):
+        # Keeps the trace of a message that service B rewrote before sending it, e.g. to stamp its offset.
+        if self.pending:
+            entry = self.pending.pop(id(message), None)
+            if entry is not None:
+                self.pending[id(replacement)] = (replacement,) + entry[1:]
+
+    def get_trace(self, message):
+        if isinstance(message, (str, bytes, bytearray)):
+            marker = TRACE_MARKER if isinstance(message, str) else TRACE_MARKER_BYTES
+            if not is_tagged(message) and marker not in message:
+                return None, None
+            try:
+                message = self.codec.decode(message)
+            except Exception:
+                return None, None
+        if not isinstance(message, dict) or not isinstance(message.get(TRACE_FIELD), dict):
+            return None, None
+        return message[TRACE_FIELD], message.get(ENQUEUED_AT_FIELD)
+
+    def export(self, trace_id, stages):
+        for name, start, end in stages:
+            stage_duration.observe(max(0.0, end - start), stage=name)
+        try:
+            self.exporter.export(trace_id, stages)
+        except Exception as e:
+            logger.error("[Tracer:export] Failed to export trace %s: %s", trace_id, e)
+
+
+def create_exporter(exporter):
+    if exporter == "json":
+        return JsonTraceExporter()
+    elif exporter == "otel":
+        return OpenTelemetryExporter()
+    raise ValueError(f"Unknown trace exporter: {exporter}")
+
+
+"""
+Appends one JSON object per trace and service to path: {"trace_id", "spans": [{"name", "start",
+"end", "duration"}]}, with times in seconds since the epoch.
+"""
+class JsonTraceExporter:
+    def __init__(self, path=TRACING_JSON_PATH):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def export(self, trace_id, stages):
+        line = json.dumps({"trace_id": trace_id,
+                           "spans": [{"name": name, "start": start, "end": end, "duration": round(end - start, 6)}
+                                     for name, start, end in stages]})
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a", buffering=1)
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+"""
+Emits every stage as a span of the message's trace through the OpenTelemetry API. Where the spans
+go is decided by the tracer provider the process configures (e.g. an OTLP exporter); without one
+the API discards them.
+"""
+class OpenTelemetryExporter:
+    def __init__(self):
+        if otel_trace is None:
+            raise ValueError("opentelemetry-api is not installed")
+        self.tracer = otel_trace.get_tracer("asynchronous-message-queue")
+
+    def export(self, trace_id, stages):
+        parent = otel_trace.SpanContext(trace_id=int(trace_id, 16), span_id=random.getrandbits(64), is_remote=True,
+                                        trace_flags=otel_trace.TraceFlags(otel_trace.TraceFlags.SAMPLED))
+        context = otel_trace.set_span_in_context(otel_trace.NonRecordingSpan(parent))
+        for name, start, end in stages:
+            span = self.tracer.start_span(name, context=context, start_time=int(start * 1e9))
+            span.end(end_time=int(end * 1e9))
+
+
+tracer = Tracer()
@@ -1,43 +1,176 @@
-import json
 import traceback
 import asyncio
+import time
 from fastapi import WebSocket
 from starlette.websockets import WebSocketState
 
-from src.utils.logger import logger
-from src.utils.config import WEBSOCKET_MAX_RETRIES, REDIS_RETRY_DELAY_SECONDS, WEBSOCKET_RETRY_DELAY_SECONDS
+from src.message_queue.codec import to_json_text, to_object, dumps_json, loads_json
+from src.utils.logger import get_logger, log_payload, SAMPLED
+from src.utils.metrics import Counter, Histogram
+from src.utils.tracing import tracer
+from src.utils.config import WEBSOCKET_MAX_RETRIES, REDIS_RETRY_DELAY_SECONDS, WEBSOCKET_RETRY_DELAY_SECONDS, WEBSOCKET_BATCH_MAX_MESSAGES, WEBSOCKET_BATCH_MAX_BYTES
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = get_logger(__name__)
+
+send_duration = Histogram("ws_send_duration_seconds", "Time spent writing a frame to a WebSocket.")
+sent_messages = Counter("ws_sent_messages_total", "Messages written to WebSockets.")
+sent_frames = Counter("ws_sent_frames_total", "Frames written to WebSockets.")
+send_errors = Counter("ws_send_errors_total", "Failed WebSocket sends.")
+
+"""
+WebSocket subprotocols a client may request, mapped to (framing, encoding). The first one in the
+client's list that the server supports is accepted; a client that requests none gets "single".
+
+- "single": One JSON text frame per message.
+- "array": Messages are coalesced into a JSON array per text frame, or a msgpack array per binary frame.
+- "ndjson": Messages are coalesced into one text frame, one JSON document per line.
+
+mq.msgpack is only offered when the msgpack package is installed. Compression is negotiated separately
+by the server (uvicorn enables permessage-deflate by default) and gains most from coalesced frames.
+"""
+SUBPROTOCOLS = {
+    "mq.json": ("single", "json"),
+    "mq.json-array": ("array", "json"),
+    "mq.ndjson": ("ndjson", "json"),
+    "mq.msgpack": ("array", "msgpack"),
+}
 
 class WebSocketHandler:
-    def __init__(self, websocket: WebSocket):
+    def __init__(self, websocket: WebSocket,
+                 max_batch_messages=WEBSOCKET_BATCH_MAX_MESSAGES,
+                 max_batch_bytes=WEBSOCKET_BATCH_MAX_BYTES):
         self.websocket = websocket
+        self.max_batch_messages = max_batch_messages
+        self.max_batch_bytes = max_batch_bytes
+        self.subprotocol = None
+        self.framing, self.encoding = "single", "json"
         if self.websocket.client_state != WebSocketState.CONNECTED:
             logger.warning("[WebSocketHandler:init] WebSocket is not in a connected state.")
 
 
     async def accept_connection(self):
         try:
-            await self.websocket.accept()
-            logger.info("[WebSocketHandler:accept_connection] WebSocket connection established.")
+            self.subprotocol = self.select_subprotocol(self.websocket.scope.get("subprotocols", []))
+            self.framing, self.encoding = SUBPROTOCOLS.get(self.subprotocol, ("single", "json"))
+            await self.websocket.accept(subprotocol=self.subprotocol)
+            logger.info("[WebSocketHandler:accept_connection] WebSocket connection established. subprotocol: %s", self.subprotocol)
         except Exception as e:
             logger.error("[WebSocketHandler:accept_connection] Failed to accept connection: %s", e)
             raise
 
 
+    @staticmethod
+    def select_subprotocol(requested):
+        for subprotocol in requested:
+            if subprotocol in SUBPROTOCOLS and (subprotocol != "mq.msgpack" or msgpack is not None):
+                return subprotocol
+        return None
+
+
+    def is_connected(self):
+        # A failed send marks the application side disconnected before the client side notices.
+        return (self.websocket.client_state == WebSocketState.CONNECTED
+                and self.websocket.application_state == WebSocketState.CONNECTED)
+
+
     async def send_message(self, message, max_retries=WEBSOCKET_MAX_RETRIES, retry_delay=REDIS_RETRY_DELAY_SECONDS):
         try:
             if self.websocket.client_state == WebSocketState.CONNECTED:
-                await self.websocket.send_text(json.dumps(message))
-                logger.info("[WebSocketHandler:send_message] Message sent: %s", message)
+                start_time = time.perf_counter()
+                send_start = time.time()
+                await self.websocket.send_text(to_json_text(message))
+                send_duration.observe(time.perf_counter() - start_time)
+                tracer.on_sent([message], send_start)
+                sent_messages.inc()
+                sent_frames.inc()
+                logger.info("[WebSocketHandler:send_message] Message sent: %s", log_payload(message), extra=SAMPLED)
             else:
                 raise RuntimeError("WebSocket is not connected.")
         except Exception as e:
+            send_errors.inc()
             logger.error("[WebSocketHandler:send_message] Error sending message: %s", e)
             raise
 
 
+    """
+    Sends the messages in order, coalesced into as few frames as the negotiated framing and the
+    max_batch_messages / max_batch_bytes limits allow.
+    """
+    async def send_messages(self, messages):
+        if self.framing == "single":
+            for message in messages:
+                await self.send_message(message)
+            return
+
+        try:
+            if self.websocket.client_state != WebSocketState.CONNECTED:
+                raise RuntimeError("WebSocket is not connected.")
+            send_start = time.time()
+            for frame, count in self.encode_frames(messages):
+                start_time = time.perf_counter()
+                if self.encoding == "msgpack":
+                    await self.websocket.send_bytes(frame)
+                else:
+                    await self.websocket.send_text(frame)
+                send_duration.observe(time.perf_counter() - start_time)
+                sent_messages.inc(count)
+                sent_frames.inc()
+                logger.info("[WebSocketHandler:send_messages] Sent %d messages in one frame (%d bytes).", count, len(frame), extra=SAMPLED)
+            tracer.on_sent(messages, send_start)
+        except Exception as e:
+            send_errors.inc()
+            logger.error("[WebSocketHandler:send_messages] Error sending messages: %s", e)
+            raise
+
+
+    def encode_frames(self, messages):
+        chunk, chunk_bytes = [], 0
+        for message in messages:
+            encoded = self.encode(message)
+            if chunk and (len(chunk) >= self.max_batch_messages or chunk_bytes + len(encoded) > self.max_batch_bytes):
+                yield self.join(chunk), len(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(encoded)
+            chunk_bytes += len(encoded)
+        if chunk:
+            yield self.join(chunk), len(chunk)
+
+
+    def encode(self, message):
+        if self.encoding == "msgpack":
+            return msgpack.packb(to_object(message))
+        text = to_json_text(message)
+        if self.framing == "ndjson" and "\n" in text:
+            # Raw payloads are forwarded as stored; re-serialize the rare one spread over several lines.
+            text = dumps_json(loads_json(text))
+        return text
+
+
+    def join(self, encoded_messages):
+        if self.encoding == "msgpack":
+            return msgpack.Packer().pack_array_header(len(encoded_messages)) + b"".join(encoded_messages)
+        if self.framing == "ndjson":
+            return "\n".join(encoded_messages)
+        return "[" + ",".join(encoded_messages) + "]"
+
+
+    async def wait_for_disconnect(self):
+        # Incoming frames are ignored; this only returns once the client has gone away.
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                logger.info("[WebSocketHandler:wait_for_disconnect] Client disconnected.")
+                return
+
+
     async def close_connection(self):
         try:
-            if self.websocket.client_state == WebSocketState.CONNECTED:
+            if self.is_connected():
                 await self.websocket.close()
                 logger.info("[WebSocketHandler:close_connection] WebSocket connection closed.")
             else:
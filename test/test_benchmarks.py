@@ -0,0 +1,55 @@
+import pytest
+
+from benchmarks.harness import BenchmarkEnvironment, summarize_latencies
+from benchmarks.scenarios import run_publish, run_consume, run_end_to_end, run_fan_out
+from benchmarks.compare import compare_results
+
+MESSAGE_COUNT = 20
+MESSAGE_SIZE = 64
+
+
+@pytest.fixture
+def environment():
+    return BenchmarkEnvironment()
+
+
+def test_summarize_latencies():
+    latencies = [i / 1000 for i in range(1, 101)]
+
+    summary = summarize_latencies(latencies)
+
+    assert summary == {"p50": 50.0, "p95": 95.0, "p99": 99.0, "max": 100.0}
+
+
+@pytest.mark.parametrize("run", [run_publish, run_consume])
+async def test_queue_benchmarks(environment, run):
+    result = await run(environment, MESSAGE_SIZE, 2, 5, MESSAGE_COUNT)
+
+    assert result["messages"] == MESSAGE_COUNT
+    assert result["throughput_msgs_per_second"] > 0
+    assert result["latency_ms"]["p99"] is not None
+    assert "max_rss_kb" in result["memory"]
+
+
+async def test_end_to_end_benchmark(environment):
+    result = await run_end_to_end(environment, MESSAGE_SIZE, 2, 5, MESSAGE_COUNT)
+
+    assert result["messages"] == MESSAGE_COUNT
+    assert result["lost"] == 0
+
+
+async def test_fan_out_benchmark(environment):
+    result = await run_fan_out(environment, MESSAGE_SIZE, 3, 5, MESSAGE_COUNT)
+
+    assert result["messages"] == MESSAGE_COUNT * 3
+    assert result["lost"] == 0
+
+
+def test_compare_flags_regressions():
+    baseline = [{"benchmark": "publish", "params": {"batch_size": 1},
+                 "throughput_msgs_per_second": 1000, "latency_ms": {"p99": 1.0}}]
+    current = [{"benchmark": "publish", "params": {"batch_size": 1},
+                "throughput_msgs_per_second": 800, "latency_ms": {"p99": 1.0}}]
+
+    assert compare_results(baseline, current, threshold=0.1)[0]["regressed"] is True
+    assert compare_results(baseline, baseline, threshold=0.1)[0]["regressed"] is False
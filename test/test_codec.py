@@ -0,0 +1,67 @@
+import pytest
+import json
+from src.message_queue.codec import MessageCodec, to_json_text, HEADER_MAGIC
+
+TEST_MESSAGE = {"type": "test", "content": "test_message"}
+LARGE_TEST_MESSAGE = {"type": "test", "content": "a" * 2048}
+COMPRESSION_THRESHOLD = 1024
+
+
+def test_json_is_stored_untagged():
+    payload = MessageCodec(format="json").encode(TEST_MESSAGE)
+
+    assert payload == json.dumps(TEST_MESSAGE)
+    assert MessageCodec().decode(payload) == TEST_MESSAGE
+
+
+def test_orjson_roundtrip():
+    pytest.importorskip("orjson")
+    payload = MessageCodec(format="orjson").encode(TEST_MESSAGE)
+
+    assert not payload.startswith(HEADER_MAGIC)
+    assert MessageCodec().decode(payload) == TEST_MESSAGE
+
+
+def test_msgpack_roundtrip():
+    pytest.importorskip("msgpack")
+    payload = MessageCodec(format="msgpack").encode(TEST_MESSAGE)
+
+    assert payload.startswith(HEADER_MAGIC)
+    assert MessageCodec().decode(payload) == TEST_MESSAGE
+
+
+def test_compression_only_above_threshold():
+    codec = MessageCodec(format="json", compression="zlib", compression_threshold=COMPRESSION_THRESHOLD)
+
+    small_payload = codec.encode(TEST_MESSAGE)
+    large_payload = codec.encode(LARGE_TEST_MESSAGE)
+
+    assert small_payload == json.dumps(TEST_MESSAGE)
+    assert large_payload.startswith(HEADER_MAGIC)
+    assert len(large_payload) < len(json.dumps(LARGE_TEST_MESSAGE))
+    assert MessageCodec().decode(large_payload) == LARGE_TEST_MESSAGE
+
+
+def test_mixed_format_payloads_decode_with_any_codec():
+    payloads = [MessageCodec(format="json").encode(TEST_MESSAGE),
+                MessageCodec(format="json").encode(TEST_MESSAGE).encode(),
+                MessageCodec(format="json", compression="zlib", compression_threshold=0).encode(TEST_MESSAGE)]
+
+    assert [MessageCodec().decode(payload) for payload in payloads] == [TEST_MESSAGE] * 3
+
+
+def test_to_json_text_forwards_untagged_payload_unchanged():
+    payload = json.dumps(TEST_MESSAGE).encode()
+
+    assert to_json_text(payload) == payload.decode()
+
+
+def test_to_json_text_decodes_tagged_payload():
+    payload = MessageCodec(format="json", compression="zlib", compression_threshold=0).encode(TEST_MESSAGE)
+
+    assert json.loads(to_json_text(payload)) == TEST_MESSAGE
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        MessageCodec(format="xml")
@@ -0,0 +1,10 @@
+from src.combined.app import app
+
+
+def test_combined_app_serves_both_services():
+    paths = [route.path for route in app.router.routes]
+
+    assert "/messages" in paths
+    assert "/messages/batch" in paths
+    assert "/ws" in paths
+    assert paths.count("/metrics") == 1
@@ -0,0 +1,74 @@
+import pytest
+import json
+from unittest.mock import patch
+from src.message_queue.codec import MessageCodec
+from src.message_queue.expiry import build_envelope, get_expires_at, is_expired
+from src.message_queue.redis_queue import RedisQueue
+
+NOW = 1700000000.0
+TEST_MESSAGE = {"type": "test", "content": "test_message"}
+REDIS_MESSAGE_QUEUE_NAME = "test_queue"
+
+
+def test_build_envelope_puts_earliest_expiry_first():
+    envelope = build_envelope(TEST_MESSAGE, NOW, ttl=30, deadline=NOW + 10)
+
+    assert list(envelope) == ["expires_at", "enqueued_at", "type", "content"]
+    assert envelope["expires_at"] == NOW + 10
+    assert envelope["enqueued_at"] == NOW
+
+
+def test_build_envelope_without_expiry():
+    assert build_envelope(TEST_MESSAGE, NOW) == {"enqueued_at": NOW, **TEST_MESSAGE}
+
+
+def test_leading_expiry_is_read_without_decoding():
+    payload = json.dumps(build_envelope(TEST_MESSAGE, NOW, ttl=5))
+
+    with patch("src.message_queue.expiry.message_codec.decode") as decode_mock:
+        assert get_expires_at(payload) == NOW + 5
+        assert get_expires_at(payload.encode()) == NOW + 5
+        # orjson writes no space after the colon.
+        assert get_expires_at(payload.replace(": ", ":")) == NOW + 5
+        assert get_expires_at(json.dumps(TEST_MESSAGE)) is None
+    decode_mock.assert_not_called()
+
+
+def test_expiry_elsewhere_in_payload_is_decoded():
+    payload = json.dumps({**TEST_MESSAGE, "expires_at": NOW})
+
+    assert get_expires_at(payload) == NOW
+    assert get_expires_at({**TEST_MESSAGE, "expires_at": NOW}) == NOW
+
+
+def test_expiry_of_tagged_payload():
+    codec = MessageCodec(compression="zlib", compression_threshold=0)
+    payload = codec.encode(build_envelope(TEST_MESSAGE, NOW, ttl=5))
+
+    assert get_expires_at(payload, codec) == NOW + 5
+
+
+def test_is_expired():
+    payload = json.dumps(build_envelope(TEST_MESSAGE, NOW, ttl=5))
+
+    assert not is_expired(payload, NOW + 4)
+    assert is_expired(payload, NOW + 5)
+    assert not is_expired(json.dumps(TEST_MESSAGE), NOW + 5)
+
+
+@pytest.mark.asyncio
+async def test_sweep_removes_only_expired_messages():
+    # Running the script needs a Lua runtime in fakeredis.
+    pytest.importorskip("lupa")
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_client = fakeredis.aioredis.FakeRedis()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client)
+    expired = json.dumps(build_envelope(TEST_MESSAGE, NOW, ttl=5))
+    fresh = [json.dumps(build_envelope({**TEST_MESSAGE, "content": str(index)}, NOW + 10 ** 10, ttl=5)) for index in range(3)]
+    unbounded = json.dumps(TEST_MESSAGE)
+    await redis_client.rpush(REDIS_MESSAGE_QUEUE_NAME, expired, fresh[0], expired, fresh[1], unbounded, expired, fresh[2])
+
+    assert await queue.sweep_expired(batch_size=2) == 3
+
+    assert await redis_client.lrange(REDIS_MESSAGE_QUEUE_NAME, 0, -1) == [message.encode() for message in fresh[:2] + [unbounded, fresh[2]]]
+    assert queue.expired_messages == 3
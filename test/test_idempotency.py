@@ -0,0 +1,86 @@
+import pytest
+import json
+from src.message_queue.redis_queue import RedisQueue
+from src.message_queue.redis_stream_queue import RedisStreamQueue
+from src.message_queue.memory_queue import InMemoryQueue, InMemoryBroker
+
+KEYED_TEST_MESSAGE={"type": "test", "content": "test_message", "idempotency_key": "order-1"}
+UNKEYED_TEST_MESSAGE={"type": "test", "content": "test_message"}
+REDIS_MESSAGE_QUEUE_NAME="test_queue"
+
+
+def create_fake_redis():
+    # Running the scripts needs a Lua runtime in fakeredis.
+    pytest.importorskip("lupa")
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.aioredis.FakeRedis()
+
+
+@pytest.mark.asyncio
+async def test_duplicate_messages_are_pushed_once():
+    redis_client = create_fake_redis()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client, max_queue_size=2)
+    keyed = json.dumps(KEYED_TEST_MESSAGE)
+    unkeyed = json.dumps(UNKEYED_TEST_MESSAGE)
+
+    assert await queue.publish_many([keyed, keyed, unkeyed], idempotency_keys=["order-1", "order-1", None]) is True
+    assert await queue.publish(keyed, idempotency_key="order-1") is True
+
+    assert await redis_client.lrange(REDIS_MESSAGE_QUEUE_NAME, 0, -1) == [keyed.encode(), unkeyed.encode()]
+    assert queue.duplicate_messages == 2
+    assert 0 < await redis_client.ttl(f"{REDIS_MESSAGE_QUEUE_NAME}:idempotency:order-1") <= queue.idempotency_window
+
+    assert await queue.publish_many([json.dumps({**KEYED_TEST_MESSAGE, "idempotency_key": "order-2"})], idempotency_keys=["order-2"]) is True
+    assert await redis_client.llen(REDIS_MESSAGE_QUEUE_NAME) == 2
+    assert queue.dropped_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_payloads_are_not_scanned_for_keys():
+    redis_client = create_fake_redis()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client)
+    keyed = json.dumps(KEYED_TEST_MESSAGE)
+
+    assert await queue.publish_many([keyed, keyed]) is True
+
+    assert await redis_client.llen(REDIS_MESSAGE_QUEUE_NAME) == 2
+    assert queue.duplicate_messages == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_appends_duplicate_messages_once():
+    redis_client = create_fake_redis()
+    queue = RedisStreamQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client)
+    keyed = json.dumps(KEYED_TEST_MESSAGE)
+    unkeyed = json.dumps(UNKEYED_TEST_MESSAGE)
+
+    assert await queue.publish_many([keyed, keyed, unkeyed], idempotency_keys=["order-1", "order-1", None],
+                                    checkpoint=("checkpoint", 7)) is True
+    assert await queue.publish(keyed, idempotency_key="order-1") is True
+
+    entries = await redis_client.xrange(REDIS_MESSAGE_QUEUE_NAME)
+    assert [fields[b"data"] for _, fields in entries] == [keyed.encode(), unkeyed.encode()]
+    assert queue.duplicate_messages == 2
+    assert await redis_client.get("checkpoint") == b"7"
+    assert 0 < await redis_client.ttl(f"{REDIS_MESSAGE_QUEUE_NAME}:idempotency:order-1") <= queue.idempotency_window
+
+
+@pytest.mark.asyncio
+async def test_memory_queue_stores_duplicate_messages_once():
+    queue = InMemoryQueue(REDIS_MESSAGE_QUEUE_NAME, broker=InMemoryBroker())
+
+    assert await queue.publish_many([KEYED_TEST_MESSAGE, KEYED_TEST_MESSAGE, UNKEYED_TEST_MESSAGE],
+                                    idempotency_keys=["order-1", "order-1", None]) is True
+    assert await queue.publish(KEYED_TEST_MESSAGE, idempotency_key="order-1") is True
+
+    assert await queue.subscribe_batch(10, subscribe_timeout=0) == [KEYED_TEST_MESSAGE, UNKEYED_TEST_MESSAGE]
+    assert queue.duplicate_messages == 2
+
+
+def test_memory_broker_forgets_keys_after_the_window():
+    broker = InMemoryBroker()
+
+    assert broker.claim_idempotency_key("order-1", 60) is True
+    assert broker.claim_idempotency_key("order-1", 60) is False
+    assert broker.claim_idempotency_key("order-2", 0) is True
+    assert broker.claim_idempotency_key("order-2", 60) is True
@@ -0,0 +1,48 @@
+import logging
+from src.utils.logger import SampledRecordFilter, LogPayload, get_logger, LOGGER_NAME
+
+MAX_RECORDS_PER_SECOND = 3
+TEST_PAYLOAD = '{"type": "test", "content": "test_message"}'
+
+
+def make_record(msg, sampled=True):
+    record = logging.LogRecord("test", logging.INFO, __file__, 0, msg, (), None)
+    if sampled:
+        record.sampled = True
+    return record
+
+
+def test_sampled_records_are_rate_limited():
+    record_filter = SampledRecordFilter(max_per_second=MAX_RECORDS_PER_SECOND)
+
+    results = [record_filter.filter(make_record("[Test] message %s")) for _ in range(10)]
+
+    assert results == [True] * MAX_RECORDS_PER_SECOND + [False] * (10 - MAX_RECORDS_PER_SECOND)
+
+
+def test_unsampled_records_are_never_limited():
+    record_filter = SampledRecordFilter(max_per_second=MAX_RECORDS_PER_SECOND)
+
+    assert all(record_filter.filter(make_record("[Test] error", sampled=False)) for _ in range(10))
+
+
+def test_payload_is_omitted_by_default():
+    assert str(LogPayload(TEST_PAYLOAD, max_length=0)) == f"<{len(TEST_PAYLOAD)} chars>"
+
+
+def test_payload_is_truncated():
+    assert str(LogPayload(TEST_PAYLOAD.encode(), max_length=8)) == f'{TEST_PAYLOAD[:8]}...<{len(TEST_PAYLOAD)} chars>'
+
+
+def test_module_logger_is_a_child_of_the_application_logger():
+    assert get_logger("src.message_queue.redis_queue").name == f"{LOGGER_NAME}.message_queue.redis_queue"
+
+
+def test_queued_records_carry_only_the_message():
+    from src.utils.logger import _queue_handler
+
+    record = make_record("[Test] value %s", sampled=False)
+    record.args = (1,)
+    prepared = _queue_handler.prepare(record)
+
+    assert prepared.getMessage() == "[Test] value 1"
@@ -0,0 +1,152 @@
+import pytest
+import asyncio
+import json
+from src.message_queue.base_queue import MessageQueue
+from src.message_queue.memory_queue import InMemoryQueue, InMemoryBroker
+from src.message_queue.overflow import QueueFullError
+from src.message_queue.queue_factory import create_queue
+
+REDIS_MESSAGE_QUEUE_NAME = "test_queue"
+REDIS_MESSAGE_QUEUE_MAX_SIZE = 5
+SUBSCRIBE_TIMEOUT = 0.05
+VALID_TEST_MESSAGE = {"type": "test", "content": "test_message"}
+
+
+def create_memory_queue(broker=None, **kwargs):
+    return InMemoryQueue(REDIS_MESSAGE_QUEUE_NAME, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                         broker=broker or InMemoryBroker(), **kwargs)
+
+
+def test_factory_creates_memory_backend():
+    queue = create_queue(REDIS_MESSAGE_QUEUE_NAME, backend="memory")
+
+    assert isinstance(queue, InMemoryQueue)
+    assert isinstance(queue, MessageQueue)
+
+
+@pytest.mark.asyncio
+async def test_objects_are_passed_by_reference():
+    queue = create_memory_queue()
+
+    await queue.publish(VALID_TEST_MESSAGE)
+
+    assert await queue.subscribe(SUBSCRIBE_TIMEOUT) is VALID_TEST_MESSAGE
+
+
+@pytest.mark.asyncio
+async def test_serialized_payloads_are_decoded_unless_raw():
+    queue = create_memory_queue()
+    await queue.publish_many([json.dumps(VALID_TEST_MESSAGE)] * 2)
+
+    assert await queue.subscribe_batch(1, SUBSCRIBE_TIMEOUT) == [VALID_TEST_MESSAGE]
+    assert await queue.subscribe_batch(1, SUBSCRIBE_TIMEOUT, raw=True) == [json.dumps(VALID_TEST_MESSAGE)]
+
+
+@pytest.mark.asyncio
+async def test_queues_with_the_same_broker_share_messages():
+    broker = InMemoryBroker()
+    publisher, subscriber = create_memory_queue(broker), create_memory_queue(broker)
+
+    await publisher.publish_many([{"index": index} for index in range(3)])
+
+    assert await subscriber.subscribe_batch(10, SUBSCRIBE_TIMEOUT) == [{"index": index} for index in range(3)]
+    assert await publisher.get_queue_size() == 0
+
+
+@pytest.mark.asyncio
+async def test_subscribe_waits_for_a_message():
+    queue = create_memory_queue()
+
+    subscriber = asyncio.create_task(queue.subscribe_batch(10, 1))
+    await asyncio.sleep(0)
+    await queue.publish(VALID_TEST_MESSAGE)
+
+    assert await asyncio.wait_for(subscriber, 0.5) == [VALID_TEST_MESSAGE]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_timeout():
+    queue = create_memory_queue()
+
+    assert await queue.subscribe_batch(10, SUBSCRIBE_TIMEOUT) == []
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_is_served_first():
+    queue = create_memory_queue()
+
+    await queue.publish({"content": "bulk"})
+    await queue.publish({"content": "urgent"}, priority=2)
+
+    assert await queue.subscribe(SUBSCRIBE_TIMEOUT) == {"content": "urgent"}
+
+
+@pytest.mark.asyncio
+async def test_type_routing_with_patterns():
+    queue = create_memory_queue()
+
+    await queue.publish_many([{"content": "a"}, {"content": "b"}], ["orders", "payments"])
+
+    assert await queue.subscribe_batch(10, SUBSCRIBE_TIMEOUT, message_types=["pay*"]) == [{"content": "b"}]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_counts_dropped_messages():
+    queue = create_memory_queue()
+
+    await queue.publish_many([{"index": index} for index in range(REDIS_MESSAGE_QUEUE_MAX_SIZE + 2)])
+
+    assert queue.dropped_messages == 2
+    assert (await queue.subscribe_batch(10, SUBSCRIBE_TIMEOUT))[0] == {"index": 2}
+
+
+@pytest.mark.asyncio
+async def test_reject_new_raises_when_queue_is_full():
+    queue = create_memory_queue(overflow_policy="reject_new")
+    await queue.publish_many([VALID_TEST_MESSAGE] * REDIS_MESSAGE_QUEUE_MAX_SIZE)
+
+    with pytest.raises(QueueFullError):
+        await queue.publish(VALID_TEST_MESSAGE)
+    assert await queue.get_queue_size() == REDIS_MESSAGE_QUEUE_MAX_SIZE
+
+
+@pytest.mark.asyncio
+async def test_block_waits_for_room():
+    queue = create_memory_queue(overflow_policy="block", overflow_block_timeout=1)
+    await queue.publish_many([VALID_TEST_MESSAGE] * REDIS_MESSAGE_QUEUE_MAX_SIZE)
+
+    publisher = asyncio.create_task(queue.publish({"content": "late"}))
+    await asyncio.sleep(0.01)
+    await queue.subscribe_batch(1, SUBSCRIBE_TIMEOUT)
+
+    assert await asyncio.wait_for(publisher, 1) is True
+    assert await queue.get_queue_size() == REDIS_MESSAGE_QUEUE_MAX_SIZE
+
+
+EXPIRED_TEST_MESSAGE = {"expires_at": 1, "type": "test", "content": "expired_message"}
+
+
+@pytest.mark.asyncio
+async def test_expired_messages_are_not_delivered():
+    queue = create_memory_queue()
+    await queue.publish_many([EXPIRED_TEST_MESSAGE, VALID_TEST_MESSAGE])
+
+    assert await queue.subscribe_batch(10, SUBSCRIBE_TIMEOUT) == [VALID_TEST_MESSAGE]
+    assert queue.expired_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_sweep_evicts_expired_messages():
+    queue = create_memory_queue()
+    await queue.publish_many([EXPIRED_TEST_MESSAGE, VALID_TEST_MESSAGE, json.dumps(EXPIRED_TEST_MESSAGE)])
+
+    assert await queue.sweep_expired() == 2
+    assert await queue.get_queue_size() == 1
+
+
+@pytest.mark.asyncio
+async def test_queue_size_counts_type_keys_and_lanes():
+    queue = create_memory_queue()
+    await queue.publish_many([VALID_TEST_MESSAGE] * 3, ["orders", "orders", None], [0, 1, 0])
+
+    assert await queue.get_queue_size() == 3
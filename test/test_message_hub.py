@@ -0,0 +1,275 @@
+import pytest
+import asyncio
+import json
+import fakeredis
+from unittest.mock import AsyncMock
+from src.message_queue.redis_stream_queue import RedisStreamQueue
+from src.service_b.message_subscriber import MessageSubscriber
+from src.service_b.message_hub import MessageHub, HubClient
+from src.service_b.replay_buffer import ReplayBuffer
+
+TEST_MESSAGES = [{"type": "test", "content": f"message {i}"} for i in range(3)]
+CLIENT_QUEUE_SIZE = 2
+
+
+def queued_messages(client):
+    return list(client.send_queue._queue)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_delivers_every_message_to_every_client():
+    hub = MessageHub(AsyncMock(), delivery_mode="broadcast", client_queue_size=10)
+    clients = [hub.register(AsyncMock()) for _ in range(3)]
+
+    for message in TEST_MESSAGES:
+        await hub.dispatch(message)
+
+    for client in clients:
+        assert queued_messages(client) == TEST_MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_competing_delivers_each_message_once_round_robin():
+    hub = MessageHub(AsyncMock(), delivery_mode="competing", client_queue_size=10)
+    clients = [hub.register(AsyncMock()) for _ in range(3)]
+
+    for message in TEST_MESSAGES:
+        await hub.dispatch(message)
+
+    assert [queued_messages(client) for client in clients] == [[message] for message in TEST_MESSAGES]
+
+
+@pytest.mark.asyncio
+async def test_drop_oldest_policy():
+    client = HubClient(AsyncMock(), queue_size=CLIENT_QUEUE_SIZE, overflow_policy="drop_oldest")
+
+    for message in TEST_MESSAGES:
+        assert await client.enqueue(message) is True
+
+    assert queued_messages(client) == TEST_MESSAGES[1:]
+    assert client.dropped_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_unregisters_slow_client():
+    hub = MessageHub(AsyncMock(), delivery_mode="broadcast", client_queue_size=CLIENT_QUEUE_SIZE, overflow_policy="disconnect")
+    client = hub.register(AsyncMock())
+
+    for message in TEST_MESSAGES:
+        await hub.dispatch(message)
+
+    assert client.closed is True
+    assert client not in hub.clients
+
+
+@pytest.mark.asyncio
+async def test_block_policy_waits_for_room():
+    client = HubClient(AsyncMock(), queue_size=CLIENT_QUEUE_SIZE, overflow_policy="block")
+    for message in TEST_MESSAGES[:CLIENT_QUEUE_SIZE]:
+        await client.enqueue(message)
+
+    blocked = asyncio.create_task(client.enqueue(TEST_MESSAGES[-1]))
+    await asyncio.sleep(0)
+    assert not blocked.done()
+
+    client.send_queue.get_nowait()
+    assert await asyncio.wait_for(blocked, timeout=1) is True
+
+
+@pytest.mark.asyncio
+async def test_single_consumer_feeds_all_clients():
+    subscriber_mock = AsyncMock()
+    subscriber_mock.subscribe_batch.side_effect = [TEST_MESSAGES] + [asyncio.CancelledError()]
+    hub = MessageHub(subscriber_mock, delivery_mode="broadcast", client_queue_size=10)
+    handlers = [AsyncMock(framing="single") for _ in range(2)]
+    clients = [hub.register(handler) for handler in handlers]
+
+    senders = [asyncio.create_task(client.run()) for client in clients]
+    await hub.start()
+    await asyncio.sleep(0.01)
+    await hub.stop()
+    await asyncio.gather(*senders)
+
+    assert subscriber_mock.subscribe_batch.await_count == 2
+    for handler in handlers:
+        assert [call.args[0] for call in handler.send_message.await_args_list] == TEST_MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_batching_client_coalesces_queued_messages():
+    handler = AsyncMock(framing="array", max_batch_messages=10)
+    client = HubClient(handler, queue_size=10, batch_window=0.01)
+    sender = asyncio.create_task(client.run())
+
+    await client.enqueue(TEST_MESSAGES[0])
+    await asyncio.sleep(0)
+    for message in TEST_MESSAGES[1:]:
+        await client.enqueue(message)
+    await asyncio.sleep(0.05)
+    client.close()
+    await sender
+
+    handler.send_messages.assert_awaited_once_with(TEST_MESSAGES)
+    handler.send_message.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_failed_send_hands_undelivered_messages_to_redelivery():
+    scheduler = AsyncMock()
+    hub = MessageHub(AsyncMock(), delivery_mode="competing", client_queue_size=10, redelivery_scheduler=scheduler)
+    handler = AsyncMock(framing="single")
+    handler.send_message.side_effect = RuntimeError("closed")
+    client = hub.register(handler)
+    for message in TEST_MESSAGES:
+        await hub.dispatch(message)
+
+    with pytest.raises(RuntimeError):
+        await client.run()
+    hub.unregister(client)
+    await hub.stop()
+
+    scheduler.schedule.assert_awaited_once_with(TEST_MESSAGES, "client disconnected")
+
+
+@pytest.mark.asyncio
+async def test_broadcast_does_not_redeliver():
+    scheduler = AsyncMock()
+    hub = MessageHub(AsyncMock(), delivery_mode="broadcast", client_queue_size=10, redelivery_scheduler=scheduler)
+    client = hub.register(AsyncMock())
+    await hub.dispatch(TEST_MESSAGES[0])
+
+    hub.unregister(client)
+    await hub.stop()
+
+    scheduler.schedule.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_competing_redelivers_messages_read_after_the_last_client_left():
+    scheduler = AsyncMock()
+    subscriber_mock = AsyncMock()
+    subscriber_mock.subscribe_batch.side_effect = [TEST_MESSAGES] + [asyncio.CancelledError()]
+    hub = MessageHub(subscriber_mock, delivery_mode="competing", redelivery_scheduler=scheduler)
+    hub._has_clients.set()
+
+    await hub.start()
+    await asyncio.sleep(0.01)
+    await hub.stop()
+
+    scheduler.schedule.assert_awaited_once_with(TEST_MESSAGES, "no client available")
+    subscriber_mock.ack.assert_awaited_once_with(TEST_MESSAGES)
+
+
+@pytest.mark.asyncio
+async def test_resumed_client_receives_the_gap_before_live_messages():
+    hub = MessageHub(AsyncMock(), delivery_mode="broadcast", client_queue_size=10, replay_buffer=ReplayBuffer(max_size=10, first_offset=1))
+    live_handler = AsyncMock(framing="array", max_batch_messages=10)
+    hub.register(live_handler)
+    for message in TEST_MESSAGES[:2]:
+        await hub.dispatch(message)
+
+    handler = AsyncMock(framing="array", max_batch_messages=10)
+    client = hub.register(handler, resume_offset=1)
+    await hub.dispatch(TEST_MESSAGES[2])
+    sender = asyncio.create_task(client.run())
+    await asyncio.sleep(0.05)
+    client.close()
+    await sender
+
+    sent = [call.args[0] for call in handler.send_messages.await_args_list]
+    assert sent[0] == [{**TEST_MESSAGES[1], "offset": 2}]
+    assert sent[1] == [{**TEST_MESSAGES[2], "offset": 3}]
+
+
+@pytest.mark.asyncio
+async def test_client_without_offset_starts_at_live_messages():
+    hub = MessageHub(AsyncMock(), delivery_mode="broadcast", client_queue_size=10, replay_buffer=ReplayBuffer(max_size=10, first_offset=1))
+    await hub.dispatch(TEST_MESSAGES[0])
+
+    client = hub.register(AsyncMock())
+
+    assert client.catch_up == []
+
+
+@pytest.mark.asyncio
+async def test_stream_entries_stay_pending_until_sent():
+    redis_client = fakeredis.aioredis.FakeRedis()
+    queue = RedisStreamQueue("test_stream", redis_client=redis_client, blocking_client=redis_client,
+                             consumer_group="test_group", consumer_name="test_consumer")
+    await queue.publish_many([json.dumps(message) for message in TEST_MESSAGES])
+    subscriber = MessageSubscriber(queue, filter_mode="allow_all", forward_raw=False, type_routing=False)
+    hub = MessageHub(subscriber, delivery_mode="competing", client_queue_size=10)
+    handler = AsyncMock(framing="single")
+    # The client dies after sending the first message; the other two are still in its send queue.
+    handler.send_message.side_effect = [None, RuntimeError("closed")]
+    client = hub.register(handler)
+
+    # fakeredis does not block in XREADGROUP, so reads after the first one wait here instead.
+    batches = [await subscriber.subscribe_batch()]
+
+    async def subscribe_batch():
+        if batches:
+            return batches.pop()
+        await asyncio.Event().wait()
+    subscriber.subscribe_batch = subscribe_batch
+
+    await hub.start()
+    await asyncio.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        await client.run()
+    hub.unregister(client)
+    await hub.stop()
+
+    pending = await redis_client.xpending("test_stream", "test_group")
+    assert pending["pending"] == len(TEST_MESSAGES) - 1
+
+
+@pytest.mark.asyncio
+async def test_broadcast_acks_once_every_client_is_done():
+    subscriber_mock = AsyncMock()
+    hub = MessageHub(subscriber_mock, delivery_mode="broadcast", client_queue_size=10)
+    sender, leaver = hub.register(AsyncMock(framing="single")), hub.register(AsyncMock(framing="single"))
+    await hub.dispatch(TEST_MESSAGES[0])
+
+    sending = asyncio.create_task(sender.run())
+    await asyncio.sleep(0.01)
+    subscriber_mock.ack.assert_not_awaited()
+
+    # A broadcast client that leaves gives up its copy.
+    hub.unregister(leaver)
+    await hub.stop()
+    await sending
+    subscriber_mock.ack.assert_awaited_once_with([TEST_MESSAGES[0]])
+
+
+@pytest.mark.asyncio
+async def test_competing_blocks_on_a_slow_single_client_by_default():
+    hub = MessageHub(AsyncMock(), delivery_mode="competing", client_queue_size=CLIENT_QUEUE_SIZE)
+    client = hub.register(AsyncMock())
+    for message in TEST_MESSAGES[:CLIENT_QUEUE_SIZE]:
+        await hub.dispatch(message)
+
+    # The hub stops reading instead of discarding a message that has already left Redis.
+    blocked = asyncio.create_task(hub.dispatch(TEST_MESSAGES[-1]))
+    await asyncio.sleep(0)
+    assert not blocked.done()
+
+    client.send_queue.get_nowait()
+    assert await asyncio.wait_for(blocked, timeout=1) is True
+    assert queued_messages(client) == TEST_MESSAGES[1:]
+    assert client.dropped_messages == 0
+
+
+@pytest.mark.asyncio
+async def test_competing_redelivers_messages_dropped_by_a_slow_client():
+    scheduler = AsyncMock()
+    subscriber_mock = AsyncMock()
+    hub = MessageHub(subscriber_mock, delivery_mode="competing", client_queue_size=CLIENT_QUEUE_SIZE,
+                     overflow_policy="drop_oldest", redelivery_scheduler=scheduler)
+    hub.register(AsyncMock())
+
+    for message in TEST_MESSAGES:
+        await hub.dispatch(message)
+
+    scheduler.schedule.assert_awaited_once_with([TEST_MESSAGES[0]], "dropped by a full send queue")
+    subscriber_mock.ack.assert_awaited_once_with([TEST_MESSAGES[0]])
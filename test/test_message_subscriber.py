@@ -1,4 +1,6 @@
+import asyncio
 import pytest
+from unittest.mock import AsyncMock
 from src.service_b.message_subscriber import MessageSubscriber
 from src.utils.config import ALLOWED_TYPE
 
@@ -22,4 +24,54 @@ In this case, only messages with a 'type' matching ALLOWED_TYPE will be forwarde
 )
 def test_is_allowed_message_type(message, filter_mode, expected):
     subscriber = MessageSubscriber(filter_mode=filter_mode)
-    assert subscriber.is_allowed_message_type(message) == expected
\ No newline at end of file
+    assert subscriber.is_allowed_message_type(message) == expected
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_filters_messages():
+    queue_mock = AsyncMock()
+    queue_mock.subscribe_batch.return_value = [
+        {"type": ALLOWED_TYPE, "content": "test"},
+        {"type": "different_type", "content": "test"},
+    ]
+    subscriber = MessageSubscriber(redis_queue=queue_mock, filter_mode="specific_type")
+
+    result = await subscriber.subscribe_batch()
+
+    assert result == [{"type": ALLOWED_TYPE, "content": "test"}]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_forwards_raw_payloads_without_filter():
+    queue_mock = AsyncMock()
+    queue_mock.subscribe_batch.return_value = [b'{"type": "test", "content": "test"}']
+    subscriber = MessageSubscriber(redis_queue=queue_mock, filter_mode="allow_all", forward_raw=True)
+
+    result = await subscriber.subscribe_batch(max_count=10)
+
+    assert result == [b'{"type": "test", "content": "test"}']
+    queue_mock.subscribe_batch.assert_called_with(10, raw=True, message_types=None)
+
+
+
+@pytest.mark.asyncio
+async def test_type_routing_reads_only_subscribed_types():
+    queue_mock = AsyncMock()
+    queue_mock.subscribe_batch.return_value = [{"type": ALLOWED_TYPE, "content": "test"}]
+    subscriber = MessageSubscriber(redis_queue=queue_mock, filter_mode="specific_type", forward_raw=False, type_routing=True)
+
+    result = await subscriber.subscribe_batch(max_count=10)
+
+    assert result == [{"type": ALLOWED_TYPE, "content": "test"}]
+    queue_mock.subscribe_batch.assert_called_with(10, raw=False, message_types=[ALLOWED_TYPE])
+    queue_mock.ack.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_run_expiry_sweep_keeps_running_after_errors():
+    queue_mock = AsyncMock()
+    queue_mock.sweep_expired.side_effect = [Exception("Connection lost"), 3, asyncio.CancelledError()]
+    subscriber = MessageSubscriber(redis_queue=queue_mock)
+
+    with pytest.raises(asyncio.CancelledError):
+        await subscriber.run_expiry_sweep(interval=0)
+
+    assert queue_mock.sweep_expired.await_count == 3
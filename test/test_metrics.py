@@ -0,0 +1,54 @@
+from src.utils.metrics import MetricsRegistry, Counter, Gauge, Histogram
+
+LATENCY_BUCKETS = (0.01, 0.1, 1)
+
+
+def test_counter_renders_prometheus_text():
+    registry = MetricsRegistry(enabled=True)
+    counter = Counter("test_messages_total", "Test messages.", registry=registry)
+
+    counter.inc(backend="list")
+    counter.inc(2, backend="list")
+
+    assert counter.get(backend="list") == 3
+    assert registry.render() == (
+        "# HELP test_messages_total Test messages.\n"
+        "# TYPE test_messages_total counter\n"
+        'test_messages_total{backend="list"} 3\n'
+    )
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry(enabled=True)
+    histogram = Histogram("test_duration_seconds", "Test durations.", buckets=LATENCY_BUCKETS, registry=registry)
+
+    for value in (0.005, 0.05, 0.5, 5):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'test_duration_seconds_bucket{le="0.01"} 1' in lines
+    assert 'test_duration_seconds_bucket{le="1"} 3' in lines
+    assert 'test_duration_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_duration_seconds_count 4" in lines
+
+
+def test_gauge_callback_is_read_at_scrape_time():
+    registry = MetricsRegistry(enabled=True)
+    backlog = [1, 2]
+    Gauge("test_backlog", "Test backlog.", registry=registry, callback=lambda: len(backlog))
+
+    backlog.append(3)
+
+    assert "test_backlog 3" in registry.render().splitlines()
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry(enabled=False)
+    counter = Counter("test_messages_total", "Test messages.", registry=registry)
+    histogram = Histogram("test_duration_seconds", "Test durations.", buckets=LATENCY_BUCKETS, registry=registry)
+
+    counter.inc()
+    histogram.observe(0.5)
+
+    assert counter.get() == 0
+    assert histogram.get_count() == 0
@@ -0,0 +1,199 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from src.message_queue.partitioned_queue import PartitionedQueue
+from src.message_queue.partitioning import ConsistentHashRing
+from src.message_queue.overflow import QueueFullError
+from src.message_queue.queue_factory import create_queue
+
+REDIS_MESSAGE_QUEUE_NAME = "test_queue"
+PARTITION_COUNT = 4
+CHECKPOINT = ("test_queue:spill:log", 7)
+
+
+def create_partitioned_queue(**kwargs):
+    queue = PartitionedQueue(REDIS_MESSAGE_QUEUE_NAME, partition_count=PARTITION_COUNT, **kwargs)
+    queue.partitions = [AsyncMock() for _ in range(PARTITION_COUNT)]
+    for partition in queue.partitions:
+        partition.publish_many.return_value = True
+    queue.redis_client = AsyncMock()
+    return queue
+
+
+def published_messages(partition):
+    return [message for call in partition.publish_many.await_args_list for message in call.args[0]]
+
+
+def test_factory_creates_partitioned_queue():
+    queue = create_queue(REDIS_MESSAGE_QUEUE_NAME, backend="list", partitions=PARTITION_COUNT)
+
+    assert isinstance(queue, PartitionedQueue)
+    assert [partition.queue_name for partition in queue.partitions] == [f"{{test_queue:{index}}}" for index in range(PARTITION_COUNT)]
+    with pytest.raises(ValueError):
+        create_queue(REDIS_MESSAGE_QUEUE_NAME, backend="stream", partitions=PARTITION_COUNT)
+
+
+def test_partitions_are_placed_round_robin_on_servers():
+    queue = PartitionedQueue(REDIS_MESSAGE_QUEUE_NAME, partition_count=PARTITION_COUNT, connection_urls=["redis://a", "redis://b"])
+
+    assert [partition.connection_url for partition in queue.partitions] == ["redis://a", "redis://b"] * 2
+
+
+@pytest.mark.asyncio
+async def test_messages_of_a_key_go_to_one_partition_in_order():
+    queue = create_partitioned_queue()
+    messages = [json.dumps({"type": "orders", "key": f"customer-{index % 3}", "content": str(index)}) for index in range(30)]
+
+    assert await queue.publish_many(messages) is True
+
+    ring = ConsistentHashRing(PARTITION_COUNT)
+    for customer in range(3):
+        partition = queue.partitions[ring.get_partition(f"customer-{customer}")]
+        assert [message for message in published_messages(partition) if f'"customer-{customer}"' in message] == messages[customer::3]
+
+
+@pytest.mark.asyncio
+async def test_given_partition_keys_are_used_without_decoding():
+    queue = create_partitioned_queue()
+    queue.codec = MagicMock()
+    messages = [json.dumps({"type": "orders", "content": str(index)}) for index in range(4)]
+
+    assert await queue.publish_many(messages, partition_keys=["customer-1"] * 4) is True
+
+    partition = queue.partitions[ConsistentHashRing(PARTITION_COUNT).get_partition("customer-1")]
+    assert published_messages(partition) == messages
+    queue.codec.decode.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_checkpoint_is_written_after_every_partition():
+    queue = create_partitioned_queue()
+
+    await queue.publish_many([{"type": f"type-{index}", "content": "x"} for index in range(10)], checkpoint=CHECKPOINT)
+
+    queue.redis_client.set.assert_awaited_once_with(*CHECKPOINT)
+
+
+@pytest.mark.asyncio
+async def test_partition_failure_fails_the_batch():
+    queue = create_partitioned_queue()
+    for partition in queue.partitions:
+        partition.publish_many.return_value = False
+
+    assert await queue.publish_many([{"type": "orders", "content": "x"}], checkpoint=CHECKPOINT) is False
+    queue.redis_client.set.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_rejected_partition_raises_queue_full():
+    queue = create_partitioned_queue()
+    for partition in queue.partitions:
+        partition.publish_many.side_effect = QueueFullError("full")
+
+    with pytest.raises(QueueFullError):
+        await queue.publish_many([{"type": "orders", "content": "x"}])
+
+
+def create_consumer(server, consumer_id, leases, **kwargs):
+    queue = create_partitioned_queue(consumer_id=consumer_id, rebalance_interval=60, read_timeout=0.01, **kwargs)
+    queue.redis_client = FakeRedis(server=server)
+
+    async def acquire_lease(partition):
+        return leases.setdefault(partition, consumer_id) == consumer_id
+
+    async def release_lease(partition):
+        if leases.get(partition) == consumer_id:
+            del leases[partition]
+
+    async def subscribe_lane_batch(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return None, []
+
+    queue.acquire_lease, queue.release_lease = acquire_lease, release_lease
+    for partition in queue.partitions:
+        partition.subscribe_lane_batch.side_effect = subscribe_lane_batch
+    return queue
+
+
+def serve_batches(partition, batches):
+    async def subscribe_lane_batch(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return ("lane", batches.pop(0)) if batches else (None, [])
+
+    partition.subscribe_lane_batch.side_effect = subscribe_lane_batch
+
+
+@pytest.mark.asyncio
+async def test_partitions_rebalance_when_consumers_join_and_leave():
+    server, leases = FakeServer(), {}
+    first, second = create_consumer(server, "a", leases), create_consumer(server, "b", leases)
+
+    await first.rebalance()
+    assert sorted(first.owned) == list(range(PARTITION_COUNT))
+
+    await first.start_consuming()
+    await second.rebalance()
+    await first.rebalance()
+    await second.rebalance()
+    assert (sorted(first.owned), sorted(second.owned)) == ([0, 2], [1, 3])
+
+    await second.start_consuming()
+    await second.stop_consuming()
+    await first.rebalance()
+    assert sorted(first.owned) == list(range(PARTITION_COUNT))
+    await first.stop_consuming()
+    assert leases == {}
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_returns_prefetched_messages():
+    queue = create_consumer(FakeServer(), "a", {})
+    serve_batches(queue.partitions[0], [[json.dumps({"content": index}) for index in range(3)]])
+
+    await queue.rebalance()
+    await queue.start_consuming()
+
+    assert await queue.subscribe_batch(2, 1) == [{"content": 0}, {"content": 1}]
+    assert await queue.subscribe(1) == {"content": 2}
+    await queue.stop_consuming()
+
+
+@pytest.mark.asyncio
+async def test_released_partition_puts_prefetched_messages_back():
+    queue = create_consumer(FakeServer(), "a", {})
+    serve_batches(queue.partitions[0], [["m0", "m1", "m2"], ["m3", "m4"]])
+
+    await queue.rebalance()
+    await queue.start_consuming(raw=True)
+    assert await queue.subscribe_batch(1, 1) == ["m0"]
+    await asyncio.sleep(0.05)
+
+    stopped, reader = queue.owned[0]
+    await queue.release(0)
+
+    assert reader.done()
+    queue.partitions[0].requeue.assert_awaited_once_with("lane", ["m1", "m2", "m3", "m4"])
+    # Nothing of partition 0 is delivered after the handoff.
+    reads = queue.partitions[0].subscribe_lane_batch.await_count
+    assert await queue.subscribe_batch(10, 0.05) == []
+    assert queue.partitions[0].subscribe_lane_batch.await_count == reads
+    await queue.stop_consuming()
+
+
+@pytest.mark.asyncio
+async def test_reader_waiting_for_a_prefetch_slot_stops_without_reading():
+    queue = create_consumer(FakeServer(), "a", {}, prefetch_batches=1)
+    serve_batches(queue.partitions[0], [["m0"], ["m1"]])
+
+    await queue.rebalance()
+    await queue.start_consuming(raw=True)
+    await asyncio.sleep(0.05)
+    await queue.release(0)
+    await asyncio.sleep(0.05)
+
+    queue.partitions[0].requeue.assert_awaited_once_with("lane", ["m0"])
+    assert queue.partitions[0].subscribe_lane_batch.await_count == 1
+    await queue.stop_consuming()
@@ -0,0 +1,40 @@
+from src.message_queue.partitioning import ConsistentHashRing, get_partition_key, assign_partitions
+
+PARTITION_COUNT = 8
+TEST_KEYS = [f"key-{index}" for index in range(2000)]
+
+
+def test_same_key_maps_to_the_same_partition():
+    assert [ConsistentHashRing(PARTITION_COUNT).get_partition(key) for key in TEST_KEYS] == \
+           [ConsistentHashRing(PARTITION_COUNT).get_partition(key) for key in TEST_KEYS]
+
+
+def test_keys_are_spread_over_all_partitions():
+    ring = ConsistentHashRing(PARTITION_COUNT)
+
+    assert {ring.get_partition(key) for key in TEST_KEYS} == set(range(PARTITION_COUNT))
+
+
+def test_adding_a_partition_only_moves_its_share_of_keys():
+    before, after = ConsistentHashRing(PARTITION_COUNT), ConsistentHashRing(PARTITION_COUNT + 1)
+
+    moved = [key for key in TEST_KEYS if before.get_partition(key) != after.get_partition(key)]
+
+    assert all(after.get_partition(key) == PARTITION_COUNT for key in moved)
+    assert len(moved) < len(TEST_KEYS) * 2 / (PARTITION_COUNT + 1)
+
+
+def test_partition_key_prefers_the_explicit_key():
+    assert get_partition_key({"type": "orders", "key": "customer-1"}) == "customer-1"
+    assert get_partition_key({"type": "orders"}) == "orders"
+    assert get_partition_key("not a message") is None
+
+
+def test_assignment_covers_every_partition_once():
+    members = ["b", "a", "c"]
+
+    assignments = [assign_partitions(PARTITION_COUNT, members, member) for member in members]
+
+    assert sorted(partition for assigned in assignments for partition in assigned) == list(range(PARTITION_COUNT))
+    assert {len(assigned) for assigned in assignments} == {2, 3}
+    assert assign_partitions(PARTITION_COUNT, members, "unknown") == []
@@ -0,0 +1,38 @@
+from collections import Counter
+
+import pytest
+
+from src.message_queue.priority_lanes import PriorityLanes
+
+QUEUE_NAME = "test_queue"
+
+
+def test_lane_keys():
+    lanes = PriorityLanes(levels=3)
+
+    assert lanes.lane_key(QUEUE_NAME) == QUEUE_NAME
+    assert lanes.lane_key(QUEUE_NAME, 2) == f"{QUEUE_NAME}:priority:2"
+    assert lanes.lane_key(QUEUE_NAME, 7) == f"{QUEUE_NAME}:priority:2"
+
+
+def test_strict_policy_serves_highest_lane_first():
+    lanes = PriorityLanes(levels=3, policy="strict")
+
+    assert lanes.lanes_in_order([QUEUE_NAME]) == [f"{QUEUE_NAME}:priority:2", f"{QUEUE_NAME}:priority:1", QUEUE_NAME]
+
+
+def test_weighted_policy_shares_first_place_by_weight():
+    lanes = PriorityLanes(levels=3, policy="weighted", weights=(1, 2, 4))
+
+    first_lanes = Counter(lanes.lanes_in_order([QUEUE_NAME])[0] for _ in range(70))
+
+    assert first_lanes == {f"{QUEUE_NAME}:priority:2": 40, f"{QUEUE_NAME}:priority:1": 20, QUEUE_NAME: 10}
+
+
+def test_single_level_uses_the_queue_only():
+    assert PriorityLanes(levels=1).lanes_in_order([QUEUE_NAME]) == [QUEUE_NAME]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        PriorityLanes(policy="random")
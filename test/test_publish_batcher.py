@@ -0,0 +1,57 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from src.message_queue.publish_batcher import PublishBatcher
+from src.message_queue.overflow import QueueFullError
+
+VALID_TEST_MESSAGE = json.dumps({"type": "test", "content": "test_message"})
+BATCH_MAX_SIZE = 10
+BATCH_MAX_DELAY = 0.01
+
+
+@pytest.mark.asyncio
+async def test_concurrent_publishes_are_coalesced():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.return_value = True
+    batcher = PublishBatcher(queue_mock, max_batch_size=BATCH_MAX_SIZE, max_delay=BATCH_MAX_DELAY)
+
+    results = await asyncio.gather(*(batcher.publish(VALID_TEST_MESSAGE) for _ in range(5)))
+
+    assert results == [True] * 5
+    queue_mock.publish_many.assert_awaited_once_with([VALID_TEST_MESSAGE] * 5, None, None, idempotency_keys=None, partition_keys=None)
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_flushed_without_waiting():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.return_value = True
+    batcher = PublishBatcher(queue_mock, max_batch_size=BATCH_MAX_SIZE, max_delay=60)
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(batcher.publish(VALID_TEST_MESSAGE) for _ in range(BATCH_MAX_SIZE * 2))), timeout=1)
+
+    assert all(results)
+    assert queue_mock.publish_many.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_failure_is_reported_to_every_caller():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.side_effect = RuntimeError("Connection lost")
+    batcher = PublishBatcher(queue_mock, max_batch_size=BATCH_MAX_SIZE, max_delay=BATCH_MAX_DELAY)
+
+    results = await asyncio.gather(*(batcher.publish(VALID_TEST_MESSAGE) for _ in range(3)))
+
+    assert results == [False] * 3
+
+
+@pytest.mark.asyncio
+async def test_rejected_batch_raises_in_every_caller():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.side_effect = QueueFullError("Queue is full")
+    batcher = PublishBatcher(queue_mock, max_batch_size=BATCH_MAX_SIZE, max_delay=BATCH_MAX_DELAY)
+
+    results = await asyncio.gather(*(batcher.publish(VALID_TEST_MESSAGE) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, QueueFullError) for result in results)
@@ -0,0 +1,67 @@
+from src.service_a.rate_limiter import TokenBucketRateLimiter
+
+RATE = 10
+BURST = 5
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_is_admitted_then_limited():
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, clock=FakeClock())
+
+    results = [limiter.try_acquire({"client": 1})[0] for _ in range(BURST + 1)]
+
+    assert results == [True] * BURST + [False]
+
+
+def test_retry_after_reflects_refill_rate():
+    clock = FakeClock()
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, clock=clock)
+    limiter.try_acquire({"client": BURST})
+
+    allowed, retry_after = limiter.try_acquire({"client": 2})
+
+    assert allowed is False
+    assert retry_after == 2 / RATE
+    clock.now += retry_after
+    assert limiter.try_acquire({"client": 2}) == (True, 0)
+
+
+def test_buckets_are_independent():
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, clock=FakeClock())
+    limiter.try_acquire({"a": BURST})
+
+    assert limiter.try_acquire({"a": 1})[0] is False
+    assert limiter.try_acquire({"b": 1})[0] is True
+
+
+def test_rejected_request_does_not_consume_tokens():
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, clock=FakeClock())
+    limiter.try_acquire({"a": BURST})
+
+    assert limiter.try_acquire({"a": 1, "b": 1})[0] is False
+    assert limiter.try_acquire({"b": BURST})[0] is True
+
+
+def test_batch_larger_than_burst_leaves_bucket_in_debt():
+    clock = FakeClock()
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, clock=clock)
+
+    assert limiter.try_acquire({"client": BURST * 2})[0] is True
+    clock.now += BURST / RATE
+    assert limiter.try_acquire({"client": 1})[0] is False
+
+
+def test_least_recently_used_buckets_are_forgotten():
+    limiter = TokenBucketRateLimiter(rate=RATE, burst=BURST, max_keys=2, clock=FakeClock())
+    limiter.try_acquire({"a": BURST})
+    limiter.try_acquire({"b": 1})
+    limiter.try_acquire({"c": 1})
+
+    assert limiter.try_acquire({"a": 1})[0] is True
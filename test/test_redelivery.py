@@ -0,0 +1,159 @@
+import pytest
+import json
+import time
+import fakeredis
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+import src.service_b.app as service_b
+from src.message_queue.redelivery import RedeliveryScheduler, ATTEMPTS_FIELD, LAST_ERROR_FIELD
+from src.message_queue.redis_stream_queue import STREAM_ENTRY_ID_KEY
+
+REDIS_MESSAGE_QUEUE_NAME = "test_queue"
+MAX_ATTEMPTS = 3
+BASE_DELAY = 10
+TEST_MESSAGE = {"type": "test", "content": "test_message", "priority": 1}
+
+
+def create_scheduler(**kwargs):
+    queue = MagicMock(queue_name=REDIS_MESSAGE_QUEUE_NAME, redis_client=fakeredis.aioredis.FakeRedis())
+    queue.publish_many = AsyncMock(return_value=True)
+    return RedeliveryScheduler(queue, max_attempts=MAX_ATTEMPTS, base_delay=BASE_DELAY, max_delay=BASE_DELAY * 10, **kwargs)
+
+
+async def delayed_messages(scheduler):
+    payloads = await scheduler.redis_client.hvals(scheduler.messages_key)
+    return [json.loads(payload) for payload in payloads]
+
+
+async def dead_letter(scheduler, message):
+    for _ in range(MAX_ATTEMPTS):
+        await scheduler.schedule([message], "closed")
+
+
+async def make_due(scheduler):
+    for entry_id in await scheduler.redis_client.zrange(scheduler.delayed_key, 0, -1):
+        await scheduler.redis_client.zadd(scheduler.delayed_key, {entry_id: 0})
+
+
+@pytest.mark.asyncio
+async def test_failed_messages_are_scheduled_with_backoff():
+    scheduler = create_scheduler()
+
+    scheduled = await scheduler.schedule([{**TEST_MESSAGE, STREAM_ENTRY_ID_KEY: "1-0"}, json.dumps(TEST_MESSAGE)], RuntimeError("closed"))
+
+    assert scheduled == 2
+    # Payloads are stored as delivered, without the stream entry id or any bookkeeping.
+    assert await delayed_messages(scheduler) == [TEST_MESSAGE, TEST_MESSAGE]
+    attempts_key = scheduler.attempts_key(json.dumps(TEST_MESSAGE))
+    assert await scheduler.redis_client.get(attempts_key) == b"1"
+    assert 0 < await scheduler.redis_client.ttl(attempts_key) <= scheduler.attempts_ttl
+    due_times = [score for _, score in await scheduler.redis_client.zrange(scheduler.delayed_key, 0, -1, withscores=True)]
+    assert all(time.time() + BASE_DELAY / 2 - 1 <= due_time <= time.time() + BASE_DELAY for due_time in due_times)
+
+
+@pytest.mark.asyncio
+async def test_messages_are_dead_lettered_after_max_attempts():
+    scheduler = create_scheduler()
+
+    for _ in range(MAX_ATTEMPTS - 1):
+        assert await scheduler.schedule([TEST_MESSAGE], "closed") == 1
+
+    assert await scheduler.schedule([TEST_MESSAGE], "closed") == 0
+    dead_letters = await scheduler.list_dead_letters()
+    assert [(message[ATTEMPTS_FIELD], message[LAST_ERROR_FIELD]) for message in dead_letters] == [(MAX_ATTEMPTS, "closed")]
+    assert await scheduler.get_stats() == {"delayed": MAX_ATTEMPTS - 1, "dead_letters": 1}
+    assert await scheduler.redis_client.get(scheduler.attempts_key(json.dumps(TEST_MESSAGE))) is None
+
+
+@pytest.mark.asyncio
+async def test_expired_messages_are_not_scheduled():
+    scheduler = create_scheduler()
+
+    assert await scheduler.schedule([{**TEST_MESSAGE, "expires_at": 1}, TEST_MESSAGE], "closed") == 1
+    assert await scheduler.get_stats() == {"delayed": 1, "dead_letters": 0}
+    scheduler.queue.record_expired.assert_called_once_with(1)
+
+
+@pytest.mark.asyncio
+async def test_due_messages_are_published_again():
+    scheduler = create_scheduler(type_routing=True)
+    await scheduler.schedule([TEST_MESSAGE], "closed")
+    await scheduler.schedule([{**TEST_MESSAGE, "content": "later"}], "closed")
+    first_entry = (await scheduler.redis_client.zrange(scheduler.delayed_key, 0, 0))[0]
+    await scheduler.redis_client.zadd(scheduler.delayed_key, {first_entry: 0})
+
+    assert await scheduler.promote_due() == 1
+
+    payloads, message_types, priorities = scheduler.queue.publish_many.await_args.args
+    assert [json.loads(payload)["content"] for payload in payloads] in (["test_message"], ["later"])
+    assert message_types == ["test"]
+    assert priorities == [1]
+    assert scheduler.queue.publish_many.await_args.kwargs["idempotency_keys"] == [f"redelivery:{first_entry.decode()}"]
+    assert (await scheduler.get_stats())["delayed"] == 1
+    assert await scheduler.promote_due() == 0
+
+
+@pytest.mark.asyncio
+async def test_messages_stay_delayed_when_publishing_fails():
+    scheduler = create_scheduler()
+    scheduler.queue.publish_many.return_value = False
+    await scheduler.schedule([TEST_MESSAGE], "closed")
+    await make_due(scheduler)
+
+    with pytest.raises(RuntimeError):
+        await scheduler.promote_due()
+
+    assert (await scheduler.get_stats())["delayed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_dead_letters_are_replayed_with_attempts_reset():
+    scheduler = create_scheduler()
+    for index in range(3):
+        await dead_letter(scheduler, {**TEST_MESSAGE, "content": f"message {index}"})
+    await scheduler.redis_client.delete(scheduler.delayed_key, scheduler.messages_key)
+
+    assert await scheduler.replay_dead_letters(2) == 2
+
+    assert await scheduler.get_stats() == {"delayed": 2, "dead_letters": 1}
+    assert await delayed_messages(scheduler) == [{**TEST_MESSAGE, "content": f"message {index}"} for index in range(2)]
+    assert await scheduler.promote_due() == 2
+    assert await scheduler.purge_dead_letters() == 1
+    # The attempts start over, so a replayed message gets max_attempts more deliveries.
+    assert await scheduler.schedule([{**TEST_MESSAGE, "content": "message 0"}], "closed") == 1
+
+
+@pytest.mark.asyncio
+async def test_send_failure_schedules_redelivery_and_acks():
+    scheduler = create_scheduler()
+    send = AsyncMock(side_effect=RuntimeError("closed"))
+    with patch.object(service_b, "redelivery_scheduler", scheduler), \
+         patch.object(service_b, "message_subscriber", AsyncMock()) as subscriber_mock:
+        with pytest.raises(RuntimeError):
+            await service_b.send_or_redeliver(send(), [TEST_MESSAGE])
+
+    subscriber_mock.ack.assert_awaited_once_with([TEST_MESSAGE])
+    assert (await scheduler.get_stats())["delayed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_admin_api_lists_and_replays_dead_letters():
+    scheduler = create_scheduler()
+    for index in range(2):
+        await dead_letter(scheduler, {**TEST_MESSAGE, "content": f"message {index}"})
+    with patch.object(service_b, "redelivery_scheduler", scheduler):
+        listed = await service_b.list_dead_letters(offset=1, limit=10)
+        replayed = await service_b.replay_dead_letters(count=10)
+
+    assert listed["total"] == 2
+    assert len(listed["messages"]) == 1
+    assert replayed["replayed"] == 2
+
+
+def test_admin_api_without_redelivery():
+    client = TestClient(service_b.app)
+    with patch.object(service_b, "redelivery_scheduler", None):
+        response = client.get("/admin/dead-letters")
+
+    assert response.status_code == 404
+    assert response.json()["detail"] == "redelivery is disabled"
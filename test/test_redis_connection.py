@@ -0,0 +1,40 @@
+import redis.asyncio as redis
+
+from src.message_queue.redis_connection import create_redis_client, get_retry_delay
+
+VALID_CONNECTION_URL = "redis://localhost"
+BASE_DELAY = 1
+MAX_DELAY = 8
+
+
+def test_retry_delay_grows_exponentially_with_jitter():
+    for retry in range(1, 5):
+        upper_bound = BASE_DELAY * 2 ** (retry - 1)
+        delay = get_retry_delay(retry, BASE_DELAY, MAX_DELAY)
+        assert upper_bound / 2 <= delay <= upper_bound
+
+
+def test_retry_delay_is_capped():
+    assert get_retry_delay(10, BASE_DELAY, MAX_DELAY) <= MAX_DELAY
+
+
+def test_retry_delay_disabled():
+    assert get_retry_delay(3, 0) == 0
+
+
+async def test_create_redis_client_uses_bounded_pool():
+    client = create_redis_client(VALID_CONNECTION_URL, max_connections=7)
+    pool = client.connection_pool
+
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 7
+    assert pool.connection_kwargs["socket_keepalive"] is True
+    assert pool.connection_kwargs["socket_timeout"] is not None
+    await client.aclose()
+
+
+async def test_blocking_client_has_no_socket_timeout():
+    client = create_redis_client(VALID_CONNECTION_URL, max_connections=2, blocking=True)
+
+    assert client.connection_pool.connection_kwargs["socket_timeout"] is None
+    await client.aclose()
@@ -1,8 +1,9 @@
 import pytest
 import json
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from redis.exceptions import RedisError
-from src.message_queue.redis_queue import RedisQueue 
+from src.message_queue.redis_queue import RedisQueue
+from src.message_queue.overflow import QueueFullError
 
 VALID_CONNECTION_URL="redis://localhost"
 REDIS_MAX_RETRIES=3
@@ -12,59 +13,418 @@ VALID_TEST_MESSAGE=json.dumps({"type": "test", "content": "test_message"})
 REDIS_MESSAGE_QUEUE_NAME="test_queue"
 REDIS_RETRY_DELAY_SECONDS=2
 
+
+def lanes(*keys):
+    return [f"{key}:priority:{priority}" for priority in (2, 1) for key in keys] + list(keys)
+
+
+def mock_pipeline(redis_mock):
+    pipe = MagicMock()
+    pipe.__aenter__.return_value = pipe
+    pipe.execute = AsyncMock()
+    redis_mock.pipeline = MagicMock(return_value=pipe)
+    return pipe
+
+
 @pytest.mark.asyncio
 async def test_publish():
     redis_mock = AsyncMock()
-    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)    
-    redis_mock.rpush.return_value = 1
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    pipe.execute.return_value = [1, True]
 
     await queue.publish(VALID_TEST_MESSAGE)
 
-    redis_mock.rpush.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
+    pipe.rpush.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
 
 
 @pytest.mark.asyncio
 async def test_full_queue_handling():
     redis_mock = AsyncMock()
-    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)   
-    redis_mock.llen.return_value = REDIS_MESSAGE_QUEUE_MAX_SIZE + 1
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)
 
     await queue.publish(VALID_TEST_MESSAGE)
 
-    redis_mock.ltrim.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, -REDIS_MESSAGE_QUEUE_MAX_SIZE, -1)
+    # The push and the trim are sent together in one MULTI/EXEC transaction.
+    redis_mock.pipeline.assert_called_once_with(transaction=True)
+    pipe.ltrim.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, -REDIS_MESSAGE_QUEUE_MAX_SIZE, -1)
+    redis_mock.rpush.assert_not_called()
 
 
 @pytest.mark.asyncio
 async def test_publish_retry_on_disconnect_and_timeout():
     redis_mock = AsyncMock()
-    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_retries=REDIS_MAX_RETRIES, retry_delay=REDIS_RETRY_DELAY_SECONDS)
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_retries=REDIS_MAX_RETRIES, retry_delay=0)
     
-    redis_mock.rpush.side_effect = [RedisError("Connection lost"), TimeoutError("Timeout occurred"), None]
+    pipe.execute.side_effect = [RedisError("Connection lost"), TimeoutError("Timeout occurred"), [1, True]]
 
     result = await queue.publish(VALID_TEST_MESSAGE)
     
     assert result is True
-    assert redis_mock.rpush.call_count == REDIS_MAX_RETRIES
+    assert pipe.execute.await_count == REDIS_MAX_RETRIES
+
+
+@pytest.mark.asyncio
+async def test_publish_many():
+    redis_mock = AsyncMock()
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)
+
+    result = await queue.publish_many([VALID_TEST_MESSAGE] * 3)
+
+    assert result is True
+    redis_mock.pipeline.assert_called_once_with(transaction=True)
+    pipe.rpush.assert_called_once_with(REDIS_MESSAGE_QUEUE_NAME, *([VALID_TEST_MESSAGE] * 3))
+    pipe.ltrim.assert_called_once_with(REDIS_MESSAGE_QUEUE_NAME, -REDIS_MESSAGE_QUEUE_MAX_SIZE, -1)
+    pipe.execute.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_publish_many_retry_on_failure():
+    redis_mock = AsyncMock()
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_retries=REDIS_MAX_RETRIES, retry_delay=0)
+    pipe.execute.side_effect = RedisError("Connection lost")
+
+    result = await queue.publish_many([VALID_TEST_MESSAGE])
+
+    assert result is False
+    assert pipe.execute.await_count == REDIS_MAX_RETRIES
+
+
+@pytest.mark.asyncio
+async def test_publish_many_empty():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+
+    assert await queue.publish_many([]) is True
+    redis_mock.pipeline.assert_not_called()
 
 
 @pytest.mark.asyncio
 async def test_subscribe():
     redis_mock = AsyncMock()
     queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
-    redis_mock.brpop.return_value = (REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
+    redis_mock.blpop.return_value = (REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
     
     result = await queue.subscribe()
 
     assert result == json.loads(VALID_TEST_MESSAGE)
-    redis_mock.brpop.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS)
+    redis_mock.blpop.assert_called_with(lanes(REDIS_MESSAGE_QUEUE_NAME), timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS)
 
 
 @pytest.mark.asyncio
 async def test_subscribe_timeout():
     redis_mock = AsyncMock()
     queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
-    redis_mock.brpop.side_effect = TimeoutError("Timeout occurred")  
+    redis_mock.blpop.side_effect = TimeoutError("Timeout occurred")  
 
     result = await queue.subscribe()
     
     assert result is None
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_drains_available_messages():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    redis_mock.blpop.return_value = (REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
+    redis_mock.lpop.return_value = [VALID_TEST_MESSAGE, VALID_TEST_MESSAGE]
+
+    result = await queue.subscribe_batch(max_count=10)
+
+    assert result == [json.loads(VALID_TEST_MESSAGE)] * 3
+    redis_mock.blpop.assert_called_with(lanes(REDIS_MESSAGE_QUEUE_NAME), timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS)
+    redis_mock.lpop.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, 9)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_timeout():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    redis_mock.blpop.return_value = None
+
+    result = await queue.subscribe_batch()
+
+    assert result == []
+    redis_mock.lpop.assert_not_called()
+
+
+
+@pytest.mark.asyncio
+async def test_publish_many_routes_messages_by_type():
+    redis_mock = AsyncMock()
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)
+
+    await queue.publish_many(["a1", "b1", "a2"], ["a", "b", "a"])
+
+    pipe.rpush.assert_any_call(f"{REDIS_MESSAGE_QUEUE_NAME}:type:a", "a1", "a2")
+    pipe.rpush.assert_any_call(f"{REDIS_MESSAGE_QUEUE_NAME}:type:b", "b1")
+    pipe.sadd.assert_called_once_with(f"{REDIS_MESSAGE_QUEUE_NAME}:types", "a", "b")
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_blocks_on_all_matching_type_keys():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    redis_mock.smembers.return_value = {b"order.created", b"order.paid", b"audit"}
+    redis_mock.blpop.return_value = (f"{REDIS_MESSAGE_QUEUE_NAME}:type:order.paid".encode(), VALID_TEST_MESSAGE)
+    redis_mock.lpop.return_value = None
+
+    result = await queue.subscribe_batch(max_count=10, message_types=["order.*"])
+
+    assert result == [json.loads(VALID_TEST_MESSAGE)]
+    redis_mock.blpop.assert_called_with(lanes(f"{REDIS_MESSAGE_QUEUE_NAME}:type:order.created", f"{REDIS_MESSAGE_QUEUE_NAME}:type:order.paid"),
+                                        timeout=REDIS_MESSAGE_SUBSCRIBE_TIMEOUT_SECONDS)
+    redis_mock.lpop.assert_called_with(f"{REDIS_MESSAGE_QUEUE_NAME}:type:order.paid".encode(), 9)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_blocks_on_dedicated_client():
+    redis_mock = AsyncMock()
+    blocking_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, blocking_client=blocking_mock)
+    blocking_mock.blpop.return_value = (REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)
+    redis_mock.lpop.return_value = None
+
+    await queue.subscribe_batch(max_count=10)
+
+    blocking_mock.blpop.assert_called_once()
+    redis_mock.blpop.assert_not_called()
+    redis_mock.lpop.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, 9)
+
+
+@pytest.mark.asyncio
+async def test_connect_creates_separate_pools():
+    command_client = AsyncMock()
+    blocking_client = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, connection_url=VALID_CONNECTION_URL, max_connections=20, blocking_max_connections=4)
+
+    with patch("src.message_queue.redis_queue.create_redis_client", side_effect=[command_client, blocking_client]) as create_mock:
+        assert await queue.connect() is True
+
+    create_mock.assert_any_call(VALID_CONNECTION_URL, 20)
+    create_mock.assert_any_call(VALID_CONNECTION_URL, 4, blocking=True)
+    command_client.ping.assert_called_once()
+    assert queue.get_blocking_client() is blocking_client
+
+
+@pytest.mark.asyncio
+async def test_failed_connect_reuses_and_closes_pools():
+    command_client = AsyncMock()
+    blocking_client = AsyncMock()
+    command_client.ping.side_effect = RedisError("Connection refused")
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, connection_url=VALID_CONNECTION_URL, max_retries=REDIS_MAX_RETRIES, retry_delay=0)
+
+    with patch("src.message_queue.redis_queue.create_redis_client", side_effect=[command_client, blocking_client]) as create_mock:
+        assert await queue.connect() is False
+
+    assert create_mock.call_count == 2
+    assert command_client.ping.await_count == REDIS_MAX_RETRIES
+    command_client.aclose.assert_awaited_once()
+    blocking_client.aclose.assert_awaited_once()
+    assert queue.redis_client is None
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_backs_off_after_consecutive_failures():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, retry_delay=REDIS_RETRY_DELAY_SECONDS)
+    redis_mock.blpop.side_effect = RedisError("Connection lost")
+
+    with patch("src.message_queue.redis_queue.asyncio.sleep", new=AsyncMock()) as sleep_mock:
+        for _ in range(3):
+            assert await queue.subscribe_batch() == []
+
+    delays = [call.args[0] for call in sleep_mock.call_args_list]
+    assert REDIS_RETRY_DELAY_SECONDS / 2 <= delays[0] <= REDIS_RETRY_DELAY_SECONDS
+    assert REDIS_RETRY_DELAY_SECONDS * 2 <= delays[2] <= REDIS_RETRY_DELAY_SECONDS * 4
+
+
+@pytest.mark.asyncio
+async def test_publish_with_priority_uses_priority_lane():
+    redis_mock = AsyncMock()
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)
+
+    await queue.publish(VALID_TEST_MESSAGE, priority=2)
+
+    pipe.rpush.assert_called_once_with(f"{REDIS_MESSAGE_QUEUE_NAME}:priority:2", VALID_TEST_MESSAGE)
+    pipe.ltrim.assert_called_once_with(f"{REDIS_MESSAGE_QUEUE_NAME}:priority:2", -REDIS_MESSAGE_QUEUE_MAX_SIZE, -1)
+
+
+def mock_push_if_room(redis_mock, *results):
+    script = AsyncMock(side_effect=list(results))
+    redis_mock.register_script = MagicMock(return_value=script)
+    return script
+
+
+@pytest.mark.asyncio
+async def test_publish_counts_dropped_messages():
+    redis_mock = AsyncMock()
+    pipe = mock_pipeline(redis_mock)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE)
+    pipe.execute.return_value = [REDIS_MESSAGE_QUEUE_MAX_SIZE + 1, True]
+
+    assert await queue.publish(VALID_TEST_MESSAGE) is True
+
+    assert queue.dropped_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_publish_reject_new_raises_when_queue_is_full():
+    redis_mock = AsyncMock()
+    script = mock_push_if_room(redis_mock, 0)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                       overflow_policy="reject_new")
+
+    with pytest.raises(QueueFullError):
+        await queue.publish(VALID_TEST_MESSAGE)
+
+    script.assert_awaited_once_with(keys=[REDIS_MESSAGE_QUEUE_NAME], args=[REDIS_MESSAGE_QUEUE_MAX_SIZE, "", 1, VALID_TEST_MESSAGE])
+    redis_mock.rpush.assert_not_called()
+    redis_mock.ltrim.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_publish_many_reject_new_pushes_when_there_is_room():
+    redis_mock = AsyncMock()
+    script = mock_push_if_room(redis_mock, 1)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                       overflow_policy="reject_new")
+
+    assert await queue.publish_many([VALID_TEST_MESSAGE] * 2) is True
+
+    script.assert_awaited_once_with(keys=[REDIS_MESSAGE_QUEUE_NAME],
+                                    args=[REDIS_MESSAGE_QUEUE_MAX_SIZE, "", 2, VALID_TEST_MESSAGE, VALID_TEST_MESSAGE])
+
+
+@pytest.mark.asyncio
+async def test_publish_block_waits_for_room():
+    redis_mock = AsyncMock()
+    script = mock_push_if_room(redis_mock, 0, 0, 1)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, overflow_policy="block", overflow_block_timeout=1)
+
+    with patch("src.message_queue.overflow.asyncio.sleep", new=AsyncMock()) as sleep_mock:
+        assert await queue.publish(VALID_TEST_MESSAGE) is True
+
+    assert script.await_count == 3
+    assert sleep_mock.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_publish_block_raises_after_timeout():
+    redis_mock = AsyncMock()
+    mock_push_if_room(redis_mock, *([0] * 100))
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, overflow_policy="block", overflow_block_timeout=0.05)
+
+    with pytest.raises(QueueFullError):
+        await queue.publish(VALID_TEST_MESSAGE)
+
+
+def test_unknown_overflow_policy_is_rejected():
+    with pytest.raises(ValueError):
+        RedisQueue(REDIS_MESSAGE_QUEUE_NAME, overflow_policy="drop_newest")
+
+
+KEYED_TEST_MESSAGE=json.dumps({"type": "test", "content": "test_message", "idempotency_key": "order-1"})
+
+
+@pytest.mark.asyncio
+async def test_publish_many_with_idempotency_keys_uses_script():
+    redis_mock = AsyncMock()
+    script = mock_push_if_room(redis_mock, [1, 0])
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE, idempotency_window=60)
+
+    assert await queue.publish_many([KEYED_TEST_MESSAGE, VALID_TEST_MESSAGE], checkpoint=("checkpoint", 7), idempotency_keys=["order-1", None]) is True
+
+    script.assert_awaited_once_with(keys=[REDIS_MESSAGE_QUEUE_NAME, f"{REDIS_MESSAGE_QUEUE_NAME}:idempotency:order-1", "checkpoint"],
+                                    args=[REDIS_MESSAGE_QUEUE_MAX_SIZE, 7, 0, 60, 1, 2, 1, KEYED_TEST_MESSAGE, 0, VALID_TEST_MESSAGE])
+    redis_mock.pipeline.assert_not_called()
+    assert queue.duplicate_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_publish_with_idempotency_key_counts_trimmed_messages():
+    redis_mock = AsyncMock()
+    mock_push_if_room(redis_mock, [1, 2])
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+
+    assert await queue.publish(KEYED_TEST_MESSAGE, idempotency_key="order-1") is True
+
+    assert queue.dropped_messages == 2
+    assert queue.duplicate_messages == 0
+
+
+@pytest.mark.asyncio
+async def test_publish_with_idempotency_key_reject_new_raises_when_queue_is_full():
+    redis_mock = AsyncMock()
+    script = mock_push_if_room(redis_mock, -1)
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                       overflow_policy="reject_new", idempotency_window=60)
+
+    with pytest.raises(QueueFullError):
+        await queue.publish(KEYED_TEST_MESSAGE, idempotency_key="order-1")
+
+    assert script.await_args.kwargs["args"][:5] == [REDIS_MESSAGE_QUEUE_MAX_SIZE, "", 1, 60, 1]
+
+
+EXPIRED_TEST_MESSAGE=json.dumps({"expires_at": 1, "type": "test", "content": "expired_message"})
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_drops_expired_messages():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    redis_mock.blpop.return_value = (REDIS_MESSAGE_QUEUE_NAME, EXPIRED_TEST_MESSAGE)
+    redis_mock.lpop.return_value = [VALID_TEST_MESSAGE, EXPIRED_TEST_MESSAGE]
+
+    result = await queue.subscribe_batch(3, raw=True)
+
+    assert result == [VALID_TEST_MESSAGE]
+    assert queue.expired_messages == 2
+
+
+@pytest.mark.asyncio
+async def test_subscribe_skips_expired_messages():
+    redis_mock = AsyncMock()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock)
+    redis_mock.blpop.side_effect = [(REDIS_MESSAGE_QUEUE_NAME, EXPIRED_TEST_MESSAGE), (REDIS_MESSAGE_QUEUE_NAME, VALID_TEST_MESSAGE)]
+
+    result = await queue.subscribe()
+
+    assert result == json.loads(VALID_TEST_MESSAGE)
+    assert redis_mock.blpop.await_count == 2
+    assert queue.expired_messages == 1
+
+
+@pytest.mark.asyncio
+async def test_type_keys_cannot_collide_with_internal_keys():
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_client = fakeredis.aioredis.FakeRedis()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client, max_retries=1)
+
+    for message_type in ("types", "dead", "delayed", "orders"):
+        assert await queue.publish(json.dumps({"type": message_type, "content": "test"}), message_type) is True
+
+    assert await redis_client.type(f"{REDIS_MESSAGE_QUEUE_NAME}:types") == b"set"
+    assert not await redis_client.exists(f"{REDIS_MESSAGE_QUEUE_NAME}:dead", f"{REDIS_MESSAGE_QUEUE_NAME}:delayed")
+    # Every read pops from one type key.
+    messages = []
+    for _ in range(4):
+        messages += await queue.subscribe_batch(max_count=10, subscribe_timeout=0.1, message_types=["*"])
+    assert sorted(message["type"] for message in messages) == ["dead", "delayed", "orders", "types"]
+
+
+@pytest.mark.asyncio
+async def test_queue_size_counts_type_keys_and_lanes():
+    fakeredis = pytest.importorskip("fakeredis")
+    redis_client = fakeredis.aioredis.FakeRedis()
+    queue = RedisQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_client, max_retries=1)
+
+    assert await queue.publish_many([VALID_TEST_MESSAGE] * 3, ["orders", "orders", None], [0, 1, 0]) is True
+
+    assert await queue.get_queue_size() == 3
@@ -0,0 +1,94 @@
+import pytest
+import json
+from unittest.mock import AsyncMock, MagicMock
+from src.message_queue.redis_stream_queue import RedisStreamQueue, STREAM_ENTRY_ID_KEY
+
+REDIS_MAX_RETRIES=3
+REDIS_MESSAGE_QUEUE_MAX_SIZE=50
+VALID_TEST_MESSAGE=json.dumps({"type": "test", "content": "test_message"})
+REDIS_MESSAGE_QUEUE_NAME="test_stream"
+CONSUMER_GROUP="test_group"
+CONSUMER_NAME="test_consumer"
+
+
+def create_queue(redis_mock, **kwargs):
+    return RedisStreamQueue(REDIS_MESSAGE_QUEUE_NAME, redis_client=redis_mock, max_queue_size=REDIS_MESSAGE_QUEUE_MAX_SIZE,
+                            consumer_group=CONSUMER_GROUP, consumer_name=CONSUMER_NAME, retry_delay=0, **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_publish_many_uses_approximate_trimming():
+    redis_mock = AsyncMock()
+    pipe = MagicMock()
+    pipe.__aenter__.return_value = pipe
+    pipe.execute = AsyncMock()
+    redis_mock.pipeline = MagicMock(return_value=pipe)
+    queue = create_queue(redis_mock)
+
+    result = await queue.publish_many([VALID_TEST_MESSAGE] * 2)
+
+    assert result is True
+    assert pipe.xadd.call_count == 2
+    pipe.xadd.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, {"data": VALID_TEST_MESSAGE},
+                                 maxlen=REDIS_MESSAGE_QUEUE_MAX_SIZE, approximate=True)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_reads_through_consumer_group():
+    redis_mock = AsyncMock()
+    redis_mock.xautoclaim.return_value = [b"0-0", [], []]
+    redis_mock.xreadgroup.return_value = [[REDIS_MESSAGE_QUEUE_NAME, [(b"1-0", {b"data": VALID_TEST_MESSAGE})]]]
+    queue = create_queue(redis_mock)
+
+    result = await queue.subscribe_batch(max_count=10, subscribe_timeout=2)
+
+    assert result == [{**json.loads(VALID_TEST_MESSAGE), STREAM_ENTRY_ID_KEY: "1-0"}]
+    lanes = [f"{REDIS_MESSAGE_QUEUE_NAME}:priority:2", f"{REDIS_MESSAGE_QUEUE_NAME}:priority:1", REDIS_MESSAGE_QUEUE_NAME]
+    redis_mock.xreadgroup.assert_called_with(CONSUMER_GROUP, CONSUMER_NAME, {lane: ">" for lane in lanes},
+                                             count=10, block=2000)
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_returns_reclaimed_messages_first():
+    redis_mock = AsyncMock()
+    # One call per priority lane, highest first; only the default lane has a stale entry.
+    redis_mock.xautoclaim.side_effect = [[b"0-0", [], []], [b"0-0", [], []],
+                                         [b"0-0", [(b"1-0", {b"data": VALID_TEST_MESSAGE})], []]]
+    queue = create_queue(redis_mock)
+
+    result = await queue.subscribe_batch(max_count=10)
+
+    assert [message[STREAM_ENTRY_ID_KEY] for message in result] == ["1-0"]
+    redis_mock.xreadgroup.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_ack():
+    redis_mock = AsyncMock()
+    queue = create_queue(redis_mock)
+
+    result = await queue.ack([{"type": "test", STREAM_ENTRY_ID_KEY: "1-0"}, {"type": "test", STREAM_ENTRY_ID_KEY: "2-0"}])
+
+    assert result is True
+    redis_mock.xack.assert_called_with(REDIS_MESSAGE_QUEUE_NAME, CONSUMER_GROUP, "1-0", "2-0")
+
+
+def test_only_drop_oldest_overflow_policy_is_supported():
+    with pytest.raises(ValueError):
+        RedisStreamQueue(REDIS_MESSAGE_QUEUE_NAME, overflow_policy="reject_new")
+
+
+@pytest.mark.asyncio
+async def test_subscribe_batch_acks_expired_entries():
+    redis_mock = AsyncMock()
+    queue = create_queue(redis_mock)
+    redis_mock.xautoclaim.return_value = [b"0-0", [], []]
+    expired_message = json.dumps({"expires_at": 1, "type": "test", "content": "expired_message"})
+    redis_mock.xreadgroup.return_value = [[REDIS_MESSAGE_QUEUE_NAME, [(b"1-0", {b"data": expired_message}),
+                                                                      (b"2-0", {b"data": VALID_TEST_MESSAGE})]]]
+
+    messages = await queue.subscribe_batch(10)
+
+    assert [message[STREAM_ENTRY_ID_KEY] for message in messages] == ["2-0"]
+    redis_mock.xack.assert_awaited_once_with(REDIS_MESSAGE_QUEUE_NAME, CONSUMER_GROUP, b"1-0")
+    assert queue.expired_messages == 1
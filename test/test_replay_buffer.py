@@ -0,0 +1,64 @@
+import json
+
+from src.message_queue.codec import MessageCodec
+from src.service_b.replay_buffer import ReplayBuffer, create_replay_buffer, stamp_offset
+
+FIRST_OFFSET = 1000
+TEST_MESSAGES = [{"type": "test", "content": f"message {i}"} for i in range(5)]
+
+
+def test_offsets_are_consecutive():
+    buffer = ReplayBuffer(max_size=10, first_offset=FIRST_OFFSET)
+
+    stamped = [buffer.append(message) for message in TEST_MESSAGES]
+
+    assert [message["offset"] for message in stamped] == list(range(FIRST_OFFSET, FIRST_OFFSET + len(TEST_MESSAGES)))
+    assert buffer.last_offset == FIRST_OFFSET + len(TEST_MESSAGES) - 1
+    assert "offset" not in TEST_MESSAGES[0]
+
+
+def test_read_after_returns_only_the_gap():
+    buffer = ReplayBuffer(max_size=10, first_offset=FIRST_OFFSET)
+    stamped = [buffer.append(message) for message in TEST_MESSAGES]
+
+    assert buffer.read_after(FIRST_OFFSET + 2) == stamped[3:]
+    assert buffer.read_after(buffer.last_offset) == []
+    assert buffer.read_after(buffer.last_offset + 100) == []
+
+
+def test_offset_older_than_the_window_gets_the_whole_window():
+    buffer = ReplayBuffer(max_size=3, first_offset=FIRST_OFFSET)
+    stamped = [buffer.append(message) for message in TEST_MESSAGES]
+
+    assert buffer.read_after(FIRST_OFFSET - 50) == stamped[-3:]
+
+
+def test_default_offsets_start_from_the_clock():
+    earlier, later = ReplayBuffer(), ReplayBuffer()
+
+    assert later.next_offset >= earlier.next_offset > 0
+
+
+def test_json_payloads_are_stamped_as_text():
+    assert stamp_offset('{"type": "test", "content": "a"}', 7) == '{"type": "test", "content": "a","offset":7}'
+    assert stamp_offset(b'{"type":"test"}\n', 7) == '{"type":"test","offset":7}'
+    assert stamp_offset("{}", 7) == '{"offset":7}'
+    # A field of the same name is overridden by the stamp.
+    assert json.loads(stamp_offset('{"offset": 1}', 7))["offset"] == 7
+
+
+def test_encoded_payloads_are_decoded_and_stamped():
+    codec = MessageCodec(compression="zlib", compression_threshold=0)
+    payload = codec.encode(TEST_MESSAGES[0])
+
+    assert stamp_offset(payload, 7) == {**TEST_MESSAGES[0], "offset": 7}
+
+
+def test_resuming_defaults_to_on_only_in_broadcast_mode(caplog):
+    assert create_replay_buffer(None, "hub", "broadcast").messages.maxlen > 0
+    assert create_replay_buffer(0, "hub", "broadcast") is None
+    assert create_replay_buffer(None, "hub", "competing") is None
+    assert "Resuming" not in caplog.text
+
+    assert create_replay_buffer(100, "hub", "competing") is None
+    assert "Resuming needs the hub in broadcast mode" in caplog.text
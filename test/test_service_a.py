@@ -1,7 +1,12 @@
+import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, patch
 import json
+import src.service_a.app as service_a
 from src.service_a.app import app, message_publisher
+from src.service_a.rate_limiter import TokenBucketRateLimiter
+from src.message_queue.overflow import QueueFullError
+from src.utils.config import QUEUE_FULL_RETRY_AFTER_SECONDS
 
 client = TestClient(app)
 
@@ -9,6 +14,16 @@ MESSAGE_MAX_CONTENT_LENGTH = 512
 
 valid_payload={"type": "test", "content": "test queue"}
 
+ENQUEUED_AT = 1700000000.0
+
+@pytest.fixture(autouse=True)
+def fixed_time():
+    with patch.object(service_a.time, "time", return_value=ENQUEUED_AT):
+        yield
+
+def envelope(payload):
+    return {"enqueued_at": ENQUEUED_AT, **payload}
+
 def test_produce_message_success():
     message_publisher.publish = AsyncMock(return_value=True)
     response = client.post("/messages", json=valid_payload)
@@ -17,6 +32,41 @@ def test_produce_message_success():
     assert response.json() == {"status": "success", "detail": "Message queued"}
     message_publisher.publish.assert_called_once()
 
+def test_produce_message_idempotency_key_header():
+    message_publisher.publish = AsyncMock(return_value=True)
+    response = client.post("/messages", json=valid_payload, headers={"Idempotency-Key": "order-1"})
+
+    assert response.status_code == 200
+    serialized_message, _, _, idempotency_key, _ = message_publisher.publish.call_args.args
+    assert json.loads(serialized_message) == envelope({**valid_payload, "idempotency_key": "order-1"})
+    assert idempotency_key == "order-1"
+
+def test_produce_message_with_ttl():
+    message_publisher.publish = AsyncMock(return_value=True)
+    response = client.post("/messages", json={**valid_payload, "ttl_seconds": 30, "deadline": ENQUEUED_AT + 60})
+
+    assert response.status_code == 200
+    serialized_message = message_publisher.publish.call_args.args[0]
+    assert serialized_message.startswith(json.dumps({"expires_at": ENQUEUED_AT + 30})[:-1])
+    assert json.loads(serialized_message) == {"expires_at": ENQUEUED_AT + 30, **envelope(valid_payload)}
+
+def test_produce_message_past_deadline():
+    response = client.post("/messages", json={**valid_payload, "deadline": ENQUEUED_AT})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "deadline has already passed"
+
+def test_produce_message_sampled_trace():
+    message_publisher.publish = AsyncMock(return_value=True)
+    with patch.object(service_a.tracer, "sample_rate", 1.0), patch.object(service_a.tracer, "exporter") as exporter_mock:
+        response = client.post("/messages", json=valid_payload)
+
+    assert response.status_code == 200
+    message = json.loads(message_publisher.publish.call_args.args[0])
+    trace_id, stages = exporter_mock.export.call_args.args
+    assert message["trace"]["id"] == trace_id
+    assert [name for name, _, _ in stages] == ["service_a.handle", "service_a.publish"]
+
 def test_produce_message_empty_content():
     payload = {"type": "test", "content": ""}
     response = client.post("/messages", json=payload)
@@ -45,3 +95,138 @@ def test_produce_message_publish_failure():
 
     assert response.status_code == 500
     assert response.json()["detail"] == "Failed to publish the message"
+
+def test_produce_messages_batch_success():
+    message_publisher.publish_many = AsyncMock(return_value=True)
+    response = client.post("/messages/batch", json=[valid_payload, valid_payload])
+
+    assert response.status_code == 200
+    assert response.json() == {"status": "success", "detail": "2 messages queued"}
+    message_publisher.publish_many.assert_called_once_with([json.dumps(envelope(valid_payload))] * 2, None, None, None, ["test", "test"])
+
+def test_produce_messages_batch_invalid_message():
+    message_publisher.publish_many = AsyncMock(return_value=True)
+    response = client.post("/messages/batch", json=[valid_payload, {"type": "test", "content": ""}])
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "message or type is empty"
+    message_publisher.publish_many.assert_not_called()
+
+def test_produce_messages_batch_publish_failure():
+    message_publisher.publish_many = AsyncMock(return_value=False)
+    response = client.post("/messages/batch", json=[valid_payload])
+
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Failed to publish the messages"
+
+def test_metrics_endpoint():
+    message_publisher.publish = AsyncMock(return_value=True)
+    client.post("/messages", json=valid_payload)
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE service_a_published_messages_total counter" in response.text
+
+def test_produce_message_with_priority():
+    message_publisher.publish = AsyncMock(return_value=True)
+    response = client.post("/messages", json={**valid_payload, "priority": 2})
+
+    assert response.status_code == 200
+    message_publisher.publish.assert_called_once_with(json.dumps(envelope({**valid_payload, "priority": 2})), None, 2, None, "test")
+
+def test_produce_message_invalid_priority():
+    message_publisher.publish = AsyncMock(return_value=True)
+    response = client.post("/messages", json={**valid_payload, "priority": 99})
+
+    assert response.status_code == 422
+    message_publisher.publish.assert_not_called()
+
+def test_produce_message_queue_full():
+    message_publisher.publish = AsyncMock(side_effect=QueueFullError("Queue is full"))
+    response = client.post("/messages", json=valid_payload)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(QUEUE_FULL_RETRY_AFTER_SECONDS)
+    assert response.json()["detail"] == "queue is full"
+
+def test_produce_messages_batch_queue_full():
+    message_publisher.publish_many = AsyncMock(side_effect=QueueFullError("Queue is full"))
+    response = client.post("/messages/batch", json=[valid_payload] * 3)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(QUEUE_FULL_RETRY_AFTER_SECONDS)
+
+def test_produce_message_rate_limited():
+    message_publisher.publish = AsyncMock(return_value=True)
+    with patch.object(service_a, "rate_limiter", TokenBucketRateLimiter(rate=1, burst=1)):
+        assert client.post("/messages", json=valid_payload).status_code == 200
+        response = client.post("/messages", json=valid_payload)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    message_publisher.publish.assert_called_once()
+
+def test_produce_messages_batch_rate_limited_per_type():
+    message_publisher.publish_many = AsyncMock(return_value=True)
+    with patch.object(service_a, "rate_limiter", TokenBucketRateLimiter(rate=1, burst=2)), \
+         patch.object(service_a, "RATE_LIMIT_KEY", "type"):
+        assert client.post("/messages/batch", json=[valid_payload] * 2).status_code == 200
+        assert client.post("/messages/batch", json=[valid_payload]).status_code == 429
+        response = client.post("/messages/batch", json=[{**valid_payload, "type": "other"}])
+
+    assert response.status_code == 200
+
+def test_produce_message_write_behind_accepted():
+    with patch.object(message_publisher, "write_behind", object()), \
+         patch.object(message_publisher, "enqueue_many", return_value=True) as enqueue_mock:
+        response = client.post("/messages", json=valid_payload)
+
+    assert response.status_code == 202
+    assert response.json() == {"status": "accepted", "detail": "Message accepted"}
+    enqueue_mock.assert_called_once_with([json.dumps(envelope(valid_payload))], [None], [0], [None], ["test"])
+
+def test_produce_messages_batch_write_behind_buffer_full():
+    with patch.object(message_publisher, "write_behind", object()), \
+         patch.object(message_publisher, "enqueue_many", return_value=False):
+        response = client.post("/messages/batch", json=[valid_payload] * 3)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(QUEUE_FULL_RETRY_AFTER_SECONDS)
+
+def ndjson(*records):
+    return "\n".join(record if isinstance(record, str) else json.dumps(record) for record in records).encode()
+
+def test_produce_message_stream_reports_invalid_lines():
+    message_publisher.publish_many = AsyncMock(return_value=True)
+    body = ndjson(valid_payload, {"type": "test", "content": ""}, "", "not json", valid_payload)
+
+    response = client.post("/messages/stream", content=body, headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["accepted"], result["rejected"], result["last_line"]) == (2, 2, 5)
+    assert [error["line"] for error in result["errors"]] == [2, 4]
+    assert result["errors"][0]["error"] == "message or type is empty"
+    message_publisher.publish_many.assert_called_once_with([json.dumps(envelope(valid_payload))] * 2, None, None, None, ["test", "test"])
+
+def test_produce_message_stream_queue_full():
+    message_publisher.publish_many = AsyncMock(side_effect=QueueFullError("full"))
+
+    response = client.post("/messages/stream", content=ndjson(valid_payload), headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(QUEUE_FULL_RETRY_AFTER_SECONDS)
+    assert (response.json()["accepted"], response.json()["last_line"]) == (0, 0)
+
+def test_produce_message_stream_empty():
+    response = client.post("/messages/stream", content=b"\n\n", headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "stream is empty"
+
+def test_produce_message_stream_msgpack_not_installed():
+    with patch.object(service_a, "msgpack", None):
+        response = client.post("/messages/stream", content=b"\x80", headers={"Content-Type": "application/msgpack"})
+
+    assert response.status_code == 415
@@ -0,0 +1,148 @@
+import pytest
+import os
+import json
+from unittest.mock import AsyncMock, patch
+from src.message_queue.spill_log import SpillLog, SpillReplayer
+from src.service_a.message_publisher import MessagePublisher
+
+VALID_TEST_MESSAGE = json.dumps({"type": "test", "content": "test_message"})
+REDIS_MESSAGE_QUEUE_NAME = "test_queue"
+SEGMENT_MAX_BYTES = 200
+
+
+def open_spill_log(directory):
+    spill_log = SpillLog(str(directory), segment_max_bytes=SEGMENT_MAX_BYTES, fsync_interval=0)
+    spill_log.open()
+    return spill_log
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith("segment-"))
+
+
+def create_queue_mock(checkpoint=None):
+    queue_mock = AsyncMock()
+    queue_mock.queue_name = REDIS_MESSAGE_QUEUE_NAME
+    queue_mock.redis_client.get.return_value = checkpoint
+    queue_mock.publish_many.return_value = True
+    return queue_mock
+
+
+@pytest.mark.asyncio
+async def test_records_are_read_back_in_order(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+
+    await spill_log.append_many([VALID_TEST_MESSAGE, b"\x00binary"], ["test", None], [2, 0], ["order-1", None])
+    records = spill_log.read_batch(10)
+
+    assert [tuple(record) for record in records] == [(1, VALID_TEST_MESSAGE, "test", 2, "order-1"), (2, b"\x00binary", None, 0, None)]
+
+
+@pytest.mark.asyncio
+async def test_segments_rotate_and_replayed_segments_are_deleted(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+    for _ in range(10):
+        await spill_log.append_many([VALID_TEST_MESSAGE])
+    assert len(segment_files(tmp_path)) > 2
+
+    spill_log.mark_replayed(10)
+
+    assert len(segment_files(tmp_path)) == 1
+    assert spill_log.is_active() is False
+
+
+@pytest.mark.asyncio
+async def test_reopen_truncates_torn_tail_and_keeps_progress(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+    await spill_log.append_many([VALID_TEST_MESSAGE] * 3)
+    spill_log.mark_replayed(1)
+    await spill_log.close()
+    with open(os.path.join(tmp_path, segment_files(tmp_path)[-1]), "ab") as segment_file:
+        segment_file.write(b"\x00\x00\x00\x09torn")
+
+    spill_log = open_spill_log(tmp_path)
+
+    assert [record.sequence for record in spill_log.read_batch(10)] == [2, 3]
+    await spill_log.append_many([VALID_TEST_MESSAGE])
+    assert [record.sequence for record in spill_log.read_batch(10)] == [2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_replay_publishes_batches_with_checkpoint(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+    await spill_log.append_many([VALID_TEST_MESSAGE] * 3, ["test"] * 3)
+    queue_mock = create_queue_mock()
+    replayer = SpillReplayer(spill_log, queue_mock, batch_size=2)
+
+    assert await replayer.replay_batch() is True
+    assert await replayer.replay_batch() is True
+
+    calls = queue_mock.publish_many.await_args_list
+    assert [call.args[0] for call in calls] == [[VALID_TEST_MESSAGE] * 2, [VALID_TEST_MESSAGE]]
+    assert calls[1].kwargs["checkpoint"] == (replayer.checkpoint_key, 3)
+    assert spill_log.is_active() is False
+
+
+@pytest.mark.asyncio
+async def test_replay_skips_records_already_in_redis(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+    await spill_log.append_many([json.dumps({"content": str(index)}) for index in range(3)])
+    queue_mock = create_queue_mock(checkpoint=b"2")
+
+    await SpillReplayer(spill_log, queue_mock).replay_batch()
+
+    queue_mock.publish_many.assert_awaited_once()
+    assert queue_mock.publish_many.await_args.args[0] == [json.dumps({"content": "2"})]
+
+
+@pytest.mark.asyncio
+async def test_failed_replay_keeps_records(tmp_path):
+    spill_log = open_spill_log(tmp_path)
+    await spill_log.append_many([VALID_TEST_MESSAGE])
+    queue_mock = create_queue_mock()
+    queue_mock.publish_many.return_value = False
+
+    assert await SpillReplayer(spill_log, queue_mock).replay_batch() is False
+    assert spill_log.get_pending_count() == 1
+
+
+@pytest.mark.asyncio
+async def test_publisher_spills_when_redis_is_unavailable(tmp_path):
+    queue_mock = create_queue_mock()
+    queue_mock.connect.return_value = False
+    publisher = MessagePublisher(queue_mock, auto_batch=False, write_behind=False,
+                                 spill_log=SpillLog(str(tmp_path), fsync_interval=0))
+
+    assert await publisher.connect() is True
+    await publisher.spill_replayer.stop()
+    assert await publisher.publish(VALID_TEST_MESSAGE) is True
+
+    queue_mock.publish.assert_not_called()
+    assert publisher.spill_log.get_pending_count() == 1
+    await publisher.disconnect()
+
+
+def test_publisher_with_a_spill_log_does_not_retry(tmp_path):
+    with patch("src.service_a.message_publisher.create_queue") as create_queue:
+        MessagePublisher(auto_batch=False, write_behind=False, spill_log=SpillLog(str(tmp_path)))
+        MessagePublisher(auto_batch=False, write_behind=False, spill=False)
+
+    assert create_queue.call_args_list[0].kwargs == {"max_retries": 1}
+    assert create_queue.call_args_list[1].kwargs == {}
+
+
+@pytest.mark.asyncio
+async def test_write_behind_batches_are_spilled_when_redis_fails(tmp_path):
+    queue_mock = create_queue_mock()
+    queue_mock.publish_many.return_value = False
+    publisher = MessagePublisher(queue_mock, auto_batch=False, write_behind=True,
+                                 spill_log=SpillLog(str(tmp_path), fsync_interval=0))
+    await publisher.connect()
+    await publisher.spill_replayer.stop()
+
+    assert publisher.enqueue_many([VALID_TEST_MESSAGE] * 3) is True
+    await publisher.write_behind.close()
+
+    assert publisher.get_buffer_depth() == 0
+    assert publisher.spill_log.get_pending_count() == 3
+    await publisher.disconnect()
@@ -0,0 +1,71 @@
+import pytest
+import asyncio
+from src.service_a.stream_ingest import ChunkedPublisher, read_ndjson, read_msgpack
+
+MAX_LINE_BYTES = 16
+
+
+async def stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect(records):
+    return [record async for record in records]
+
+
+@pytest.mark.asyncio
+async def test_read_ndjson_joins_lines_split_across_chunks():
+    records = await collect(read_ndjson(stream(b'{"a"', b': 1}\n\n{"b": 2}\n{"c"', b': 3}'), MAX_LINE_BYTES))
+
+    assert records == [(1, b'{"a": 1}'), (3, b'{"b": 2}'), (4, b'{"c": 3}')]
+
+
+@pytest.mark.asyncio
+async def test_read_ndjson_drops_long_lines_without_buffering_them():
+    long_line = b"x" * (MAX_LINE_BYTES + 1)
+
+    records = await collect(read_ndjson(stream(long_line, long_line, b"\n{}\n", long_line), MAX_LINE_BYTES))
+
+    assert records == [(1, None), (2, b"{}"), (3, None)]
+
+
+@pytest.mark.asyncio
+async def test_read_msgpack_yields_objects():
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({"a": 1}) + msgpack.packb({"b": 2})
+
+    records = await collect(read_msgpack(stream(body[:3], body[3:]), MAX_LINE_BYTES))
+
+    assert records == [(1, {"a": 1}), (2, {"b": 2})]
+
+
+@pytest.mark.asyncio
+async def test_chunked_publisher_publishes_in_order():
+    published = []
+
+    async def publish(records):
+        await asyncio.sleep(0)
+        published.append(records)
+
+    publisher = ChunkedPublisher(publish, chunk_size=2)
+    for line in range(1, 6):
+        await publisher.add(line, line)
+    await publisher.flush()
+
+    assert published == [[1, 2], [3, 4], [5]]
+    assert (publisher.accepted, publisher.last_line) == (5, 5)
+
+
+@pytest.mark.asyncio
+async def test_chunked_publisher_stops_at_the_first_failure():
+    async def publish(records):
+        if 3 in records:
+            raise RuntimeError("queue is full")
+
+    publisher = ChunkedPublisher(publish, chunk_size=2)
+    with pytest.raises(RuntimeError):
+        for line in range(1, 7):
+            await publisher.add(line, line)
+
+    assert (publisher.accepted, publisher.last_line) == (2, 2)
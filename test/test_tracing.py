@@ -0,0 +1,93 @@
+import pytest
+import json
+from unittest.mock import MagicMock
+from src.message_queue.expiry import build_envelope
+from src.utils.tracing import Tracer, JsonTraceExporter, create_exporter, otel_trace
+
+NOW = 1700000000.0
+TEST_MESSAGE = {"type": "test", "content": "test_message"}
+
+
+def create_tracer(**kwargs):
+    tracer = Tracer(sample_rate=1.0, **kwargs)
+    tracer.exporter = MagicMock()
+    return tracer
+
+
+def test_start_trace_respects_sample_rate():
+    assert Tracer(sample_rate=0).start_trace() is None
+
+    trace = create_tracer().start_trace(NOW)
+
+    assert len(trace["id"]) == 32
+    assert trace["received_at"] == NOW
+
+
+def test_finish_publish_exports_service_a_stages():
+    tracer = create_tracer()
+    trace = tracer.start_trace(NOW)
+
+    tracer.finish_publish([trace, None], NOW + 1)
+
+    trace_id, stages = tracer.exporter.export.call_args.args
+    assert trace_id == trace["id"]
+    assert [(name, start) for name, start, _ in stages] == [("service_a.handle", NOW), ("service_a.publish", NOW + 1)]
+
+
+def test_consumed_message_exports_service_b_stages():
+    tracer = create_tracer()
+    trace = tracer.start_trace(NOW)
+    payload = json.dumps(build_envelope(TEST_MESSAGE, NOW, trace=trace))
+
+    tracer.on_dequeued([payload, json.dumps(TEST_MESSAGE)])
+    assert len(tracer.pending) == 1
+    tracer.on_sent([payload], NOW + 2)
+
+    trace_id, stages = tracer.exporter.export.call_args.args
+    assert trace_id == trace["id"]
+    assert [name for name, _, _ in stages] == ["queue.wait", "service_b.dispatch", "websocket.send"]
+    assert stages[0][1] == NOW
+    assert not tracer.pending
+
+
+def test_untraced_payloads_are_not_decoded():
+    tracer = create_tracer()
+    tracer.codec = MagicMock()
+
+    tracer.on_dequeued([json.dumps(build_envelope({**TEST_MESSAGE, "content": "trace"}, NOW))])
+
+    tracer.codec.decode.assert_not_called()
+    assert not tracer.pending
+
+
+def test_pending_traces_are_bounded():
+    tracer = create_tracer(max_pending=2)
+    messages = [build_envelope(TEST_MESSAGE, NOW, trace=tracer.start_trace(NOW)) for _ in range(3)]
+
+    tracer.on_dequeued(messages)
+
+    assert [entry[0] for entry in tracer.pending.values()] == messages[1:]
+
+
+def test_json_exporter_appends_one_line_per_trace(tmp_path):
+    exporter = JsonTraceExporter(str(tmp_path / "traces" / "traces.jsonl"))
+
+    exporter.export("a" * 32, [("websocket.send", NOW, NOW + 0.5)])
+    exporter.export("b" * 32, [("websocket.send", NOW, NOW + 0.25)])
+    exporter.close()
+
+    lines = (tmp_path / "traces" / "traces.jsonl").read_text().splitlines()
+    assert [json.loads(line)["trace_id"] for line in lines] == ["a" * 32, "b" * 32]
+    assert json.loads(lines[0])["spans"] == [{"name": "websocket.send", "start": NOW, "end": NOW + 0.5, "duration": 0.5}]
+
+
+def test_unknown_exporter_is_rejected():
+    with pytest.raises(ValueError):
+        create_exporter("zipkin")
+
+
+def test_otel_exporter_requires_opentelemetry():
+    if otel_trace is not None:
+        pytest.skip("opentelemetry is installed")
+    with pytest.raises(ValueError):
+        create_exporter("otel")
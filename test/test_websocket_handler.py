@@ -0,0 +1,124 @@
+import pytest
+import json
+from unittest.mock import AsyncMock, MagicMock
+from starlette.websockets import WebSocketState
+import src.websocket.websocket_handler as websocket_handler
+from src.websocket.websocket_handler import WebSocketHandler
+
+TEST_MESSAGES = [{"type": "test", "content": f"message {i}"} for i in range(3)]
+
+
+def create_handler(subprotocols, **kwargs):
+    websocket = AsyncMock()
+    websocket.client_state = WebSocketState.CONNECTED
+    websocket.application_state = WebSocketState.CONNECTED
+    websocket.scope = {"subprotocols": subprotocols}
+    return WebSocketHandler(websocket, **kwargs)
+
+
+def sent_frames(handler):
+    return [call.args[0] for call in handler.websocket.send_text.await_args_list]
+
+
+def test_first_supported_subprotocol_is_selected():
+    assert WebSocketHandler.select_subprotocol(["chat", "mq.ndjson", "mq.json-array"]) == "mq.ndjson"
+    assert WebSocketHandler.select_subprotocol(["chat"]) is None
+
+
+def test_msgpack_is_not_offered_without_the_package(monkeypatch):
+    monkeypatch.setattr(websocket_handler, "msgpack", None)
+
+    assert WebSocketHandler.select_subprotocol(["mq.msgpack", "mq.json-array"]) == "mq.json-array"
+
+
+@pytest.mark.asyncio
+async def test_without_subprotocol_every_message_is_a_frame():
+    handler = create_handler([])
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES)
+
+    handler.websocket.accept.assert_awaited_once_with(subprotocol=None)
+    assert [json.loads(frame) for frame in sent_frames(handler)] == TEST_MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_json_array_coalesces_messages_into_one_frame():
+    handler = create_handler(["mq.json-array"])
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES + [json.dumps(TEST_MESSAGES[0])])
+
+    handler.websocket.accept.assert_awaited_once_with(subprotocol="mq.json-array")
+    assert [json.loads(frame) for frame in sent_frames(handler)] == [TEST_MESSAGES + TEST_MESSAGES[:1]]
+
+
+@pytest.mark.asyncio
+async def test_ndjson_frames_respect_the_message_limit():
+    handler = create_handler(["mq.ndjson"], max_batch_messages=2)
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES + ['{\n"type": "test"}'])
+
+    frames = sent_frames(handler)
+    assert len(frames) == 2
+    assert [json.loads(line) for frame in frames for line in frame.split("\n")] == TEST_MESSAGES + [{"type": "test"}]
+
+
+@pytest.mark.asyncio
+async def test_frames_respect_the_byte_limit():
+    handler = create_handler(["mq.json-array"], max_batch_bytes=len(json.dumps(TEST_MESSAGES[0])) * 2)
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES)
+
+    assert [len(json.loads(frame)) for frame in sent_frames(handler)] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_msgpack_sends_binary_frames():
+    msgpack = pytest.importorskip("msgpack")
+    handler = create_handler(["mq.msgpack"])
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES)
+
+    frame = handler.websocket.send_bytes.await_args.args[0]
+    assert msgpack.unpackb(frame) == TEST_MESSAGES
+
+
+@pytest.mark.asyncio
+async def test_send_messages_fails_when_disconnected():
+    handler = create_handler(["mq.json-array"])
+    await handler.accept_connection()
+    handler.websocket.client_state = WebSocketState.DISCONNECTED
+
+    with pytest.raises(RuntimeError):
+        await handler.send_messages(TEST_MESSAGES)
+
+
+@pytest.mark.asyncio
+async def test_failed_send_leaves_the_socket_unusable():
+    handler = create_handler([])
+    await handler.accept_connection()
+    assert handler.is_connected()
+
+    # Starlette marks its side disconnected when the send fails; the client side is only updated by a receive.
+    handler.websocket.application_state = WebSocketState.DISCONNECTED
+
+    assert not handler.is_connected()
+    await handler.close_connection()
+    handler.websocket.close.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_sent_messages_are_reported_to_the_tracer(monkeypatch):
+    tracer_mock = MagicMock()
+    monkeypatch.setattr(websocket_handler, "tracer", tracer_mock)
+    handler = create_handler(["mq.json-array"])
+    await handler.accept_connection()
+
+    await handler.send_messages(TEST_MESSAGES)
+
+    tracer_mock.on_sent.assert_called_once()
+    assert tracer_mock.on_sent.call_args.args[0] == TEST_MESSAGES
@@ -0,0 +1,96 @@
+import pytest
+import asyncio
+import json
+from unittest.mock import AsyncMock
+from src.message_queue.write_behind_buffer import WriteBehindBuffer
+from src.message_queue.overflow import QueueFullError
+
+VALID_TEST_MESSAGE = json.dumps({"type": "test", "content": "test_message"})
+BUFFER_MAX_SIZE = 10
+BATCH_MAX_SIZE = 4
+
+
+def create_buffer(queue_mock, **kwargs):
+    return WriteBehindBuffer(queue_mock, max_size=BUFFER_MAX_SIZE, max_batch_size=BATCH_MAX_SIZE, retry_delay=0, **kwargs)
+
+
+async def wait_until_empty(buffer):
+    while buffer.get_depth():
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_buffered_messages_are_flushed_in_batches():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.return_value = True
+    buffer = create_buffer(queue_mock)
+    messages = [json.dumps({"type": "test", "content": str(index)}) for index in range(6)]
+
+    assert buffer.offer_many(messages) is True
+    await buffer.start()
+    await asyncio.wait_for(wait_until_empty(buffer), timeout=1)
+    await buffer.close()
+
+    assert [call.args[0] for call in queue_mock.publish_many.await_args_list] == [messages[:4], messages[4:]]
+
+
+@pytest.mark.asyncio
+async def test_offer_is_rejected_when_buffer_is_full():
+    buffer = create_buffer(AsyncMock())
+
+    assert buffer.offer_many([VALID_TEST_MESSAGE] * BUFFER_MAX_SIZE) is True
+    assert buffer.offer(VALID_TEST_MESSAGE) is False
+    assert buffer.get_depth() == BUFFER_MAX_SIZE
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_in_order():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.side_effect = [False, QueueFullError("Queue is full"), True]
+    buffer = create_buffer(queue_mock)
+
+    buffer.offer(VALID_TEST_MESSAGE, "test", 1)
+    await buffer.start()
+    await asyncio.wait_for(wait_until_empty(buffer), timeout=1)
+    await buffer.close()
+
+    assert queue_mock.publish_many.await_count == 3
+    queue_mock.publish_many.assert_awaited_with([VALID_TEST_MESSAGE], ["test"], [1], idempotency_keys=None, partition_keys=None)
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_remaining_messages():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.return_value = True
+    buffer = create_buffer(queue_mock)
+    await buffer.start()
+
+    buffer.offer_many([VALID_TEST_MESSAGE] * 3)
+    await buffer.close()
+
+    assert buffer.get_depth() == 0
+    assert buffer.offer(VALID_TEST_MESSAGE) is False
+
+
+@pytest.mark.asyncio
+async def test_close_gives_up_after_shutdown_timeout():
+    queue_mock = AsyncMock()
+    queue_mock.publish_many.return_value = False
+    buffer = create_buffer(queue_mock, shutdown_timeout=0.05)
+    await buffer.start()
+
+    buffer.offer(VALID_TEST_MESSAGE)
+    await buffer.close()
+
+    assert buffer.get_depth() == 1
+
+
+@pytest.mark.asyncio
+async def test_oldest_age_tracks_first_buffered_message():
+    buffer = create_buffer(AsyncMock())
+
+    assert buffer.get_oldest_age() == 0
+    buffer.offer(VALID_TEST_MESSAGE)
+    await asyncio.sleep(0.01)
+
+    assert buffer.get_oldest_age() >= 0.01